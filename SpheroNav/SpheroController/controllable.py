@@ -68,6 +68,10 @@ class ControllableSphero(TraceableSphero):
         self._setup_sphero()
 
     def _setup_sphero(self):
+        # Stale roll, rgb and back led commands are replaced by newer ones
+        self.device.coalescing = True
+        # A dropped link is connected again and the settings below are sent again
+        self.device.auto_reconnect = True
         self.device.set_option_flags(
             motion_timeout=True,
             tail_led=True,
@@ -33,6 +33,12 @@ class SpheroVectorController(object):
         self.achieved_fps = None
         self._time_delta = 1.0 / DEFAULT_UPDATE_RATE
 
+        # ACKNOWLEDGEMENTS
+        # Only every n-th roll command is acknowledged by the device, the rest are sent without waiting
+        # for a response. The acknowledged commands are used as probes to estimate delivery. 1 acks all.
+        self.ack_interval = 1
+        self._num_cmds = 0
+
         # MOVEMENT
         self._vector = Vector2D(0, 0)
         self._last_vector = self._vector.copy()
@@ -185,12 +191,26 @@ class SpheroVectorController(object):
                 if self.device.connected():
                 # TODO catch all exceptions from sphero and handle them!!!
                     #print "ROLL CMD", speed, direction
-                    self.device.roll(speed, direction)
+                    self._roll(speed, direction)
                     self._last_speed = speed
                     self._last_direction = direction
 
                 #self._last_vector = self._vector.copy()
 
+    def _roll(self, speed, direction):
+        """
+        Helper method: sends the roll command, acknowledged or not as set by ack_interval
+        """
+        if self.ack_interval > 1:
+            probe = self._num_cmds % self.ack_interval == 0
+            self.device.roll(speed, direction, ack=probe, block=False)
+        elif self.device.coalescing:
+            # Latest-wins, an unsent roll is replaced by this one
+            self.device.roll(speed, direction, block=False)
+        else:
+            self.device.roll(speed, direction)
+        self._num_cmds += 1
+
     def _update_heading(self):
         """
         Helper method: Updates the state of the class and calculates the new heading.
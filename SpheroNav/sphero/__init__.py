@@ -2,9 +2,23 @@
 TEST mordi
 """
 from core import SpheroAPI
+from future import ResponseFuture
 from constants import *
 from manager import SpheroManager
+from reactor import SpheroReactor
 from error import *
 from streaming import SensorStreamingConfig, SensorStreamingResponse
+from history import SensorHistory
+from telemetry import TelemetryRecorder, TelemetryLog
+from fusion import PoseEstimator
+from ratecontrol import StreamingRateController
+from rtt import RttEstimator
+from subscription import StreamingSubscription
+from dispatcher import CallbackDispatcher, LoopDispatcher
+from shadow import DeviceShadow
+from exporter import MetricsServer, prometheus_text
+from transport import Transport, RfcommTransport, LoopbackTransport
+from simulator import SimulatedSphero, SimulatedTransport
+from capture import CapturingTransport, ReplayTransport, WireCapture
 from util import device_to_host_angle, host_to_device_angle
 
@@ -0,0 +1,357 @@
+# coding: utf-8
+"""
+Sphero API driven by an asyncio event loop.
+
+Requires trollius, the asyncio port for python 2. Commands are coroutines and are awaited with
+``yield From(...)``
+"""
+import time
+
+import trollius as asyncio
+from trollius import From, Return
+
+from core import SpheroAPI
+from dispatcher import LoopDispatcher
+from error import SpheroError, SpheroConnectionError, SpheroDeadlineError, SpheroTimeoutError
+
+
+class RequestFuture(asyncio.Future):
+    """
+    asyncio future for the response of a request sent to the device
+    """
+
+    def __init__(self, packet, loop=None):
+        super(RequestFuture, self).__init__(loop=loop)
+        self.request = packet
+        self.sent_at = None
+        self.deadline = None
+
+    @property
+    def seq(self):
+        return self.request.seq
+
+    def set_result(self, result):
+        # The waiter may have given up on the request before the response arrived
+        if not self.done():
+            super(RequestFuture, self).set_result(result)
+
+    def set_exception(self, exception):
+        if not self.done():
+            super(RequestFuture, self).set_exception(exception)
+
+
+class SensorStream(object):
+    """
+    Stream of sensor data received from the device.
+
+    Usage in a coroutine:
+        stream = device.sensor_stream()
+        while True:
+            data = yield From(stream.get())
+    """
+
+    def __init__(self, device, maxsize=0, loop=None):
+        """
+        :param device: The device the data is streamed from
+        :type device: AsyncSpheroAPI
+        :param maxsize: Max number of samples kept, the oldest samples are dropped when the stream is full.
+        0 keeps all samples
+        """
+        super(SensorStream, self).__init__()
+        self._device = device
+        self._queue = asyncio.Queue(maxsize=maxsize, loop=loop)
+        self.dropped = 0
+
+    def put(self, streaming_data):
+        """
+        Helper method: adds a received sample to the stream
+        """
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(streaming_data)
+
+    @asyncio.coroutine
+    def get(self):
+        """
+        Returns the next sample from the stream, waits until a sample is received
+        :rtype: streaming.SensorStreamingResponse
+        """
+        data = yield From(self._queue.get())
+        raise Return(data)
+
+    def close(self):
+        """
+        Stops receiving samples to this stream
+        """
+        self._device.close_sensor_stream(self)
+
+
+class AsyncSpheroAPI(SpheroAPI):
+    """
+    A SpheroAPI that is driven by an asyncio event loop instead of receiver threads.
+
+    The connection is registered as a reader in the event loop, so a single thread can run many devices.
+    All commands return coroutines that are awaited with ``yield From(device.roll(50, 0))``. The collision,
+    power and streaming callbacks are run in the event loop, see dispatcher.LoopDispatcher
+    """
+
+    expire_interval = 0.1
+    coroutine_commands = True
+
+    def __init__(self, bt_name=None, bt_addr=None, transport=None, loop=None, dispatcher=None):
+        """
+        :param loop: The event loop to run the device in, defaults to the current event loop
+        :param dispatcher: Runs the collision, power and streaming callbacks. Defaults to a dispatcher that
+        runs them in the event loop
+        :type dispatcher: sphero.dispatcher.CallbackDispatcher
+        """
+        loop = loop if loop is not None else asyncio.get_event_loop()
+        if dispatcher is None:
+            dispatcher = LoopDispatcher(loop)
+        super(AsyncSpheroAPI, self).__init__(bt_name, bt_addr, transport, dispatcher=dispatcher)
+        self._loop = loop
+        self._window = asyncio.Semaphore(self.max_in_flight, loop=self._loop)
+        self._expire_handle = None
+        self._sensor_streams = []
+
+    @asyncio.coroutine
+    def connect(self, retries=10):
+        """
+        Connect the sphero device
+        :param retries: Number of connection retries
+        """
+        if self.bt_addr is None:
+            raise SpheroError("No device address is set for the connection")
+
+        if self._connecting:
+            raise SpheroError("Device is already trying to connect")
+
+        if self.connected():
+            raise Return(True)
+
+        self._connecting = True
+        try:
+            for _ in xrange(retries):
+                try:
+                    yield From(self._loop.run_in_executor(None, self._transport.connect, self.bt_addr))
+                    break
+                except SpheroConnectionError:
+                    yield From(asyncio.sleep(1.0, loop=self._loop))
+            else:
+                raise SpheroConnectionError('Failed to connect after %d retries. Is the device turned on?' % retries)
+        finally:
+            self._connecting = False
+
+        self._connection = self._transport
+        self._receiver_crashed = False
+        self._frame_parser.reset()
+        self._loop.add_reader(self._connection.fileno(), self._on_readable)
+        self._expire_handle = self._loop.call_later(self.expire_interval, self._expire)
+        raise Return(True)
+
+    def disconnect(self):
+        """
+        Closes the sphero connection
+        :return: True if the connection was closed
+        """
+        if self._connection is None:
+            return False
+
+        self._stop_reading()
+        self._connection.close()
+        self._connection = None
+        error = SpheroConnectionError('Device is not connected')
+        self._scheduler.clear(error)
+        self._fail_pending(error)
+        # The device may be reset before it is connected again
+        self.shadow.clear()
+        return True
+
+    def _stop_reading(self):
+        self._loop.remove_reader(self._connection.fileno())
+        if self._expire_handle is not None:
+            self._expire_handle.cancel()
+            self._expire_handle = None
+
+    def _on_readable(self):
+        """
+        Helper method that is triggered by the event loop when data can be received from the device
+        """
+        if super(AsyncSpheroAPI, self)._on_readable():
+            return True
+        if self._connection is not None:
+            self._stop_reading()
+        return False
+
+    def _expire(self):
+        self._expire_pending()
+        self._expire_handle = self._loop.call_later(self.expire_interval, self._expire)
+
+    def _create_future(self, packet):
+        future = RequestFuture(packet, loop=self._loop)
+        future.add_done_callback(self._on_request_done)
+        return future
+
+    def _on_request_done(self, future):
+        missed_deadline = not future.cancelled() and isinstance(future.exception(), SpheroDeadlineError)
+        if not missed_deadline or future.sent_at is None:
+            # A request that missed its deadline stays pending, so a late response is counted
+            self._pop_pending(future.seq, future)
+        self._window.release()
+
+    @asyncio.coroutine
+    def _write(self, packet, block=True, ack=True, force=False, deadline=None):
+        """
+        Sends a message to the connected device.
+
+        All commands accept the options of this method as keyword arguments.
+        :param packet: The request to send. A subclass of the Request class
+        :type packet: request.Request
+        :param block: Set to False to return the future response as soon as the request is sent
+        :param ack: Set to False to ask the device to not respond, see SpheroAPI._write
+        :param force: Set to True to send the request even if the shadow shows that the device already has
+        the value
+        :param deadline: Time (as time.time()) the response is useless after, see SpheroAPI._write
+        :return: A response class, or a RequestFuture if block is False
+        :rtype: response.Response or RequestFuture
+        """
+        if self._is_redundant(packet, force):
+            if not ack:
+                raise Return(None)
+            answer = self.shadow.answer(packet)
+            if block:
+                raise Return(answer)
+            future = RequestFuture(packet, loop=self._loop)
+            future.set_result(answer)
+            raise Return(future)
+
+        if not ack:
+            if deadline is not None and time.time() > deadline:
+                self.deadline_stats.dropped[type(packet).__name__] += 1
+                raise SpheroDeadlineError('Dropped, the deadline passed before it was sent')
+            self._send_unacknowledged(packet)
+            raise Return(None)
+
+        attempts = 1 + (self.max_retries if packet.idempotent else 0)
+        for attempt in xrange(attempts):
+            if attempt:
+                self.retries[type(packet).__name__] += 1
+                packet = self._copy_request(packet)
+            yield From(self._window.acquire())
+            try:
+                future = self.send_async(packet, deadline)
+            except SpheroError:
+                self._window.release()
+                raise
+
+            if packet.allow_no_answer and not attempt:
+                self._track_probe(future)
+            if not block:
+                raise Return(future)
+
+            timeout = self._timeout_for(packet)
+            missed_deadline = deadline is not None and deadline - time.time() < timeout
+            if missed_deadline:
+                timeout = max(0.0, deadline - time.time())
+            try:
+                yield From(asyncio.wait_for(asyncio.shield(future, loop=self._loop), timeout, loop=self._loop))
+            except asyncio.TimeoutError:
+                if missed_deadline:
+                    future.set_exception(SpheroDeadlineError('No response received from device before the '
+                                                             'deadline'))
+                else:
+                    self._time_out(future)
+            if not isinstance(future.exception(), SpheroTimeoutError):
+                break
+        raise Return(future.result())
+
+    @asyncio.coroutine
+    def resync_shadow(self, **options):
+        options['force'] = True
+        responses = []
+        for request_class, data in self.shadow.items():
+            response = yield From(self._write(request_class(self.seq, *data), **options))
+            responses.append(response)
+        raise Return(responses)
+
+    @asyncio.coroutine
+    def subscribe(self, keys, callback, max_rate=None, **options):
+        """
+        Coroutine, see SpheroAPI.subscribe
+        """
+        subscription, ssc = self._subscriptions.add(keys, callback, max_rate)
+        yield From(self.set_data_streaming(ssc, **options))
+        raise Return(subscription)
+
+    @asyncio.coroutine
+    def unsubscribe(self, subscription, **options):
+        """
+        Coroutine, see SpheroAPI.unsubscribe
+        """
+        ssc = self._subscriptions.remove(subscription)
+        if ssc is not None:
+            yield From(self.set_data_streaming(ssc, **options))
+
+    @asyncio.coroutine
+    def get_device_name(self):
+        info = yield From(self.get_bluetooth_info())
+        raise Return(info.name)
+
+    # SENSOR STREAMING
+
+    def sensor_stream(self, maxsize=0):
+        """
+        Creates a stream of the sensor data received from the device.
+        set_data_streaming() must be called to activate sensor streaming on the Sphero device
+        :param maxsize: Max number of samples kept in the stream, 0 for no limit
+        :rtype: SensorStream
+        """
+        stream = SensorStream(self, maxsize, loop=self._loop)
+        self._sensor_streams.append(stream)
+        return stream
+
+    def close_sensor_stream(self, stream):
+        """
+        Stops receiving sensor data to the given stream
+        :type stream: SensorStream
+        """
+        try:
+            self._sensor_streams.remove(stream)
+        except ValueError:
+            pass
+
+    def _on_streaming(self, streaming_data):
+        super(AsyncSpheroAPI, self)._on_streaming(streaming_data)
+        for stream in self._sensor_streams:
+            stream.put(streaming_data)
+
+
+if __name__ == "__main__":
+    # DRIVES A SIMULATED FLEET FROM ONE THREAD
+    from simulator import SimulatedTransport
+    from streaming import SensorStreamingConfig
+
+    @asyncio.coroutine
+    def run_device(device):
+        yield From(device.connect())
+        ping = yield From(device.ping())
+        print device.bt_name, "ping:", ping.success
+
+        ssc = SensorStreamingConfig()
+        ssc.sample_rate = 10
+        ssc.stream_imu_angle()
+        yield From(device.set_data_streaming(ssc))
+
+        stream = device.sensor_stream()
+        for _ in xrange(5):
+            data = yield From(stream.get())
+            print device.bt_name, data.imu
+        stream.close()
+
+        yield From(device.stop_data_streaming())
+        device.disconnect()
+
+    main_loop = asyncio.get_event_loop()
+    fleet = [AsyncSpheroAPI("Sphero-SIM%d" % i, "00:00:00:00:00:0%d" % i, SimulatedTransport()) for i in xrange(5)]
+    main_loop.run_until_complete(asyncio.wait([run_device(device) for device in fleet]))
@@ -0,0 +1,265 @@
+# coding: utf-8
+"""
+Capture of the raw data exchanged with a Sphero device, and replay of captured data.
+
+File format:
+    The MAGIC bytes, followed by one chunk for each call to send or recv on the transport. A chunk is a
+    header of the direction, the monotonic time in seconds and the length, followed by the raw bytes.
+"""
+import socket
+import struct
+import threading
+import time
+
+import request
+from error import SpheroError
+from streaming import SensorStreamingConfig
+from transport import Transport
+from util import monotonic
+
+MAGIC = 'SPHCAP\x00\x01'
+
+RECEIVED = 0
+SENT = 1
+
+# direction, timestamp, length
+_chunk_header = struct.Struct('<BdI')
+# sop1, sop2, did, cid, seq, dlen
+_request_header = struct.Struct('6B')
+
+
+class CapturingTransport(Transport):
+    """
+    Transport that writes all data sent and received through another transport to a capture file
+    """
+
+    def __init__(self, transport, path):
+        """
+        :param transport: The transport that is captured
+        :type transport: Transport
+        :param path: The capture file, an existing file is overwritten when the transport is first connected.
+        When it is connected again, e.g. after the connection was lost, the capture is appended to the file
+        """
+        super(CapturingTransport, self).__init__()
+        self.transport = transport
+        self.path = path
+        self._file = None
+        self._started = False
+        self._lock = threading.Lock()
+
+    def connect(self, address):
+        self.transport.connect(address)
+        with self._lock:
+            if self._file is None and self._started:
+                self._file = open(self.path, 'ab')
+            elif self._file is None:
+                self._file = open(self.path, 'wb')
+                self._file.write(MAGIC)
+                self._started = True
+
+    def send(self, data):
+        self._capture(SENT, data)
+        self.transport.send(data)
+
+    def recv(self, size):
+        data = self.transport.recv(size)
+        self._capture(RECEIVED, data)
+        return data
+
+    def fileno(self):
+        return self.transport.fileno()
+
+    def close(self):
+        self.transport.close()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _capture(self, direction, data):
+        if not data:
+            return
+        with self._lock:
+            if self._file is not None:
+                self._file.write(_chunk_header.pack(direction, monotonic(), len(data)))
+                self._file.write(data)
+
+
+class WireCapture(object):
+    """
+    A capture file read into memory
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The capture file
+        :raise SpheroError: If the file is not a capture file
+        """
+        super(WireCapture, self).__init__()
+        self.path = path
+        self.chunks = []
+        """ :type chunks: list of (direction, timestamp, data)"""
+
+        with open(path, 'rb') as capture_file:
+            if capture_file.read(len(MAGIC)) != MAGIC:
+                raise SpheroError("Not a capture file: %s" % path)
+            while True:
+                header = capture_file.read(_chunk_header.size)
+                if len(header) < _chunk_header.size:
+                    break
+                direction, timestamp, length = _chunk_header.unpack(header)
+                data = capture_file.read(length)
+                if len(data) < length:
+                    # The capture was not closed properly
+                    break
+                self.chunks.append((direction, timestamp, data))
+
+    def received(self):
+        """
+        :return: The chunks received from the device
+        :rtype: list of (timestamp, data)
+        """
+        return [(timestamp, data) for direction, timestamp, data in self.chunks if direction == RECEIVED]
+
+    def sent(self):
+        """
+        :return: The chunks sent to the device
+        :rtype: list of (timestamp, data)
+        """
+        return [(timestamp, data) for direction, timestamp, data in self.chunks if direction == SENT]
+
+    @property
+    def bytes_received(self):
+        return sum(len(data) for _, data in self.received())
+
+    @property
+    def duration(self):
+        """
+        Seconds from the first to the last captured chunk
+        :rtype: float
+        """
+        if not self.chunks:
+            return 0.0
+        return self.chunks[-1][1] - self.chunks[0][1]
+
+    def streaming_config(self):
+        """
+        Rebuilds the streaming config from the last SetDataStreaming request in the capture that streams
+        sensor data. Requests that stop streaming, with empty masks, are skipped, as a capture normally ends
+        with one. Use it with SpheroAPI.use_streaming_config() to decode replayed sensor data
+        :return: The streaming config, or None if no streaming was configured in the capture
+        :rtype: SensorStreamingConfig or None
+        """
+        ssc = None
+        body = struct.Struct(request.SetDataStreaming.fmt)
+        stream = ''.join(data for _, data in self.sent())
+        i = 0
+        while i + _request_header.size <= len(stream):
+            sop1, sop2, did, cid, seq, dlen = _request_header.unpack_from(stream, i)
+            if sop1 != request.Request.SOP1 or sop2 | request.Request.SOP2_ANSWER != request.Request.SOP2:
+                # Not the start of a request
+                i += 1
+                continue
+            is_streaming_request = (did, cid) == (request.SetDataStreaming.did, request.SetDataStreaming.cid)
+            if is_streaming_request and i + _request_header.size + body.size <= len(stream):
+                n, m, mask1, num_packets, mask2 = body.unpack_from(stream, i + _request_header.size)
+                if mask1 or mask2:
+                    ssc = SensorStreamingConfig()
+                    ssc.n, ssc.m, ssc.mask1, ssc.num_packets, ssc.mask2 = n, m, mask1, num_packets, mask2
+            i += _request_header.size + dlen
+        return ssc
+
+
+class ReplayTransport(Transport):
+    """
+    Transport that plays back the data received in a capture, as if it was received from a device.
+
+    Data sent through the transport is discarded. Replay starts when start() is called, so the device can
+    be prepared after it is connected.
+    """
+
+    def __init__(self, capture, speed=1.0, hangup=False):
+        """
+        :param capture: The capture to replay
+        :type capture: WireCapture
+        :param speed: Playback speed relative to the captured timing, None to replay as fast as possible
+        :type speed: float or None
+        :param hangup: Close the connection when all data is replayed, as a device that disconnects
+        """
+        super(ReplayTransport, self).__init__()
+        self.capture = capture
+        self.speed = speed
+        self.hangup = hangup
+
+        self._socket = None
+        self._peer = None
+        self._started = threading.Event()
+        self.finished = threading.Event()
+        self.bytes_delivered = 0
+        self._replay_thread = None
+
+    def connect(self, address):
+        self._socket, self._peer = socket.socketpair()
+        self.bytes_delivered = 0
+        self.finished.clear()
+        self._replay_thread = threading.Thread(target=self._replay, name="ReplayThread")
+        self._replay_thread.daemon = True
+        self._replay_thread.start()
+
+    def start(self):
+        """
+        Starts the replay of the captured data
+        """
+        self._started.set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until all captured data is replayed
+        :return: True if the replay is finished
+        """
+        return self.finished.wait(timeout)
+
+    def send(self, data):
+        pass
+
+    def recv(self, size):
+        try:
+            data = self._socket.recv(size)
+        except (socket.error, AttributeError) as e:
+            raise SpheroError("Failed to receive data from device:" + str(e))
+        self.bytes_delivered += len(data)
+        return data
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def close(self):
+        self._started.set()
+        for sock in (self._socket, self._peer):
+            if sock is not None:
+                sock.close()
+        self._socket = None
+        self._peer = None
+
+    def _replay(self):
+        """
+        Helper method that writes the captured data to the connection, runs in the replay thread
+        """
+        self._started.wait()
+        peer = self._peer
+        chunks = self.capture.received()
+        try:
+            if chunks:
+                start = time.time()
+                first = chunks[0][0]
+                for timestamp, data in chunks:
+                    if self.speed:
+                        delay = (timestamp - first) / self.speed - (time.time() - start)
+                        if delay > 0:
+                            time.sleep(delay)
+                    peer.sendall(data)
+            if self.hangup:
+                peer.shutdown(socket.SHUT_WR)
+        except (socket.error, AttributeError):
+            pass
+        self.finished.set()
@@ -2,21 +2,39 @@
 """
 Sphero API Module
 """
-import bluetooth
-import struct
 from threading import Thread, Event
+from collections import Counter
+import functools
+import logging
 import threading
 import time
 import select
 
 import request
 import response
-from response import AsyncMsg
+from response import AsyncMsg, AsyncIdCode
 from response import Response
+from framing import FrameParser
+from history import SensorHistory
+from fusion import PoseEstimator
+from ratecontrol import StreamingRateController
+from subscription import SubscriptionManager
+from dispatcher import CallbackDispatcher, EVENT_COLLISION, EVENT_POWER, EVENT_STREAMING
+from shadow import DeviceShadow
+from telemetry import TelemetryRecorder
+from future import ResponseFuture
+from metrics import DeadlineStats, DeliveryStats, ProtocolMetrics, ReconnectStats, StreamingStats
+from rtt import RttEstimator
+from scheduler import CommandScheduler
+from transport import RfcommTransport
+from capture import CapturingTransport
 from sphero import streaming
-from error import SpheroError, SpheroConnectionError, SpheroFatalError, SpheroRequestError
+from error import SpheroError, SpheroConnectionError, SpheroFatalError, SpheroRequestError, SpheroTimeoutError
+from error import SpheroDeadlineError
 from constants import MotorMode
 
+logger = logging.getLogger(__name__)
+
 
 class SpheroAPI(object):
     """
@@ -25,8 +43,48 @@ class SpheroAPI(object):
     """
 
     response_timeout = 25.0
-
-    def __init__(self, bt_name=None, bt_addr=None):
+    receive_chunk_size = 1024
+    # Set when the commands return coroutines instead of blocking, see sphero.aio
+    coroutine_commands = False
+    max_in_flight = 8
+    # Wait for responses as long as the timeout estimated from the measured round trip times, see timeout
+    adaptive_timeout = True
+    # Number of times an idempotent request is sent again after a timeout
+    max_retries = 2
+    # Shortest seconds to wait for the response of a request that is not idempotent, see _timeout_for
+    min_single_attempt_timeout = 5.0
+    # Seconds between the attempts to connect again after the connection was lost, doubled after each
+    # failed attempt up to max_reconnect_delay. None to try forever
+    reconnect_delay = 0.5
+    max_reconnect_delay = 30.0
+    max_reconnect_attempts = None
+
+    # The settings that are sent again when connected after the connection was lost, in this order. The
+    # locator and the streaming config are sent after these
+    REPLAYED_REQUESTS = (
+        request.SetOptionFlags,
+        request.SetMotionTimeout,
+        request.SetStabilization,
+        request.SetRotationRate,
+        request.ConfigureCollisionDetection,
+        request.SetPowerNotification,
+        request.SetRGB,
+        request.SetBackLEDOutput,
+    )
+
+    def __init__(self, bt_name=None, bt_addr=None, transport=None, reactor=None, dispatcher=None):
+        """
+        :param bt_name: The bluetooth name of the device
+        :param bt_addr: The bluetooth address of the device
+        :param transport: The connection used to communicate with the device, defaults to a RFCOMM connection
+        :type transport: sphero.transport.Transport
+        :param reactor: Shared receiver the device is registered to when connected. Defaults to a receiver
+        thread per device
+        :type reactor: sphero.reactor.SpheroReactor
+        :param dispatcher: Runs the collision, power and streaming callbacks. Defaults to a dispatcher with
+        one worker thread per device
+        :type dispatcher: sphero.dispatcher.CallbackDispatcher
+        """
         self._dev = 0x00
 
         self._seq = 0x00
@@ -35,30 +93,94 @@ class SpheroAPI(object):
         self.bt_name = bt_name
         self.bt_addr = bt_addr
 
-        self._bt_socket = None
+        self._transport = transport if transport is not None else RfcommTransport()
+        self._connection = None
         self._connecting = False
 
-        # FOR THE ASYNC RECEIVER
-        self._response_lock = threading.RLock()
+        # Connect again when the connection is lost, and set up the device as it was, see _reconnect()
+        self.auto_reconnect = False
+        self.reconnect_stats = ReconnectStats()
+        self._reconnecting = False
+        self._reconnect_lock = threading.Lock()
+        self._reconnect_cancelled = Event()
+        self._reconnect_thread = None
+        # The locator config of the last ConfigureLocator request the device accepted
+        self._locator_config = None
 
+        # FOR THE ASYNC RECEIVER
         self._receiver_crashed = False
         self._receiver_thread = None
         self._run_receive = True
-        self._packages = []
-        self._responses = []
+        self._reactor = reactor
+        self._frame_parser = FrameParser()
+
+        # Requests waiting for a response, by sequence number
+        self._pending = {}
+        self._pending_changed = threading.Condition(threading.RLock())
+
+        # Requests sent without asking the device for a response
+        self.delivery = DeliveryStats()
 
-        self._requests_waiting_response = {}
+        # Bytes and frames sent and received, and the round trip times of each command, see metrics()
+        self.protocol_metrics = ProtocolMetrics()
+
+        # Round trip times of the acknowledged requests, and the requests sent again after a timeout by type
+        self.rtt = RttEstimator(max_rto=self.response_timeout)
+        self.retries = Counter()
+
+        # Outbound scheduler with priority lanes. When coalescing is set, unsent Roll, SetRGB and
+        # SetBackLEDOutput requests are replaced by newer requests of the same type
+        self._scheduler = CommandScheduler(self)
+        self.coalescing = False
+
+        # Last accepted value of the settings of the device. When shadowing is set, requests that would not
+        # change a setting are answered from the shadow instead of being sent
+        self.shadow = DeviceShadow()
+        self.shadowing = True
+
+        # Triggered with the request when a request of the given type has succeeded
+        self._request_succeeded_cbs = {
+            request.SetDataStreaming: self._on_data_streaming_set,
+            request.ConfigureLocator: self._on_locator_configured,
+        }
 
         # Sensor streaming config
         self._ssc = None
+        self._streaming_layout = None
         self.sensors = None
         """ :type sensor_data: streaming.SensorStreamingResponse"""
-
-        # async callbacks
+        self.history = None
+        """ :type history: SensorHistory"""
+        self._recorder = None
+        self.pose_estimator = None
+        """ :type pose_estimator: PoseEstimator"""
+
+        # Received sensor data packets against the packets expected from the streaming config
+        self.streaming_stats = StreamingStats()
+        # Received sensor data packets that did not match the layout of the active streaming config
+        self.mismatched_streaming_packets = 0
+        # Times the frames of the streamed packets
+        self._sample_clock = streaming.SampleClock()
+        self.rate_controller = None
+        """ :type rate_controller: StreamingRateController"""
+
+        # Requests dropped before they were sent, and responses received after the deadline, by request type
+        self.deadline_stats = DeadlineStats()
+
+        # Subscriptions to single streamed values
+        self._subscriptions = SubscriptionManager(self)
+
+        # async callbacks, run by the dispatcher so they never block the receiver
+        self.dispatcher = dispatcher if dispatcher is not None else CallbackDispatcher()
         self._streaming_cb = None
         self._collision_cb = None
         self._power_state_cb = None
 
+        # Decoder and handler of the async messages, by async id code
+        self._async_handlers = self._default_async_handlers()
+        # Number of received async messages without a handler, by async id code
+        self.unhandled_async_msgs = Counter()
+
         # For the sphero manager
         self._is_taken = False
         self._take_lock = threading.RLock()
@@ -104,10 +226,12 @@ class SpheroAPI(object):
                 self._seq = 0x00
             return self._seq
 
-    def connect(self, retries=10):
+    def connect(self, retries=10, capture=None):
         """
         Connect the sphero device
         :param retries: Number of connection retries
+        :param capture: Path of a file to capture all raw data sent and received on the connection to,
+        see sphero.capture
         :return: None
         """
         if self.bt_addr is None:
@@ -122,6 +246,11 @@ class SpheroAPI(object):
 
         self._connecting = True
 
+        if isinstance(self._transport, CapturingTransport):
+            self._transport = self._transport.transport
+        if capture is not None:
+            self._transport = CapturingTransport(self._transport, capture)
+
         return self._connect(retries)
 
     def _connect(self, retries):
@@ -130,13 +259,14 @@ class SpheroAPI(object):
         """
         for _ in xrange(retries):
             try:
-                self._bt_socket = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
-                self._bt_socket.connect((self.bt_addr, 1))
+                self._transport.connect(self.bt_addr)
+                self._connection = self._transport
+                self._receiver_crashed = False
 
                 # If connection was established, start listening for incoming packages
                 self._start_receiver()
                 break
-            except bluetooth.btcommon.BluetoothError:
+            except SpheroConnectionError:
                 time.sleep(1.0)
         else:
             self._connecting = False
@@ -148,8 +278,12 @@ class SpheroAPI(object):
         """
         Starts the asynchronous package receiver
         """
-        if not self._receiver_thread:
-            self._run_receive = True
+        self._run_receive = True
+        if self._reactor is not None:
+            self._frame_parser.reset()
+            self._reactor.register(self)
+        elif not self._receiver_thread:
+            self._frame_parser.reset()
             self._receiver_thread = Thread(target=self._receiver, name="SpheroReceiverThread")
             self._receiver_thread.daemon = True
             self._receiver_thread.start()
@@ -158,18 +292,27 @@ class SpheroAPI(object):
         """
         Stops the asynchronous package receiver
         """
+        if self._reactor is not None:
+            self._reactor.unregister(self)
         self._run_receive = False
         self._receiver_thread = None
 
     def disconnect(self):
         """
-        Closes the sphero connection
+        Closes the sphero connection, and stops connecting again if the connection was lost
         :return: True if the connection was closed
         """
-        if self._bt_socket is not None:
+        if self._reconnecting:
+            self._reconnect_cancelled.set()
+            thread = self._reconnect_thread
+            if thread is not None and thread is not threading.current_thread():
+                thread.join()
+        if self._connection is not None:
             self._stop_receiver()
-            self._bt_socket.close()
-            self._bt_socket = None
+            self._connection.close()
+            self._connection = None
+            self._scheduler.clear(SpheroConnectionError('Device is not connected'))
+            self.shadow.clear()
             return True
         return False
 
@@ -178,124 +321,386 @@ class SpheroAPI(object):
         Returns a bool if the sphero is connected
         :return: True if the sphero is connected
         """
-        if self._bt_socket is not None and not self._connecting:
+        if self._connection is not None and not self._connecting:
             return True
         return False
 
-    def _get_request(self, seq):
+    @property
+    def in_flight(self):
         """
-        Helper method
-        Returns the request package with the given sequence number
-        Raises a indexError if the seq number does not exist
-        :param seq: The request sequence number
-        :raise: IndexError
-        :return: The request object
+        The number of requests sent to the device that are waiting for a response
+        :rtype: int
         """
-        return filter(lambda a: a.seq == seq, self._packages)[0]
+        return len(self._pending)
 
-    def _get_response(self, seq):
+    def _register_pending(self, future):
         """
-        Helper method
-        Returns the response package with the given sequence number
-        Raises a indexError if the seq number does not exist
-        :param seq: The response sequence number
-        :raise: IndexError
-        :return: The request object
+        Helper method: Registers a request that waits for a response
+        :type future: ResponseFuture
         """
-        with self._response_lock:
-            res = next((res for res in self._responses if res.seq == seq), None)
-            self._responses.remove(res)
-            return res
+        with self._pending_changed:
+            if future.seq in self._pending:
+                raise SpheroError("To many outgoing packages in send queue")
+            self._pending[future.seq] = future
 
-    def _clean_up_failed_request(self, packet):
-        try:
-            self._packages.remove(packet)
-        except ValueError:
-            pass
-        try:
-            self._requests_waiting_response.pop(packet.seq)
-        except KeyError:
-            pass
+    def _pop_pending(self, seq, future=None):
+        """
+        Helper method: Removes the request with the given sequence number from the requests waiting for a
+        response
+        :param seq: The sequence number of the request
+        :param future: Only remove the request if it belongs to this future
+        :return: The future of the request or None if no request is waiting with this sequence number
+        :rtype: ResponseFuture or None
+        """
+        with self._pending_changed:
+            pending = self._pending.get(seq)
+            if pending is None or (future is not None and pending is not future):
+                return None
+            del self._pending[seq]
+            self._pending_changed.notify_all()
+        self._scheduler.wake()
+        return pending
+
+    @property
+    def timeout(self):
+        """
+        Seconds to wait for the response of a request. The retransmission timeout of the measured round trip
+        times if adaptive_timeout is set, see sphero.rtt, else response_timeout
+        :rtype: float
+        """
+        if self.adaptive_timeout:
+            return min(self.rtt.rto, self.response_timeout)
+        return self.response_timeout
+
+    def _timeout_for(self, packet):
+        """
+        Helper method: Seconds to wait for the response of a request. Requests that are not idempotent are
+        never sent again, so they wait as long as all attempts of an idempotent request, and at least
+        min_single_attempt_timeout
+        :type packet: request.Request
+        :rtype: float
+        """
+        timeout = self.timeout
+        if packet.idempotent or not self.adaptive_timeout:
+            return timeout
+        return min(self.response_timeout, max(self.min_single_attempt_timeout, timeout * (1 + self.max_retries)))
+
+    def _expire_pending(self):
+        """
+        Helper method: Fails all requests that have waited longer than their timeout for a response
+        """
+        now = time.time()
+        with self._pending_changed:
+            # Requests being sent have no sent_at yet
+            expired = [future for future in self._pending.itervalues()
+                       if future.sent_at is not None and future.sent_at < now - self._timeout_for(future.request)]
+        for future in expired:
+            self._time_out(future)
+        if self._scheduler.queued:
+            self._scheduler.expire(self.response_timeout)
+
+    def _time_out(self, future):
+        """
+        Helper method: Fails a request that has waited longer than the timeout for a response
+        :type future: ResponseFuture
+        """
+        if self._pop_pending(future.seq, future) is not None:
+            self.rtt.backoff()
+        future.set_exception(SpheroTimeoutError('No response received from device before timeout'))
+
+    def _fail_pending(self, error):
+        """
+        Helper method: Fails all requests waiting for a response with the given error. The queued requests are
+        kept, they are sent when connected again after the connection was lost
+        """
+        with self._pending_changed:
+            seqs = self._pending.keys()
+        for seq in seqs:
+            future = self._pop_pending(seq)
+            if future is not None:
+                future.set_exception(error)
 
     def _send_package(self, packet):
         """
         Sends the given package to the connected sphero
         :param packet: The request package to send to the connected device
         """
-        event = Event()
-        if not self._requests_waiting_response.keys in [packet.seq]:
-            self._requests_waiting_response[packet.seq] = event
-            self._packages.append(packet)
-        else:
-            raise SpheroError("To many outgoing packages in send queue")
+        data = packet.encode()
+        self._connection.send(data)
+        self.protocol_metrics.on_sent(len(data))
 
-        try:
-            self._bt_socket.send(str(packet))
-        except bluetooth.BluetoothError as bt:
-            # self._clean_up_failed_request(packet)
-            raise SpheroConnectionError("Could not send msg, device is not connected", bt.message)
-        return event
+    def _create_future(self, packet):
+        """
+        Helper method: Creates the future for the response of the given request
+        :rtype: ResponseFuture
+        """
+        return ResponseFuture(packet)
 
-    def _write(self, packet):
+    def send_async(self, packet, deadline=None):
         """
-        Sends a message to the connected device
+        Sends a request to the connected device without waiting for the response.
+
+        Up to max_in_flight requests can wait for a response at the same time. While the send window is
+        full, requests are queued in the priority lane of their type, and motion requests are sent before
+        configuration and telemetry requests, see sphero.scheduler.
         :param packet: The request to send. A subclass of the Request class
         :type packet: request.Request
-        :return: A response class or :raise SpheroError: if no response received
-        :rtype: response.Response
+        :param deadline: Time (as time.time()) the request is dropped at if it is not sent yet, None for no
+        deadline
+        :type deadline: float
+        :return: The future response of the request
+        :rtype: ResponseFuture
 
         :raise SpheroConnectionError: If device is not connected
         """
-        if not self.connected():
+        if self._reconnecting:
+            # Queued until the device is connected and set up again
+            pass
+        elif not self.connected():
             raise SpheroConnectionError('Device is not connected')
-
-        if self._receiver_crashed:
+        elif self._receiver_crashed:
             raise SpheroError('FATAL Error, could not receive data from sphero. (receiver crashed)')
 
-        event = self._send_package(packet)
-        if event.wait(self.response_timeout):
-            res = self._get_response(packet.seq)
+        self.shadow.invalidate(packet)
+        future = self._create_future(packet)
+        future.deadline = deadline
+        self._scheduler.submit(packet, future, coalesce=self.coalescing)
+        return future
+
+    def metrics(self):
+        """
+        All counters and latencies of the device, see sphero.exporter for the Prometheus text format
+        :return: Dict of the metrics, by area
+        :rtype: dict
+        """
+        return {
+            'connected': self.connected(),
+            'protocol': self.protocol_metrics.as_dict(),
+            'framing': {
+                'discarded_bytes': self._frame_parser.discarded_bytes,
+                'resyncs': self._frame_parser.resyncs,
+                'checksum_errors': self._frame_parser.checksum_errors,
+            },
+            'queues': {
+                'in_flight': self.in_flight,
+                'queued': self._scheduler.queued,
+                'lanes': self.lane_stats(),
+                'callbacks_pending': self.dispatcher.pending(),
+            },
+            'callbacks': self.dispatcher.latency(),
+            'rtt': self.rtt.as_dict(),
+            'retries': dict(self.retries),
+            'deadlines': self.deadline_stats.as_dict(),
+            'reconnect': self.reconnect_stats.as_dict(),
+            'streaming': self.streaming_stats.as_dict(),
+        }
+
+    def lane_stats(self):
+        """
+        The number of queued requests and the time requests have waited to be sent, in each priority lane
+        :return: Dict of the counters by lane name, motion, configuration and telemetry
+        :rtype: dict
+        """
+        return self._scheduler.stats()
+
+    def _can_transmit(self):
+        """
+        Helper method used by the scheduler
+        :return: True if a request can be sent without waiting for room in the send window
+        :rtype: bool
+        """
+        return self.connected() and not self._reconnecting and len(self._pending) < self.max_in_flight
 
-            if res.success:
-                return res
-            else:
-                raise SpheroRequestError('Request failed: ' + res.msg)
+    def _transmit(self, packet, future):
+        """
+        Helper method used by the scheduler: Sends a queued request, that is registered as waiting for a
+        response with _register_pending
+        :type packet: request.Request
+        :type future: ResponseFuture
+        """
+        try:
+            self._send_pending(packet, future)
+        except SpheroConnectionError:
+            if not self.auto_reconnect:
+                raise
+            replaying = self._reconnecting
+            self._on_connection_lost()
+            if replaying:
+                raise
+            # Sent when connected again
+            self._scheduler.submit(packet, future)
+
+    def _send_pending(self, packet, future):
+        future.sent_at = time.time()
+        try:
+            self._send_package(packet)
+        except SpheroError:
+            self._pop_pending(packet.seq, future)
+            raise
+
+    def _send_unacknowledged(self, packet):
+        """
+        Sends a request to the connected device and asks the device to not respond to it
+        :param packet: The request to send, the type of request must allow no answer
+        :type packet: request.Request
+        :raise SpheroConnectionError: If device is not connected
+        """
+        if not packet.allow_no_answer:
+            raise SpheroError("The device must answer requests of type %s" % type(packet).__name__)
+
+        if self._reconnecting:
+            # Unacknowledged requests are not guaranteed to arrive, and are not queued while connecting
+            self.reconnect_stats.unacknowledged_dropped += 1
+            return
+
+        if not self.connected():
+            raise SpheroConnectionError('Device is not connected')
+
+        packet.answer = False
+        try:
+            self._send_package(packet)
+        except SpheroConnectionError:
+            if not self.auto_reconnect:
+                raise
+            self._on_connection_lost()
+            self.reconnect_stats.unacknowledged_dropped += 1
+            return
+        self.delivery.unacknowledged_sent += 1
+
+    def _track_probe(self, future):
+        """
+        Helper method: Counts an acknowledged request of a type that may be sent unacknowledged. These are
+        used to estimate the delivery of the unacknowledged requests.
+        :type future: ResponseFuture
+        """
+        self.delivery.probes_sent += 1
+        future.add_done_callback(self._on_probe_done)
+
+    def _on_probe_done(self, future):
+        if isinstance(future.exception(), SpheroTimeoutError):
+            self.delivery.probes_lost += 1
         else:
-            self._clean_up_failed_request(packet)
-            if self._receiver_crashed:
-                self.disconnect()
-                raise SpheroFatalError('FATAL Error, could not receive data from sphero. (receiver crashed)')
-            raise SpheroRequestError('No response received from device before timeout')
+            self.delivery.probes_acknowledged += 1
 
-    def _something_to_receive(self):
+    def _write(self, packet, block=True, ack=True, force=False, deadline=None):
+        """
+        Sends a message to the connected device.
+
+        All commands accept the options of this method as keyword arguments.
+        :param packet: The request to send. A subclass of the Request class
+        :type packet: request.Request
+        :param block: Set to False to return the future response instead of waiting for the response
+        :type block: bool
+        :param ack: Set to False to ask the device to not respond. Only allowed for the requests where
+        allow_no_answer is set (Roll, SetHeading and SetRGB). Nothing is returned.
+        :type ack: bool
+        :param force: Set to True to send the request even if the shadow shows that the device already has
+        the value
+        :type force: bool
+        :param deadline: Time (as time.time()) the response is useless after. The request is dropped if it is
+        still queued at the deadline, and a response received after the deadline is reported as late with
+        SpheroDeadlineError. None for no deadline
+        :type deadline: float
+        :return: A response class, or a ResponseFuture if block is False
+        :rtype: response.Response or ResponseFuture
+        :raise SpheroError: if no response received
+        :raise SpheroDeadlineError: if the deadline passed before the response was received
+
+        :raise SpheroConnectionError: If device is not connected
+
+        Requests wait for a response as long as the timeout estimated from the round trip times, see timeout.
+        Idempotent requests, see request.Request.idempotent, are sent again up to max_retries times when
+        they time out and block is set.
+        """
+        if self._is_redundant(packet, force):
+            if not ack:
+                return None
+            answer = self.shadow.answer(packet)
+            if block:
+                return answer
+            future = ResponseFuture(packet)
+            future.set_result(answer)
+            return future
+
+        if not ack:
+            if deadline is not None and time.time() > deadline:
+                self.deadline_stats.dropped[type(packet).__name__] += 1
+                raise SpheroDeadlineError('Dropped, the deadline passed before it was sent')
+            self._send_unacknowledged(packet)
+            return None
+
+        attempts = 1 + (self.max_retries if packet.idempotent else 0)
+        for attempt in xrange(attempts):
+            if attempt:
+                self.retries[type(packet).__name__] += 1
+                packet = self._copy_request(packet)
+            future = self.send_async(packet, deadline)
+            if packet.allow_no_answer and not attempt:
+                self._track_probe(future)
+            if not block:
+                return future
+            if not self._wait_response(future, deadline):
+                break
+        return future.result()
+
+    def _wait_response(self, future, deadline):
         """
-        Helper method Checks if there is something to receive from the bt_socket
-        :return Returns True if anything to receive from socket
+        Helper method: Waits for the response of a sent request
+        :type future: ResponseFuture
+        :return: True if the request timed out and can be sent again
         :rtype: bool
         """
-        ready_to_receive = select.select([self._bt_socket], [], [], 0.1)[0]
-        return self._bt_socket in ready_to_receive
+        timeout = self._timeout_for(future.request)
+        if deadline is not None and deadline - time.time() < timeout:
+            if not future.wait(max(0.0, deadline - time.time())):
+                # The request stays pending, a response that arrives later is counted as late
+                future.set_exception(SpheroDeadlineError('No response received from device before the deadline'))
+        elif not future.wait(timeout):
+            self._time_out(future)
+
+        if self._receiver_crashed and not self._reconnecting:
+            self.disconnect()
+            raise SpheroFatalError('FATAL Error, could not receive data from sphero. (receiver crashed)')
+        return isinstance(future.exception(), SpheroTimeoutError)
+
+    def _copy_request(self, packet):
+        """
+        Helper method: Creates a request with the same payload and a new sequence number, used when a request
+        is sent again. A late response to the first request can then not be mistaken for the new one
+        :type packet: request.Request
+        :rtype: request.Request
+        """
+        return type(packet)(self.seq, *packet.data)
 
-    def _receive_header(self, fmt='5B', length=5):
+    def _is_redundant(self, packet, force):
         """
-        Helper method, receives the header of the package from the bt socket and converts it into a tuple
+        Helper method: Checks if the request can be answered from the shadow. The shadowed state set by the
+        request is unknown from here until the device answers it
+        """
+        if self.shadowing and not force and self.shadow.matches(packet):
+            return True
+        self.shadow.invalidate(packet)
+        return False
 
-        Start to read from the first 0xFF received. This is a fix to remove broken data in the incoming buffer
-        :param fmt: The format of the header
-        :return: tuple
+    def resync_shadow(self, **options):
         """
-        # NOTE: ADDED THIS TO REMOVE SOME WRONG BYTES
-        # THAT PERIODICALLY APPEARED IN THE START OF RECEIVE
-        start_of_header = False
-        while not start_of_header:
-            raw_data = self._receive_data(1)
-            first_byte = struct.unpack('B', raw_data)[0]
-            start_of_header = first_byte == 0xFF
-            if not start_of_header:
-                print "NOTE! Removes wrong byte in start of header! Byte: ", first_byte
+        Sends all settings in the shadow to the device again, e.g. when the device may have been reset
+        :param options: Options for the requests, see _write()
+        :return: The responses of the requests
+        :rtype: list
+        """
+        options['force'] = True
+        return [self._write(request_class(self.seq, *data), **options)
+                for request_class, data in self.shadow.items()]
 
-        raw_data += self._receive_data(length - 1)
-        return struct.unpack(fmt, raw_data)
+    def _something_to_receive(self):
+        """
+        Helper method Checks if there is something to receive from the connection
+        :return Returns True if anything to receive from the connection
+        :rtype: bool
+        """
+        ready_to_receive = select.select([self._connection], [], [], 0.1)[0]
+        return self._connection in ready_to_receive
 
     def _handle_async_msg(self, body, header):
         """
@@ -308,88 +713,148 @@ class SpheroAPI(object):
         :param header: The header of the received package
         :type header: tuple
         """
-        if AsyncMsg.is_collision_notification(header):
-            msg = response.CollisionDetected(header, body)
-            self._on_collision(msg)
-
-        elif AsyncMsg.is_power_state_notification(header):
-            msg = response.PowerNotification(header, body)
-            self._on_power_state_cb(msg)
-
-        elif AsyncMsg.is_level_one_diagnostics(header):
-            msg = response.LevelOneDiagnostics(header, body)
-            print msg  # TODO implement cb
-
-        elif AsyncMsg.is_sensor_streaming_package(header):
-            if self._ssc:
-                msg = streaming.SensorStreamingResponse(header, body, self._ssc)
-                self._on_streaming(msg)
+        id_code = header[AsyncMsg.ID_CODE]
+        try:
+            decoder, handler = self._async_handlers[id_code]
+        except KeyError:
+            self.unhandled_async_msgs[id_code] += 1
+            return
+        msg = decoder(header, body)
+        if msg is not None:
+            handler(msg)
 
-        else:
-            # TODO implement other types of async messages
-            print "Received unknown async msg! Header: ", header
+    def _default_async_handlers(self):
+        """
+        Helper method: Returns the built in decoders and handlers of async messages, by async id code
+        """
+        return {
+            AsyncIdCode.ID_COLLISION_DETECTED: (response.CollisionDetected, self._on_collision),
+            AsyncIdCode.ID_POWER_NOTIFICATION: (response.PowerNotification, self._on_power_state_cb),
+            AsyncIdCode.ID_SENSOR_STREAMING: (self._decode_streaming, self._on_streaming),
+        }
 
-    def _create_response_object(self, body, header):
+    def _decode_streaming(self, header, body):
         """
-        Helper method: Creates a response instance from the received package
-        :param header: The header of the package received
-        :param body: The body of the package received
-        :return: response.Response
+        Helper method: Decodes sensor data with the active streaming config, returns None if there is none
         """
-        seq = header[response.Response.SEQ]
-        try:
-            request_obj = self._get_request(seq)
-        except IndexError:
+        layout = self._streaming_layout
+        if layout is None:
             return None
-        self._packages.remove(request_obj)
-        response_obj = request_obj.response(header, body)
-        return response_obj
-
-    def _add_received_response(self, response_object):
-        if response_object is None:
-            raise SpheroFatalError("RESPONSE IS NONE NONE NONE")
-        with self._response_lock:
-            self._responses.append(response_object)
-        self._notify_request_received(response_object.seq)
-
-    def _notify_request_received(self, seq):
-        try:
-            self._requests_waiting_response.pop(seq).set()
-        except KeyError:
-            # Probably received the message to late
-            pass
+        if not layout.matches(body):
+            # Streamed with another config than the active one, e.g. around a SetDataStreaming request
+            self.mismatched_streaming_packets += 1
+            return None
+        streaming_data = streaming.SensorStreamingResponse(header, body, self._ssc, layout)
+        streaming_data.timestamps = self._sample_clock.stamp(layout, streaming_data.timestamp)
+        return streaming_data
+
+    def register_async_handler(self, id_code, handler, decoder=None):
+        """
+        Sets the handler of an async message, e.g. level 1 diagnostics, macro markers or orbBasic output.
+        Replaces the current handler of the id code, including the built in handling of collisions, power
+        notifications and sensor data.
+
+        The message is decoded on the receiver thread, and the handler is called with the message from a
+        thread of the dispatcher. The id code is used as the event type of the dispatcher
+        :param id_code: The async id code, see response.AsyncIdCode
+        :type id_code: int
+        :param handler: The handler method
+        :type handler: method or function
+        :param decoder: Called with the header and body of the message, returns the message or None to ignore
+        it. Defaults to the message class of the id code in response.ASYNC_MESSAGES, or response.AsyncMsg
+        :type decoder: class or function
+        """
+        if decoder is None:
+            decoder = response.ASYNC_MESSAGES.get(id_code, AsyncMsg)
+        dispatch = functools.partial(self.dispatcher.dispatch, id_code, handler, source=self)
+        self._async_handlers[id_code] = (decoder, dispatch)
+
+    def unregister_async_handler(self, id_code):
+        """
+        Removes the handler of an async message. The built in handling is restored for collisions, power
+        notifications and sensor data, other messages are counted in unhandled_async_msgs
+        :param id_code: The async id code, see response.AsyncIdCode
+        """
+        default = self._default_async_handlers().get(id_code)
+        if default is not None:
+            self._async_handlers[id_code] = default
+        else:
+            self._async_handlers.pop(id_code, None)
 
     def _handle_msg_response(self, body, header):
         """
         Helper method for parsing incoming sync response messages.
-        Creates the correct response objects and adds this to the
-        list of incoming responses
+        Creates the correct response object and completes the future of the request
+        with the same sequence number
 
         :param body: The raw body of the received package
         :type body: str or raw_data
         :param header: The header of the received package
         :type header: tuple
         """
-        response_object = self._create_response_object(body, header)
-        if response_object:
-            self._add_received_response(response_object)
+        future = self._pop_pending(header[Response.SEQ])
+        if future is None:
+            # Probably received the message to late
+            logger.debug("%s: Received a response with no pending request, seq %d", self.bt_name,
+                         header[Response.SEQ])
+            return
+        if future.sent_at is not None:
+            rtt = time.time() - future.sent_at
+            self.rtt.sample(rtt)
+            self.protocol_metrics.record_rtt(future.request, rtt)
+
+        response_object = future.request.response(header, body)
+        late = future.deadline is not None and time.time() > future.deadline
+        if late:
+            self.deadline_stats.late[type(future.request).__name__] += 1
+        if response_object.success:
+            # The device has applied a late request, so the state it set is still tracked
+            self._on_request_succeeded(future.request)
+            if late:
+                future.set_exception(SpheroDeadlineError('Response received from device after the deadline'))
+            else:
+                future.set_result(response_object)
         else:
-            print "received a message with no sender?"
+            future.set_exception(SpheroRequestError('Request failed: ' + response_object.msg))
+
+    @property
+    def discarded_bytes(self):
+        """
+        The number of received bytes that was removed while searching for the start of a package
+        :rtype: int
+        """
+        return self._frame_parser.discarded_bytes
 
-    def _receive_data(self, length):
+    def _on_request_succeeded(self, packet):
         """
-        Helper method to receive the given amount of data from the device
-        :param length: The length of the data to receive
-        :return:
+        Helper method that is triggered when the device has successfully answered a request
+        :param packet: The request
+        :type packet: request.Request
+        """
+        self.shadow.update(packet)
+        succeeded_cb = self._request_succeeded_cbs.get(type(packet))
+        if succeeded_cb:
+            succeeded_cb(packet)
+
+    def _receive_frames(self):
+        """
+        Helper method, receives a chunk of data from the device and handles all complete packages in the
+        received data.
         :raise SpheroError: Raises a sphero error if there is any issues with receiving data from the device
         """
-        data = ''
-        for _ in xrange(length):
-            try:
-                data += self._bt_socket.recv(1)
-            except bluetooth.BluetoothError as e:
-                raise SpheroError("Failed to receive data from device:" + e.message)
-        return data
+        data = self._connection.recv(self.receive_chunk_size)
+        if not data:
+            raise SpheroError("Failed to receive data from device: connection closed")
+
+        self._frame_parser.feed(data)
+        num_frames = 0
+        for header, body in self._frame_parser.frames():
+            num_frames += 1
+            if Response.is_msg_response(header):
+                self._handle_msg_response(body, header)
+            else:
+                self._handle_async_msg(body, header)
+        self.protocol_metrics.on_received(len(data), num_frames)
 
     def _receiver(self):
         """
@@ -403,24 +868,151 @@ class SpheroAPI(object):
         """
 
         while self._run_receive:
+            if self._something_to_receive() and not self._on_readable():
+                break
+            self._expire_pending()
+
+    def _on_readable(self):
+        """
+        Helper method that receives and handles the data that is ready on the connection. Is called by the
+        receiver thread, or by the reactor the device is registered to.
+        :return: False if the receiver has crashed and no more data can be received
+        :rtype: bool
+        """
+        if self._connection is None:
+            return False
+        try:
+            self._receive_frames()
+        except Exception as e:
+            if isinstance(e, SpheroError) and (self._reconnecting or (self.auto_reconnect and self._run_receive)):
+                logger.warning("%s: Connection lost: %s", self.bt_name, e)
+                self._on_connection_lost()
+                return False
+            logger.exception("%s: Receiver crashed", self.bt_name)
+            self._receiver_crashed = True
+            # No response can be received, so release all threads waiting for one
+            error = SpheroFatalError('FATAL Error, could not receive data from sphero. (receiver crashed)')
+            self._scheduler.clear(error)
+            self._fail_pending(error)
+            return False
+        return True
+
+    def _on_connection_lost(self):
+        """
+        Helper method: Starts the reconnect thread, if not already connecting again
+        """
+        with self._reconnect_lock:
+            # Set before the receiver is marked as crashed, so the waiting threads are not released
+            reconnecting, self._reconnecting = self._reconnecting, True
+            self._receiver_crashed = True
+            if reconnecting:
+                # Lost while setting up the device, the reconnect thread connects again
+                return
+            self.reconnect_stats.drops += 1
+            self._reconnect_cancelled.clear()
+            self._reconnect_thread = Thread(target=self._reconnect, name="SpheroReconnectThread")
+            self._reconnect_thread.daemon = True
+            self._reconnect_thread.start()
+
+    def _reconnect(self):
+        """
+        Connects the device again after the connection was lost, runs in the reconnect thread.
+
+        The device is connected with exponential backoff, see reconnect_delay. When connected, the settings
+        in REPLAYED_REQUESTS, the locator config and the streaming config are sent again, before the queued
+        requests are sent. The requests that waited for a response when the connection was lost fail with
+        SpheroTimeoutError, so blocking idempotent requests are sent again. The reconnect is counted in
+        reconnect_stats
+        """
+        lost_at = time.time()
+        # Captured before the connection is closed, the replayed requests update it when they succeed
+        session = self._session_requests()
+        lost = SpheroTimeoutError('No response received from device before the connection was lost')
+        connected = False
+        while not self._reconnect_cancelled.is_set():
+            self._fail_pending(lost)
+            self._stop_receiver()
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+            connected = self._connect_with_backoff()
+            if not connected:
+                break
+            self._replay(session)
+            if not self._receiver_crashed:
+                break
+            # Lost again while setting up the device
+
+        with self._reconnect_lock:
+            self._reconnecting = False
+        if connected and not self._receiver_crashed:
+            self.reconnect_stats.reconnected(time.time() - lost_at)
+            self._scheduler.pump()
+        else:
+            self.reconnect_stats.failures += 1
+            self._scheduler.clear(SpheroConnectionError('Device is not connected, failed to connect again'))
+            self.shadow.clear()
+
+    def _connect_with_backoff(self):
+        """
+        Helper method: Tries to connect until connected, cancelled or max_reconnect_attempts is reached
+        :return: True if connected
+        :rtype: bool
+        """
+        delay = self.reconnect_delay
+        attempts = 0
+        while not self._reconnect_cancelled.is_set():
+            attempts += 1
+            self.reconnect_stats.attempts += 1
+            try:
+                self._transport.connect(self.bt_addr)
+            except SpheroConnectionError:
+                if self.max_reconnect_attempts is not None and attempts >= self.max_reconnect_attempts:
+                    return False
+                self._reconnect_cancelled.wait(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+            self._connection = self._transport
+            self._receiver_crashed = False
+            self._start_receiver()
+            return True
+        return False
+
+    def _session_requests(self):
+        """
+        Helper method: Creates the requests that set up the device as it was before the connection was lost
+        :rtype: list of request.Request
+        """
+        session = [request_class(0x00, *self.shadow.get(request_class))
+                   for request_class in self.REPLAYED_REQUESTS if request_class in self.shadow]
+        if self._locator_config is not None:
+            session.append(request.ConfigureLocator(0x00, *self._locator_config))
+        ssc = self._ssc
+        if ssc is not None and ssc.num_packets == ssc.STREAM_FOREVER and (ssc.mask1 or ssc.mask2):
+            session.append(self._streaming_request(ssc))
+        return session
+
+    def _replay(self, session):
+        """
+        Helper method: Sends the requests of the session directly, ahead of the queued requests
+        :type session: list of request.Request
+        """
+        for packet in session:
+            if self._receiver_crashed or self._reconnect_cancelled.is_set():
+                return
+            packet.seq = self.seq
+            self.shadow.invalidate(packet)
+            future = self._create_future(packet)
             try:
-                if self._something_to_receive():
-                    header = self._receive_header()
-                    if Response.is_msg_response(header):
-                        body = self._receive_data(header[Response.DLEN])
-                        self._handle_msg_response(body, header)
-
-                    elif AsyncMsg.is_async_msg(header):
-                        header = AsyncMsg.convert_to_async_header(header)
-                        body = self._receive_data(header[AsyncMsg.DLEN])
-                        self._handle_async_msg(body, header)
-                    else:
-                        raise SpheroError("Unknown data received from sphero. Header: {}".format(header))
-            except SpheroError:
-                # TODO release all blocked threads waiting to receive data
-                print "RECEIVER CRASHED"
-                self._receiver_crashed = True
-            #time.sleep(0.01)
+                self._register_pending(future)
+                self._transmit(packet, future)
+                if not future.wait(self._timeout_for(packet)):
+                    self._time_out(future)
+                future.result()
+            except SpheroError as e:
+                logger.warning("%s: Failed to set up %s again: %s", self.bt_name, type(packet).__name__, e,
+                               exc_info=True)
+                self.reconnect_stats.replay_failures += 1
 
     @staticmethod
     def prep_str(s):
@@ -431,15 +1023,15 @@ class SpheroAPI(object):
 
     # CORE COMMANDS
 
-    def ping(self):
-        return self._write(request.Ping(self.seq))
+    def ping(self, **options):
+        return self._write(request.Ping(self.seq), **options)
 
-    def set_rgb(self, r, g, b, persistent=False):
+    def set_rgb(self, r, g, b, persistent=False, **options):
         # TODO verify values in range
-        return self._write(request.SetRGB(self.seq, r, g, b, 0x01 if persistent else 0x00))
+        return self._write(request.SetRGB(self.seq, r, g, b, 0x01 if persistent else 0x00), **options)
 
-    def get_rgb(self):
-        return self._write(request.GetRGB(self.seq))
+    def get_rgb(self, **options):
+        return self._write(request.GetRGB(self.seq), **options)
 
     def get_version(self):
         raise NotImplementedError
@@ -450,13 +1042,13 @@ class SpheroAPI(object):
         # Which returns both name and Bluetooth mac address.
         return self.get_bluetooth_info().name
 
-    def set_device_name(self, new_name):
+    def set_device_name(self, new_name, **options):
         """ Sets internal device name. (not announced bluetooth name).
         requires utf-8 encoded string. """
-        return self._write(request.SetDeviceName(self.seq, *self.prep_str(new_name)))
+        return self._write(request.SetDeviceName(self.seq, *self.prep_str(new_name)), **options)
 
-    def get_bluetooth_info(self):
-        return self._write(request.GetBluetoothInfo(self.seq))
+    def get_bluetooth_info(self, **options):
+        return self._write(request.GetBluetoothInfo(self.seq), **options)
 
     def set_auto_reconnect(self):
         raise NotImplementedError
@@ -464,14 +1056,14 @@ class SpheroAPI(object):
     def get_auto_reconnect(self):
         raise NotImplementedError
 
-    def get_power_state(self):
-        return self._write(request.GetPowerState(self.seq))
+    def get_power_state(self, **options):
+        return self._write(request.GetPowerState(self.seq), **options)
 
-    def set_power_notification(self, activated=True):
-        return self._write(request.SetPowerNotification(self.seq, 0x01 if activated else 0x00))
+    def set_power_notification(self, activated=True, **options):
+        return self._write(request.SetPowerNotification(self.seq, 0x01 if activated else 0x00), **options)
 
-    def sleep(self, wakeup=0, macro=0, orbbasic=0):
-        return self._write(request.Sleep(self.seq, wakeup, macro, orbbasic))
+    def sleep(self, wakeup=0, macro=0, orbbasic=0, **options):
+        return self._write(request.Sleep(self.seq, wakeup, macro, orbbasic), **options)
 
     def get_voltage_trip_points(self):
         raise NotImplementedError
@@ -485,8 +1077,8 @@ class SpheroAPI(object):
     def jump_to_bootloader(self):
         raise NotImplementedError
 
-    def perform_level_1_diagnostics(self):
-        return self._write(request.PerformLevel1Diagnostics(self.seq))
+    def perform_level_1_diagnostics(self, **options):
+        return self._write(request.PerformLevel1Diagnostics(self.seq), **options)
 
     def perform_level_2_diagnostics(self):
         raise NotImplementedError
@@ -502,11 +1094,11 @@ class SpheroAPI(object):
     def poll_packet_times(self):
         raise NotImplementedError
 
-    def set_heading(self, value):
+    def set_heading(self, value, **options):
         """value can be between 0 and 359"""
-        return self._write(request.SetHeading(self.seq, value))
+        return self._write(request.SetHeading(self.seq, value), **options)
 
-    def set_stabilization(self, state):
+    def set_stabilization(self, state, **options):
         """
         Turns off or on the internal stabilization of the sphero
 
@@ -515,9 +1107,9 @@ class SpheroAPI(object):
         :rtype: response.Response
         :return: SimpleResponse
         """
-        return self._write(request.SetStabilization(self.seq, state))
+        return self._write(request.SetStabilization(self.seq, state), **options)
 
-    def set_rotation_rate(self, val):
+    def set_rotation_rate(self, val, **options):
         """ value ca be between 0x00 and 0xFF:
             value is a multiplied with 0.784 degrees/s except for:
             0   --> 1 degrees/s
@@ -528,7 +1120,7 @@ class SpheroAPI(object):
             :rtype: response.Response
             :return: SimpleResponse
         """
-        return self._write(request.SetRotationRate(self.seq, val))
+        return self._write(request.SetRotationRate(self.seq, val), **options)
 
     def set_application_configuration_block(self):
         raise NotImplementedError
@@ -549,36 +1141,68 @@ class SpheroAPI(object):
         # TODO: Implement self leveling
         raise NotImplementedError
 
-    def set_data_streaming(self, new_ssc):
+    def set_data_streaming(self, new_ssc, **options):
         # TODO WRITE DOCUMENTATION
-        n = new_ssc.n
-        m = new_ssc.m
-        mask = new_ssc.mask1
-        mask2 = new_ssc.mask2
-        packet_cnt = new_ssc.num_packets
-        result = self._write(request.SetDataStreaming(self.seq, n, m, mask, packet_cnt, mask2))
-        if result.success:
-            self._ssc = new_ssc
-        return result
-
-    def stop_data_streaming(self):
+        return self._write(self._streaming_request(new_ssc, self.seq), **options)
+
+    @staticmethod
+    def _streaming_request(ssc, seq=0x00):
+        """
+        Helper method: Creates the SetDataStreaming request of a streaming config
+        :type ssc: streaming.SensorStreamingConfig
+        :rtype: request.SetDataStreaming
+        """
+        packet = request.SetDataStreaming(seq, ssc.n, ssc.m, ssc.mask1, ssc.num_packets, ssc.mask2)
+        packet.ssc = ssc
+        packet.layout = ssc.compile()
+        return packet
+
+    def _on_data_streaming_set(self, packet):
+        """
+        Helper method that is triggered when the device has accepted a new streaming config
+        :param packet: The SetDataStreaming request
+        """
+        self._ssc = packet.ssc
+        self._streaming_layout = packet.layout
+        self.streaming_stats.start(packet.ssc)
+
+    def _on_locator_configured(self, packet):
+        """
+        Helper method that is triggered when the device has accepted a new locator config
+        :param packet: The ConfigureLocator request
+        """
+        self._locator_config = packet.data
+
+    def use_streaming_config(self, ssc):
+        """
+        Decodes the received sensor data with the given streaming config, without sending the config to the
+        device. Used when the device already streams data, e.g. when replaying a capture
+        :type ssc: streaming.SensorStreamingConfig
+        """
+        self._ssc = ssc
+        self._streaming_layout = ssc.compile()
+        self.streaming_stats.start(ssc)
+
+    def stop_data_streaming(self, **options):
         """
         High level method to disable data streaming
         :return: response.SimpleResponse
         """
         stop_ssc = streaming.SensorStreamingConfig()
         stop_ssc.stream_none()
-        return self.set_data_streaming(stop_ssc)
+        return self.set_data_streaming(stop_ssc, **options)
 
-    def configure_collision_detection(self, meth=0x01, x_t=0x64, y_t=0x64, x_spd=0x64, y_spd=0x64, dead=0x64):
+    def configure_collision_detection(self, meth=0x01, x_t=0x64, y_t=0x64, x_spd=0x64, y_spd=0x64, dead=0x64,
+                                      **options):
         # TODO WRITE DOCS
-        return self._write(request.ConfigureCollisionDetection(self.seq, meth, x_t, y_t, x_spd, y_spd, dead))
+        return self._write(request.ConfigureCollisionDetection(self.seq, meth, x_t, y_t, x_spd, y_spd, dead),
+                           **options)
 
-    def set_back_led_output(self, value):
+    def set_back_led_output(self, value, **options):
         """value can be between 0x00 and 0xFF"""
-        return self._write(request.SetBackLEDOutput(self.seq, value))
+        return self._write(request.SetBackLEDOutput(self.seq, value), **options)
 
-    def roll(self, speed, heading, state=1):
+    def roll(self, speed, heading, state=1, **options):
         """
         :param speed: speed can have value between 0x00 and 0xFF
         :param heading: heading can have value between 0 and 359
@@ -593,13 +1217,13 @@ class SpheroAPI(object):
         :return: SimpleResponse
         :rtype: response.Response
         """
-        return self._write(request.Roll(self.seq, speed, heading, state))
+        return self._write(request.Roll(self.seq, speed, heading, state), **options)
 
-    def set_boost_with_time(self, activate=True):
-        return self._write(request.SetBoostWithTime(self.seq, activate))
+    def set_boost_with_time(self, activate=True, **options):
+        return self._write(request.SetBoostWithTime(self.seq, activate), **options)
 
     def set_raw_motor_values(self, left_mode=MotorMode.MOTOR_IGNORE, left_power=0x00,
-                             right_mode=MotorMode.MOTOR_IGNORE, right_power=0x00):
+                             right_mode=MotorMode.MOTOR_IGNORE, right_power=0x00, **options):
         """
         Sets a raw value to one or both of Spheros engines.
 
@@ -615,14 +1239,15 @@ class SpheroAPI(object):
         :rtype: response.Response
         :return: SimpleResponse
         """
-        return self._write(request.SetRawMotorValues(self.seq, left_mode, left_power, right_mode, right_power))
+        return self._write(request.SetRawMotorValues(self.seq, left_mode, left_power, right_mode, right_power),
+                           **options)
 
-    def set_motion_timeout(self, timeout):
+    def set_motion_timeout(self, timeout, **options):
         # TODO WRITE DOC
-        return self._write(request.SetMotionTimeout(self.seq, timeout))
+        return self._write(request.SetMotionTimeout(self.seq, timeout), **options)
 
     def set_option_flags(self, stay_on=False, vector_drive=False, leveling=False, tail_led=False, motion_timeout=False,
-                         demo_mode=False, tap_light=False, tap_heavy=False, gyro_max=False):
+                         demo_mode=False, tap_light=False, tap_heavy=False, gyro_max=False, **options):
         """
         Assigns the permanent option flags to the provided value and writes them to the config block for
         persistence across power cycles. See below for the bit definitions.
@@ -655,10 +1280,10 @@ class SpheroAPI(object):
         flags |= 0x0080 if tap_heavy else 0x0000
         flags |= 0x0100 if gyro_max else 0x0000
 
-        return self._write(request.SetOptionFlags(self.seq, flags))
+        return self._write(request.SetOptionFlags(self.seq, flags), **options)
 
-    def get_option_flags(self):
-        return self._write(request.GetOptionFlags(self.seq))
+    def get_option_flags(self, **options):
+        return self._write(request.GetOptionFlags(self.seq), **options)
 
     def get_configuration_block(self):
         raise NotImplementedError
@@ -718,7 +1343,7 @@ class SpheroAPI(object):
 
     # Additional "higher-level" commands
 
-    def configure_locator(self, x_pos, y_pos, yaw_tare=0x00, auto=True):
+    def configure_locator(self, x_pos, y_pos, yaw_tare=0x00, auto=True, **options):
         """
         :param x_pos: in the range 0x00 - 0xff sets the new x position
         :param y_pos: in the range 0x00 - 0xff sets the new y position
@@ -726,9 +1351,9 @@ class SpheroAPI(object):
         :return: simple response
         """
         flags = 0x01 if auto else 0x00  # Could make the user set this
-        return self._write(request.ConfigureLocator(self.seq, flags, x_pos, y_pos, yaw_tare))
+        return self._write(request.ConfigureLocator(self.seq, flags, x_pos, y_pos, yaw_tare), **options)
 
-    def read_locator(self):
+    def read_locator(self, **options):
         """
         This reads spheros current X, Y position, component velocities
         and SOG(speed over ground). Position is a signed value in cm.
@@ -736,10 +1361,10 @@ class SpheroAPI(object):
         unsigned cm/sec.
         :return: response.Response
         """
-        return self._write(request.ReadLocator(self.seq))
+        return self._write(request.ReadLocator(self.seq), **options)
 
-    def stop(self):
-        return self.roll(0, 0)
+    def stop(self, **options):
+        return self.roll(0, 0, **options)
 
     # ASYNC CALLBACKS
 
@@ -748,7 +1373,7 @@ class SpheroAPI(object):
         Used to set the callback method triggered when a collision is detected from the sphero.
         Configure_collision_detection() must be called to activate collision detection on the Sphero device
 
-        The callback will be called with the collision data set as a parameter
+        The callback will be called with the collision data set as a parameter, from a thread of the dispatcher
         :param collision_cb: The callback method
         :type collision_cb: method or function
         """
@@ -760,14 +1385,15 @@ class SpheroAPI(object):
         :param collision_data:
         """
         if self._collision_cb:
-            self._collision_cb(collision_data)
+            self.dispatcher.dispatch(EVENT_COLLISION, self._collision_cb, collision_data, source=self)
 
     def set_sensor_streaming_cb(self, streaming_cb):
         """
         Used to set the callback method triggered when sensor data is received from the sphero.
         set_data_streaming() must be called to activate sensor streaming on the Sphero device
 
-        The callback will be called with the sensor data set as a parameter
+        The callback will be called with the sensor data set as a parameter, from a thread of the dispatcher.
+        Old sensor data is dropped if the callback can not keep up
         :param streaming_cb: The callback that should be triggered when data arrives from the sphero
         :type streaming_cb: method or function
         """
@@ -779,15 +1405,129 @@ class SpheroAPI(object):
         :param streaming_data:
         """
         self.sensors = streaming_data
+        self.streaming_stats.on_packet(streaming_data.timestamp)
+        if self.history is not None:
+            self.history.add_packet(streaming_data)
+        if self._recorder is not None:
+            self._recorder.record(streaming_data)
+        if self.pose_estimator is not None:
+            self.pose_estimator.add_packet(streaming_data)
+        if self._subscriptions.subscriptions:
+            self._subscriptions.on_packet(streaming_data)
         if self._streaming_cb:
-            self._streaming_cb(streaming_data)
+            self.dispatcher.dispatch(EVENT_STREAMING, self._streaming_cb, streaming_data, source=self)
+
+    def subscribe(self, keys, callback, max_rate=None, **options):
+        """
+        Subscribes to some of the streamed sensor values. The streaming config of the device is set to
+        stream the values of all subscriptions, at the highest max rate of the subscriptions.
+
+        The callback is called from a thread of the dispatcher with the timestamp of the sample and a dict of the
+        raw values, by key. See the sensor classes in sphero.streaming for the units of the values
+        :param keys: Streaming keys of the values, e.g. [KEY_STRM_IMU_YAW_ANGLE, KEY_STRM_VELOCITY_X]
+        :type keys: list
+        :param callback: The callback method
+        :type callback: method or function
+        :param max_rate: Max number of samples delivered each second, all received samples if None
+        :type max_rate: float or None
+        :return: The subscription, used to unsubscribe
+        :rtype: sphero.subscription.StreamingSubscription
+        :raise SpheroError: If a value can not be streamed
+        """
+        return self._subscriptions.subscribe(keys, callback, max_rate, **options)
+
+    def unsubscribe(self, subscription, **options):
+        """
+        Removes a subscription. Streaming is stopped when there are no subscriptions left
+        :type subscription: sphero.subscription.StreamingSubscription
+        """
+        self._subscriptions.unsubscribe(subscription, **options)
+
+    def enable_history(self, capacity=4096):
+        """
+        Starts to keep a history of the received sensor data, available from the history attribute
+        :param capacity: The max number of samples kept
+        :return: The history
+        :rtype: SensorHistory
+        """
+        if self.history is None or self.history.capacity != capacity:
+            self.history = SensorHistory(capacity)
+        return self.history
+
+    def disable_history(self):
+        """
+        Stops keeping the history of the received sensor data
+        """
+        self.history = None
+
+    def enable_pose_estimation(self, capacity=4096):
+        """
+        Starts to estimate the pose of the device from the received sensor data, see sphero.fusion.
+        Stream gyro, accelerometer, imu angles, velocity and odometer data for the best estimate
+        :param capacity: The number of poses kept in the history of the estimator
+        :return: The pose estimator
+        :rtype: PoseEstimator
+        """
+        if self.pose_estimator is None:
+            self.pose_estimator = PoseEstimator(capacity)
+        return self.pose_estimator
+
+    def disable_pose_estimation(self):
+        """
+        Stops estimating the pose of the device
+        """
+        self.pose_estimator = None
+
+    def enable_rate_control(self, **kwargs):
+        """
+        Starts to adapt the sample rate of the active streaming config to the measured packet loss and
+        jitter, see sphero.ratecontrol
+        :param kwargs: Settings of the controller, see StreamingRateController
+        :return: The running rate controller
+        :rtype: StreamingRateController
+        """
+        self.disable_rate_control()
+        self.rate_controller = StreamingRateController(self, **kwargs)
+        self.rate_controller.start()
+        return self.rate_controller
+
+    def disable_rate_control(self):
+        """
+        Stops adapting the sample rate. The last streaming config stays active
+        """
+        controller, self.rate_controller = self.rate_controller, None
+        if controller is not None:
+            controller.stop()
+
+    def start_recording(self, path):
+        """
+        Starts to record the received sensor data to a telemetry log, see sphero.telemetry.
+        A running recording is stopped
+        :param path: The log file, an existing file is overwritten
+        :return: The recorder
+        :rtype: TelemetryRecorder
+        """
+        self.stop_recording()
+        self._recorder = TelemetryRecorder(path, self.bt_name or '')
+        return self._recorder
+
+    def stop_recording(self):
+        """
+        Stops the recording of sensor data, and writes the remaining data to the log
+        :return: The recorder that was stopped, or None if nothing was recorded
+        :rtype: TelemetryRecorder or None
+        """
+        recorder, self._recorder = self._recorder, None
+        if recorder is not None:
+            recorder.close()
+        return recorder
 
     def set_power_state_cb(self, power_state_cb):
         """
         Used to set the callback method triggered when power state data is received from the sphero.
         set_power_notification() must be called to activate power state streaming on the Sphero device
 
-        The callback will be called with the power state data set as a parameter
+        The callback will be called with the power state data set as a parameter, from a thread of the dispatcher
         :param power_state_cb: The callback that should be triggered when power state data arrives from the sphero
         :type power_state_cb: method or function
         """
@@ -799,7 +1539,7 @@ class SpheroAPI(object):
         :param power_state_data:
         """
         if self._power_state_cb:
-            self._power_state_cb(power_state_data)
+            self.dispatcher.dispatch(EVENT_POWER, self._power_state_cb, power_state_data, source=self)
 
 
 if __name__ == '__main__':
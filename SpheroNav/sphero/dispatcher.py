@@ -0,0 +1,364 @@
+# coding: utf-8
+"""
+Dispatchers that run the user callbacks of Sphero devices on worker threads or in an event loop
+"""
+from collections import deque
+import logging
+import threading
+import time
+
+from metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# Types of events
+EVENT_STREAMING = 'streaming'
+EVENT_COLLISION = 'collision'
+EVENT_POWER = 'power'
+
+# Overflow policies, used when the queue of an event type is full
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+NEVER_DROP = 'never_drop'
+
+
+class CallbackStats(object):
+    """
+    Counters of the calls to one callback
+    """
+
+    def __init__(self, name):
+        super(CallbackStats, self).__init__()
+        self.name = name
+        self.queued = 0
+        self.called = 0
+        self.dropped = 0
+        self.failed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    @property
+    def pending(self):
+        """
+        The number of calls waiting in the queue
+        :rtype: int
+        """
+        return self.queued - self.called - self.dropped
+
+    @property
+    def mean_latency(self):
+        """
+        Mean seconds from an event is dispatched until the callback is called
+        :rtype: float
+        """
+        return self.total_latency / self.called if self.called else 0.0
+
+    def as_dict(self):
+        return {
+            'queued': self.queued,
+            'called': self.called,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'pending': self.pending,
+            'mean_latency': self.mean_latency,
+            'max_latency': self.max_latency,
+        }
+
+    def __str__(self):
+        return "{}: called: {}, dropped: {}, pending: {}, mean latency: {:.6f}".format(
+            self.name, self.called, self.dropped, self.pending, self.mean_latency)
+
+
+class CallbackDispatcher(object):
+    """
+    Runs callbacks on a pool of worker threads, so slow callbacks never block the receiver of a device.
+
+    Each event type has its own bounded queue with an overflow policy:
+        - DROP_OLDEST: The oldest queued event is dropped, the callbacks always get the newest data
+        - DROP_NEWEST: The new event is dropped
+        - NEVER_DROP: The queue grows past its size, no events are lost
+
+    The events of one type from one source, e.g. a device, are run by one worker at a time, in the order they
+    are dispatched. Events of different types or sources run in parallel when there are several workers. A
+    dispatcher can be shared by many devices, see SpheroManager.
+    """
+
+    DEFAULT_POLICIES = {
+        EVENT_STREAMING: DROP_OLDEST,
+        EVENT_COLLISION: NEVER_DROP,
+        EVENT_POWER: NEVER_DROP,
+    }
+
+    def __init__(self, workers=1, max_queued=100):
+        """
+        :param workers: The number of worker threads
+        :param max_queued: The default size of the queue of each event type
+        """
+        super(CallbackDispatcher, self).__init__()
+        self.workers = workers
+        self.max_queued = max_queued
+        self._policies = dict(self.DEFAULT_POLICIES)
+        self._sizes = {}
+
+        self._queues = {}
+        self._busy = set()
+        self._stats = {}
+        # Seconds from dispatched until called, by event type
+        self._latency = {}
+        self._condition = threading.Condition(threading.Lock())
+        self._threads = []
+        self._running = False
+
+    def set_policy(self, event_type, policy, max_queued=None):
+        """
+        Sets the overflow policy of an event type
+        :param event_type: The event type, e.g. EVENT_STREAMING
+        :param policy: DROP_OLDEST, DROP_NEWEST or NEVER_DROP
+        :param max_queued: Size of the queue of the event type, the default size of the dispatcher if None
+        """
+        if policy not in (DROP_OLDEST, DROP_NEWEST, NEVER_DROP):
+            raise ValueError("Unknown overflow policy: %s" % policy)
+        with self._condition:
+            self._policies[event_type] = policy
+            if max_queued is not None:
+                self._sizes[event_type] = max_queued
+
+    def dispatch(self, event_type, callback, *args, **kwargs):
+        """
+        Queues a call to the callback with the given arguments. Never blocks
+        :param event_type: The event type, decides the overflow policy
+        :param callback: The callback
+        :type callback: method or function
+        :param source: Keyword only, the sender of the event, e.g. the device. Each event type of each source
+        has its own queue
+        :return: False if the event was dropped
+        :rtype: bool
+        """
+        key = (kwargs.pop('source', None), event_type)
+        if kwargs:
+            raise TypeError("Unexpected keyword arguments: %s" % ', '.join(kwargs))
+        with self._condition:
+            if not self._running:
+                self._start()
+            stats = self._callback_stats(callback)
+            stats.queued += 1
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = deque()
+
+            policy = self._policies.get(event_type, DROP_OLDEST)
+            if policy != NEVER_DROP and len(queue) >= self._sizes.get(event_type, self.max_queued):
+                if policy == DROP_NEWEST:
+                    stats.dropped += 1
+                    return False
+                oldest = queue.popleft()
+                self._callback_stats(oldest[0]).dropped += 1
+            queue.append((callback, args, time.time()))
+            self._notify(key)
+            return True
+
+    def stats(self):
+        """
+        The counters of each callback
+        :return: Dict of the counters by name of the callback
+        :rtype: dict
+        """
+        with self._condition:
+            return dict((stats.name, stats.as_dict()) for stats in self._stats.itervalues())
+
+    def latency(self):
+        """
+        The latency from an event is dispatched until the callback is called, by event type
+        :return: Dict of the histograms as dicts, see metrics.LatencyHistogram
+        :rtype: dict
+        """
+        with self._condition:
+            return dict((event_type, histogram.as_dict()) for event_type, histogram in self._latency.iteritems())
+
+    def pending(self):
+        """
+        The number of queued events
+        :rtype: int
+        """
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.itervalues()) + len(self._busy)
+
+    def wait(self, timeout=None):
+        """
+        Blocks until all queued events are run
+        :return: True if the queues are empty
+        """
+        end = time.time() + timeout if timeout is not None else None
+        while self.pending():
+            if end is not None and time.time() >= end:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def stop(self):
+        """
+        Stops the worker threads. Queued events are discarded
+        """
+        with self._condition:
+            self._running = False
+            self._queues.clear()
+            self._condition.notify_all()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self._threads = []
+
+    def _callback_stats(self, callback):
+        """
+        Helper method: Returns the stats of the callback, must be called with the lock held
+        """
+        name = getattr(callback, '__name__', repr(callback))
+        key = callback
+        try:
+            hash(key)
+        except TypeError:
+            # e.g. a bound method of a list, the method is created again on every lookup so the object it is
+            # bound to identifies it. The repr includes the address, so the names in stats() are unique
+            bound_to = getattr(callback, '__self__', None)
+            key = (id(bound_to), name) if bound_to is not None else id(callback)
+            name = repr(callback)
+        try:
+            return self._stats[key]
+        except KeyError:
+            stats = self._stats[key] = CallbackStats(name)
+            return stats
+
+    def _notify(self, key):
+        """
+        Helper method: Wakes a worker to run the event queued with the given key, must be called with the lock
+        held
+        """
+        self._condition.notify()
+
+    def _run(self, key, event):
+        """
+        Helper method: Calls the callback of a dispatched event and counts the call
+        :param key: The key of the queue of the event
+        :param event: The callback, the arguments and the time the event was dispatched
+        """
+        callback, args, dispatched_at = event
+        event_type = key[1]
+        latency = time.time() - dispatched_at
+        failed = False
+        try:
+            callback(*args)
+        except Exception:
+            failed = True
+            logger.exception("Callback %s failed", getattr(callback, '__name__', callback))
+
+        with self._condition:
+            self._busy.discard(key)
+            stats = self._callback_stats(callback)
+            stats.called += 1
+            stats.failed += failed
+            stats.total_latency += latency
+            stats.max_latency = max(stats.max_latency, latency)
+            histogram = self._latency.get(event_type)
+            if histogram is None:
+                histogram = self._latency[event_type] = LatencyHistogram()
+            histogram.record(latency)
+            # Another worker may wait for this queue
+            self._condition.notify()
+
+    def _start(self):
+        """
+        Helper method: Starts the worker threads, must be called with the lock held
+        """
+        self._running = True
+        for i in xrange(self.workers):
+            thread = threading.Thread(target=self._worker, name="CallbackDispatcherThread-%d" % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _next_event(self):
+        """
+        Helper method: Waits for an event of a queue that no other worker is running
+        :return: The key of the queue and the event, or None if the dispatcher is stopped
+        """
+        with self._condition:
+            while self._running:
+                for key, queue in self._queues.iteritems():
+                    if queue and key not in self._busy:
+                        self._busy.add(key)
+                        return key, queue.popleft()
+                self._condition.wait()
+            return None
+
+    def _worker(self):
+        """
+        Helper method that runs the queued callbacks, runs in the worker threads
+        """
+        while True:
+            next_event = self._next_event()
+            if next_event is None:
+                return
+            self._run(*next_event)
+
+
+class LoopDispatcher(CallbackDispatcher):
+    """
+    Runs callbacks in an asyncio event loop instead of on worker threads, used by AsyncSpheroAPI so the
+    callbacks run on the thread of the loop, like the coroutines of the device.
+
+    The queues and overflow policies are the same as for CallbackDispatcher. Events can be dispatched from
+    any thread, the callbacks are scheduled in the loop with call_soon_threadsafe and run one at a time, in
+    the order they are dispatched. wait() must not be called from the thread of the loop.
+    """
+
+    def __init__(self, loop, max_queued=100):
+        """
+        :param loop: The event loop the callbacks are run in
+        :type loop: trollius.AbstractEventLoop
+        :param max_queued: The default size of the queue of each event type
+        """
+        super(LoopDispatcher, self).__init__(workers=0, max_queued=max_queued)
+        self._loop = loop
+
+    def _notify(self, key):
+        self._loop.call_soon_threadsafe(self._run_next, key)
+
+    def _run_next(self, key):
+        """
+        Helper method: Runs the oldest event of a queue, runs in the event loop. There is nothing to run when
+        the event was dropped from the queue by its overflow policy
+        """
+        with self._condition:
+            queue = self._queues.get(key)
+            if not self._running or not queue:
+                return
+            event = queue.popleft()
+            self._busy.add(key)
+        self._run(key, event)
+
+
+if __name__ == "__main__":
+    # A SLOW STREAMING CALLBACK ON A SIMULATED DEVICE
+    from core import SpheroAPI
+    from simulator import SimulatedTransport
+    from streaming import SensorStreamingConfig
+
+    def slow_cb(data):
+        time.sleep(0.05)
+
+    device = SpheroAPI("Sphero-SIM", "00:00:00:00:00:00", SimulatedTransport())
+    device.connect()
+    device.set_sensor_streaming_cb(slow_cb)
+
+    ssc = SensorStreamingConfig()
+    ssc.sample_rate = 200
+    ssc.stream_imu_angle()
+    device.set_data_streaming(ssc)
+
+    start = time.time()
+    for _ in xrange(100):
+        device.ping()
+    print "100 pings while streaming: %.3f sec" % (time.time() - start)
+    device.stop_data_streaming()
+    print device.dispatcher.stats()
+    device.disconnect()
@@ -20,4 +20,23 @@ class SpheroFatalError(SpheroError):
 class SpheroRequestError(SpheroError):
     """
     Exception used when a command has failed
-    """
\ No newline at end of file
+    """
+
+
+class SpheroTimeoutError(SpheroRequestError):
+    """
+    Exception used when no response to a command is received from the device
+    """
+
+
+class SpheroCancelledError(SpheroRequestError):
+    """
+    Exception used when a command is dropped before it was sent to the device
+    """
+
+
+class SpheroDeadlineError(SpheroRequestError):
+    """
+    Exception used when a command has missed its deadline. The command was either dropped before it was
+    sent to the device, or the response from the device arrived after the deadline
+    """
@@ -0,0 +1,280 @@
+# coding: utf-8
+"""
+Export of the metrics of Sphero devices in the Prometheus text format, over a local HTTP endpoint
+"""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import OrderedDict
+import json
+import threading
+
+QUANTILES = (('0.5', 'p50'), ('0.9', 'p90'), ('0.99', 'p99'), ('0.999', 'p999'))
+
+
+class _Family(object):
+    """
+    Helper class: The samples of one metric name
+    """
+
+    def __init__(self, name, metric_type, doc):
+        self.name = name
+        self.type = metric_type
+        self.doc = doc
+        self.samples = []
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+             for key, value in labels)
+    return '{' + ','.join(pairs) + '}'
+
+
+class PrometheusText(object):
+    """
+    Builds the Prometheus text format from the metrics dicts of devices, see SpheroAPI.metrics()
+    """
+
+    prefix = 'sphero_'
+
+    def __init__(self):
+        super(PrometheusText, self).__init__()
+        self._families = OrderedDict()
+
+    def add(self, name, metric_type, doc, labels, value):
+        """
+        Adds a sample, samples with the value None are skipped
+        :param name: The metric name, without prefix
+        :param metric_type: counter, gauge or summary
+        :param labels: List of (name, value) pairs
+        """
+        if value is None:
+            return
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = _Family(self.prefix + name, metric_type, doc)
+        family.samples.append((family.name, labels, value))
+
+    def add_summary(self, name, doc, labels, histogram):
+        """
+        Adds the quantiles, count and sum of a latency histogram dict, see metrics.LatencyHistogram.as_dict
+        """
+        if not histogram.get('count'):
+            return
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = _Family(self.prefix + name, 'summary', doc)
+        for quantile, key in QUANTILES:
+            family.samples.append((family.name, labels + [('quantile', quantile)], histogram[key]))
+        family.samples.append((family.name + '_sum', labels, histogram['sum']))
+        family.samples.append((family.name + '_count', labels, histogram['count']))
+
+    def add_device(self, name, metrics):
+        """
+        Adds all metrics of a device
+        :param name: The device label
+        :param metrics: The metrics of the device, see SpheroAPI.metrics()
+        :type metrics: dict
+        """
+        device = [('device', name)]
+        protocol = metrics['protocol']
+        framing = metrics['framing']
+        queues = metrics['queues']
+
+        self.add('connected', 'gauge', 'True if the device is connected', device, int(metrics['connected']))
+        self.add('bytes_received_total', 'counter', 'Bytes received from the device', device,
+                 protocol['bytes_in'])
+        self.add('bytes_sent_total', 'counter', 'Bytes sent to the device', device, protocol['bytes_out'])
+        self.add('frames_received_total', 'counter', 'Frames received from the device', device,
+                 protocol['frames_in'])
+        self.add('frames_sent_total', 'counter', 'Requests sent to the device', device, protocol['frames_out'])
+        self.add('frames_per_second', 'gauge', 'Frames received from the device per second', device,
+                 protocol['frames_per_second'])
+        for command, histogram in sorted(protocol['rtt'].items()):
+            self.add_summary('request_rtt_seconds', 'Round trip time of the acknowledged requests',
+                             device + [('command', command)], histogram)
+
+        self.add('checksum_errors_total', 'counter', 'Received frames with a wrong checksum', device,
+                 framing['checksum_errors'])
+        self.add('resyncs_total', 'counter', 'Times received bytes were discarded to find the next frame',
+                 device, framing['resyncs'])
+        self.add('discarded_bytes_total', 'counter', 'Received bytes discarded while finding frames', device,
+                 framing['discarded_bytes'])
+
+        self.add('requests_in_flight', 'gauge', 'Requests waiting for a response', device, queues['in_flight'])
+        for lane, stats in sorted(queues['lanes'].items()):
+            self.add('requests_queued', 'gauge', 'Requests waiting to be sent, by priority lane',
+                     device + [('lane', lane)], stats['queued'])
+        self.add('callbacks_pending', 'gauge', 'Callbacks waiting to run in the dispatcher', device,
+                 queues['callbacks_pending'])
+        for event_type, histogram in sorted(metrics['callbacks'].items()):
+            self.add_summary('callback_latency_seconds', 'Time from an event is dispatched until the callback '
+                             'runs', device + [('event', event_type)], histogram)
+
+        rtt = metrics['rtt']
+        self.add('rtt_smoothed_seconds', 'gauge', 'Smoothed round trip time', device, rtt['srtt'])
+        self.add('rtt_variance_seconds', 'gauge', 'Round trip time variance', device, rtt['rttvar'])
+        self.add('response_timeout_seconds', 'gauge', 'Current response timeout', device, rtt['rto'])
+        self.add('timeouts_total', 'counter', 'Requests that timed out', device, rtt['timeouts'])
+        for command, retries in sorted(metrics['retries'].items()):
+            self.add('request_retries_total', 'counter', 'Requests sent again after a timeout',
+                     device + [('command', command)], retries)
+        for command, counts in sorted(metrics['deadlines'].items()):
+            self.add('deadline_dropped_total', 'counter', 'Requests dropped before they were sent, the deadline '
+                     'had passed', device + [('command', command)], counts['dropped'])
+            self.add('deadline_late_total', 'counter', 'Responses received after the deadline',
+                     device + [('command', command)], counts['late'])
+
+        reconnect = metrics['reconnect']
+        self.add('connection_drops_total', 'counter', 'Connections lost while connected', device,
+                 reconnect['drops'])
+        self.add('reconnects_total', 'counter', 'Times the device was connected again', device,
+                 reconnect['reconnects'])
+        self.add('reconnect_seconds', 'gauge', 'Duration of the last reconnect', device,
+                 reconnect['last_duration'])
+
+        streaming = metrics['streaming']
+        self.add('streaming_packets_total', 'counter', 'Sensor data packets received', device,
+                 streaming['received'])
+        self.add('streaming_loss_ratio', 'gauge', 'Ratio of the expected sensor data packets not received',
+                 device, streaming['loss'])
+        self.add('streaming_jitter_seconds', 'gauge', 'Jitter of the sensor data packets', device,
+                 streaming['jitter'])
+
+    def render(self):
+        """
+        :return: The metrics in the Prometheus text format
+        :rtype: str
+        """
+        lines = []
+        for family in self._families.itervalues():
+            lines.append('# HELP {} {}'.format(family.name, family.doc))
+            lines.append('# TYPE {} {}'.format(family.name, family.type))
+            for name, labels, value in family.samples:
+                lines.append('{}{} {}'.format(name, _format_labels(labels), repr(float(value))))
+        return '\n'.join(lines) + '\n'
+
+
+def device_name(device):
+    """
+    :type device: sphero.SpheroAPI
+    :return: The label of the device, the bluetooth name or address
+    :rtype: str
+    """
+    return device.bt_name or device.bt_addr
+
+
+def prometheus_text(devices):
+    """
+    :param devices: The devices to export
+    :type devices: list of sphero.SpheroAPI
+    :return: The metrics of the devices in the Prometheus text format
+    :rtype: str
+    """
+    text = PrometheusText()
+    for device in devices:
+        text.add_device(device_name(device), device.metrics())
+    return text.render()
+
+
+class MetricsServer(object):
+    """
+    Local HTTP endpoint that serves the metrics of a set of devices.
+
+        /metrics: The Prometheus text format
+        /metrics.json: The metrics dict of each device, by device name
+
+    The metrics are read when requested, nothing is collected in the background.
+    """
+
+    def __init__(self, devices, port=9100, host='127.0.0.1'):
+        """
+        :param devices: The devices to export, or a function that returns them, e.g.
+        SpheroManager.get_connected_spheros
+        :type devices: list or function
+        :param port: The port to listen on, 0 for any free port
+        :param host: The address to listen on, defaults to local connections only
+        """
+        super(MetricsServer, self).__init__()
+        self._devices = devices
+        self._server = HTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return "http://{}:{}/metrics".format(host, port)
+
+    def devices(self):
+        return list(self._devices() if callable(self._devices) else self._devices)
+
+    def start(self):
+        """
+        Starts serving in a daemon thread
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._server.serve_forever, name="SpheroMetricsServerThread")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops serving and closes the socket
+        """
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def _handler(self):
+        """
+        Helper method: Creates the request handler class bound to this server
+        """
+        server = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path == '/metrics':
+                    body = prometheus_text(server.devices())
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif path == '/metrics.json':
+                    body = json.dumps(dict((device_name(device), device.metrics()) for device in server.devices()))
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                # Scrapes are not logged
+                pass
+
+        return MetricsHandler
+
+
+if __name__ == "__main__":
+    # SERVES THE METRICS OF A SIMULATED DEVICE
+    import time
+    import urllib2
+    from core import SpheroAPI
+    from simulator import SimulatedTransport
+
+    device = SpheroAPI("Sphero-SIM", "00:00:00:00:00:00", SimulatedTransport())
+    device.connect()
+    for _ in xrange(200):
+        device.ping()
+    device.get_power_state()
+
+    metrics_server = MetricsServer([device], port=0)
+    metrics_server.start()
+    time.sleep(0.1)
+    print urllib2.urlopen(metrics_server.url).read()
+    metrics_server.stop()
+    device.disconnect()
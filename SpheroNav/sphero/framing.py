@@ -0,0 +1,149 @@
+# coding: utf-8
+"""
+Buffered frame parser for the data received from the Sphero device
+"""
+import struct
+
+
+class FrameParser(object):
+    """
+    Collects the raw data received from the device in a reusable buffer and splits it into complete
+    sync (response) and async frames.
+
+    Frames are found by scanning for the start of packet byte 0xFF. Bytes in front of a valid header
+    are discarded, this removes broken data that periodically appears in the incoming data.
+    The number of removed bytes is counted in discarded_bytes, and the number of times bytes were removed
+    in resyncs.
+
+    When verify_checksums is set, a frame with a wrong checksum is counted in checksum_errors and the
+    parser resyncs from the byte after its start, since the frame was most likely found at the wrong
+    position in the data.
+    """
+
+    SOP1 = 0xFF
+    SOP2_RESPONSE = 0xFF
+    SOP2_ASYNC = 0xFE
+
+    HEADER_LENGTH = 5
+    DEFAULT_BUFFER_SIZE = 4096
+
+    _header = struct.Struct('5B')
+
+    def __init__(self, size=DEFAULT_BUFFER_SIZE):
+        self._buffer = bytearray(size)
+        self._start = 0
+        self._end = 0
+        self.verify_checksums = True
+        self.discarded_bytes = 0
+        self.resyncs = 0
+        self.checksum_errors = 0
+
+    def __len__(self):
+        """
+        :return: The number of received bytes not yet parsed into a frame
+        :rtype: int
+        """
+        return self._end - self._start
+
+    def reset(self):
+        """
+        Drops all buffered data, used when the connection is reset
+        """
+        self._start = 0
+        self._end = 0
+
+    def feed(self, data):
+        """
+        Adds received data to the end of the buffer
+        :param data: The raw data received from the device
+        :type data: str or bytearray
+        """
+        length = len(data)
+        if self._end + length > len(self._buffer):
+            self._make_room(length)
+        self._buffer[self._end:self._end + length] = data
+        self._end += length
+
+    def _make_room(self, length):
+        """
+        Helper method: Moves the unparsed data to the front of the buffer, the buffer is grown if the
+        unparsed data and the new data does not fit in the current buffer
+        :param length: The number of bytes that should fit behind the unparsed data
+        """
+        unparsed = self._end - self._start
+        if unparsed + length > len(self._buffer):
+            new_buffer = bytearray(max(2 * len(self._buffer), unparsed + length))
+            new_buffer[:unparsed] = self._buffer[self._start:self._end]
+            self._buffer = new_buffer
+        elif unparsed:
+            self._buffer[:unparsed] = self._buffer[self._start:self._end]
+        self._start = 0
+        self._end = unparsed
+
+    def _discard(self, num_bytes):
+        self.discarded_bytes += num_bytes
+        self.resyncs += 1
+        self._start += num_bytes
+
+    def next_frame(self):
+        """
+        Parses the next complete frame from the buffer.
+
+        The header of a sync response is returned as (SOP1, SOP2, MRSP, SEQ, DLEN) and the header of an
+        async message as (SOP1, SOP2, ID_CODE, DLEN). The body includes the checksum byte.
+        :return: Tuple of (header, body) or None if no complete frame is buffered
+        :rtype: tuple or None
+        """
+        buf = self._buffer
+        while True:
+            start = self._start
+            available = self._end - start
+            if not available:
+                self.reset()
+                return None
+
+            if buf[start] != self.SOP1:
+                next_sop = buf.find(b'\xff', start, self._end)
+                self._discard((self._end if next_sop < 0 else next_sop) - start)
+                continue
+
+            if available < self.HEADER_LENGTH:
+                if available > 1 and buf[start + 1] not in (self.SOP2_RESPONSE, self.SOP2_ASYNC):
+                    self._discard(1)
+                    continue
+                return None
+
+            sop1, sop2, field_1, field_2, field_3 = self._header.unpack_from(buf, start)
+            if sop2 == self.SOP2_RESPONSE:
+                dlen = field_3
+                header = (sop1, sop2, field_1, field_2, dlen)
+            elif sop2 == self.SOP2_ASYNC:
+                dlen = (field_2 << 8) + field_3
+                header = (sop1, sop2, field_1, dlen)
+            else:
+                self._discard(1)
+                continue
+
+            body_start = start + self.HEADER_LENGTH
+            frame_end = body_start + dlen
+            if frame_end > self._end:
+                return None
+
+            if self.verify_checksums and dlen and (~sum(buf[start + 2:frame_end - 1]) & 0xFF) != buf[frame_end - 1]:
+                self.checksum_errors += 1
+                self._discard(1)
+                continue
+
+            body = memoryview(buf)[body_start:frame_end].tobytes()
+            self._start = frame_end
+            return header, body
+
+    def frames(self):
+        """
+        Generator that yields all complete frames in the buffer
+        :return: Tuples of (header, body)
+        """
+        frame = self.next_frame()
+        while frame is not None:
+            yield frame
+            frame = self.next_frame()
@@ -0,0 +1,287 @@
+# coding: utf-8
+"""
+Sensor fusion of the data streamed from a Sphero device, run on the host
+"""
+import numpy as np
+
+from constants import *
+from history import SensorHistory
+
+# Units of the raw streamed values, same as the sensor classes in sphero.streaming
+GYRO_DPS_UNIT = 0.1
+ACC_G_UNIT = 1.0 / 4096.0
+VELOCITY_CM_UNIT = 0.1
+
+# Longest chunk of samples filtered in closed form, and the smallest power of alpha used in a chunk
+MAX_FILTER_CHUNK = 128
+MIN_FILTER_POWER = 1e-6
+
+
+def exponential_filter(u, alpha, y0):
+    """
+    Runs the first order filter y[k] = alpha * y[k - 1] + u[k] over all samples in u at once.
+
+    The filter is evaluated in closed form, y[k] = alpha^(k+1) * (y0 + sum(u[j] / alpha^(j+1), j <= k)),
+    in chunks short enough to keep the powers of alpha well conditioned. The chunk length is derived from
+    alpha so the smallest power stays above MIN_FILTER_POWER, a small alpha is filtered sample by sample.
+    :param u: The input, one row for each sample
+    :type u: numpy.ndarray
+    :param alpha: The filter coefficient in the range 0.0 - 1.0
+    :param y0: The output of the sample before the first sample in u
+    :return: The output for each sample
+    :rtype: numpy.ndarray
+    """
+    if alpha <= 0.0:
+        return u.copy()
+    if alpha >= 1.0:
+        return y0 + np.cumsum(u, axis=0)
+
+    out = np.empty_like(u)
+    chunk = min(MAX_FILTER_CHUNK, int(np.log(MIN_FILTER_POWER) / np.log(alpha)))
+    if chunk < 2:
+        for i in xrange(len(u)):
+            y0 = out[i] = alpha * y0 + u[i]
+        return out
+
+    powers = alpha ** np.arange(1, chunk + 1, dtype=np.float64)
+    if u.ndim > 1:
+        powers = powers.reshape((chunk,) + (1,) * (u.ndim - 1))
+    for start in xrange(0, len(u), chunk):
+        block = u[start:start + chunk]
+        p = powers[:len(block)]
+        out[start:start + chunk] = p * (y0 + np.cumsum(block / p, axis=0))
+        y0 = out[start + len(block) - 1]
+    return out
+
+
+class PoseHistory(SensorHistory):
+    """
+    Ring buffer of the estimated poses of a device
+    """
+    DTYPE = np.float64
+
+    NAMES = ('x', 'y', 'vx', 'vy', 'roll', 'pitch', 'yaw')
+
+
+class PoseEstimator(object):
+    """
+    Estimates the orientation and position of a device from batches of streamed samples.
+
+    Orientation:
+        Roll and pitch are tracked with a complementary filter. The angles integrated from the gyro are
+        blended with the tilt measured by the accelerometer. Yaw is the IMU yaw angle of the device when
+        it is streamed, and is integrated from the gyro otherwise.
+
+    Position:
+        The streamed velocity is integrated and blended with the odometer of the device, which removes
+        the drift of the integration and smooths the odometer.
+
+    All values of a batch are scaled and filtered with numpy in one pass. The poses are added to a
+    PoseHistory at the streaming rate, in cm, cm/sec and degrees. Values that can not be estimated from
+    the streamed data are NaN.
+    """
+
+    def __init__(self, capacity=4096, attitude_alpha=0.98, position_alpha=0.9):
+        """
+        :param capacity: The number of poses kept in the history
+        :param attitude_alpha: Weight of the integrated gyro against the accelerometer tilt, 0.0 - 1.0
+        :param position_alpha: Weight of the integrated velocity against the odometer, 0.0 - 1.0
+        """
+        super(PoseEstimator, self).__init__()
+        self.attitude_alpha = attitude_alpha
+        self.position_alpha = position_alpha
+        self.history = PoseHistory(capacity, PoseHistory.NAMES)
+
+        self._columns = {}
+        self.reset()
+
+    def reset(self):
+        """
+        Resets the estimated pose to the origin, and clears the history
+        """
+        self._last_timestamp = None
+        self._attitude = np.zeros(2)
+        self._yaw = 0.0
+        self._position = None
+        self.history.reset()
+
+    @property
+    def pose(self):
+        """
+        The newest estimated pose, or None if nothing is estimated
+        :return: Dict of x, y, vx, vy, roll, pitch and yaw
+        :rtype: dict or None
+        """
+        times, poses = self.history.latest(1)
+        if not len(times):
+            return None
+        return dict(zip(PoseHistory.NAMES, poses[0]))
+
+    def add_packet(self, streaming_data):
+        """
+        Adds all frames of a received streaming packet
+        :type streaming_data: sphero.streaming.SensorStreamingResponse
+        """
+        self.update(streaming_data.timestamps, streaming_data.layout.names, streaming_data.frames)
+
+    def update(self, timestamps, names, frames):
+        """
+        Estimates the poses of a batch of samples, and adds them to the history
+        :param timestamps: The time of each sample
+        :type timestamps: numpy.ndarray
+        :param names: The names of the columns in frames
+        :type names: tuple
+        :param frames: The raw streamed values, of shape (samples, number of values)
+        :type frames: numpy.ndarray
+        """
+        if not len(timestamps):
+            return
+        columns = self._find_columns(names)
+        frames = frames.astype(np.float64)
+
+        dt = self._time_steps(timestamps)
+        self._last_timestamp = timestamps[-1]
+
+        poses = np.empty((len(timestamps), len(PoseHistory.NAMES)))
+        poses[:, 4:6] = self._estimate_attitude(columns, frames, dt)
+        poses[:, 6] = self._estimate_yaw(columns, frames, dt)
+        poses[:, 0:4] = self._estimate_position(columns, frames, dt)
+        self.history.extend(timestamps, poses)
+
+    def _time_steps(self, timestamps):
+        """
+        Helper method: Returns the seconds from the previous sample to each sample
+        """
+        dt = np.empty(len(timestamps))
+        dt[0] = timestamps[0] - self._last_timestamp if self._last_timestamp is not None else 0.0
+        dt[1:] = timestamps[1:] - timestamps[:-1]
+        return dt
+
+    def _find_columns(self, names):
+        """
+        Helper method: Returns the column indexes of the values used by the estimator, cached by names
+        """
+        try:
+            return self._columns[names]
+        except KeyError:
+            index = dict((name, i) for i, name in enumerate(names))
+
+            def find(*keys):
+                if all(key in index for key in keys):
+                    return [index[key] for key in keys]
+                return None
+
+            columns = self._columns[names] = {
+                'gyro': find(KEY_STRM_GYRO_X, KEY_STRM_GYRO_Y, KEY_STRM_GYRO_Z),
+                'acc': find(KEY_STRM_ACC_X, KEY_STRM_ACC_Y, KEY_STRM_ACC_Z),
+                'yaw': find(KEY_STRM_IMU_YAW_ANGLE),
+                'velocity': find(KEY_STRM_VELOCITY_X, KEY_STRM_VELOCITY_Y),
+                'odometer': find(KEY_STRM_ODOMETER_X, KEY_STRM_ODOMETER_Y),
+            }
+            return columns
+
+    def _estimate_attitude(self, columns, frames, dt):
+        """
+        Helper method: Complementary filter of roll and pitch
+        """
+        if columns['gyro'] is None and columns['acc'] is None:
+            return np.nan
+
+        alpha = self.attitude_alpha
+        if columns['gyro'] is not None:
+            rates = frames[:, columns['gyro'][:2]] * GYRO_DPS_UNIT
+            integrated = rates * dt[:, np.newaxis]
+        else:
+            integrated = 0.0
+            alpha = 0.0
+
+        if columns['acc'] is not None:
+            acc = frames[:, columns['acc']] * ACC_G_UNIT
+            tilt = np.empty((len(frames), 2))
+            tilt[:, 0] = np.degrees(np.arctan2(acc[:, 1], acc[:, 2]))
+            tilt[:, 1] = np.degrees(np.arctan2(-acc[:, 0], np.hypot(acc[:, 1], acc[:, 2])))
+        else:
+            tilt = 0.0
+            alpha = 1.0
+
+        u = alpha * integrated + (1.0 - alpha) * tilt
+        attitude = exponential_filter(u, alpha, self._attitude)
+        self._attitude = attitude[-1].copy()
+        return attitude
+
+    def _estimate_yaw(self, columns, frames, dt):
+        """
+        Helper method: Yaw from the IMU of the device, or integrated from the gyro
+        """
+        if columns['yaw'] is not None:
+            yaw = frames[:, columns['yaw'][0]]
+        elif columns['gyro'] is not None:
+            yaw = self._yaw + np.cumsum(frames[:, columns['gyro'][2]] * GYRO_DPS_UNIT * dt)
+        else:
+            return np.nan
+        yaw = (yaw + 180.0) % 360.0 - 180.0
+        self._yaw = yaw[-1]
+        return yaw
+
+    def _estimate_position(self, columns, frames, dt):
+        """
+        Helper method: Position and velocity from the integrated velocity blended with the odometer
+        """
+        result = np.empty((len(frames), 4))
+        result.fill(np.nan)
+        has_velocity = columns['velocity'] is not None
+        has_odometer = columns['odometer'] is not None
+        if not has_velocity and not has_odometer:
+            return result
+
+        if has_velocity:
+            velocity = frames[:, columns['velocity']] * VELOCITY_CM_UNIT
+            result[:, 2:4] = velocity
+            integrated = velocity * dt[:, np.newaxis]
+        else:
+            integrated = np.zeros((len(frames), 2))
+
+        if has_odometer:
+            odometer = frames[:, columns['odometer']]
+            alpha = self.position_alpha if has_velocity else 1.0 - self.position_alpha
+            if self._position is None:
+                self._position = odometer[0].copy()
+        else:
+            odometer = 0.0
+            alpha = 1.0
+            if self._position is None:
+                self._position = np.zeros(2)
+
+        u = alpha * integrated + (1.0 - alpha) * odometer
+        position = exponential_filter(u, alpha, self._position)
+        self._position = position[-1].copy()
+        result[:, 0:2] = position
+        return result
+
+
+if __name__ == "__main__":
+    # ESTIMATES THE POSE OF A SIMULATED DEVICE
+    import time
+    from core import SpheroAPI
+    from simulator import SimulatedTransport
+    from streaming import SensorStreamingConfig
+
+    device = SpheroAPI("Sphero-SIM", "00:00:00:00:00:00", SimulatedTransport())
+    device.connect()
+    estimator = device.enable_pose_estimation()
+
+    ssc = SensorStreamingConfig()
+    ssc.sample_rate = 200
+    ssc.m = 5
+    ssc.stream_gyro()
+    ssc.stream_acc()
+    ssc.stream_imu_angle()
+    ssc.stream_velocity()
+    ssc.stream_odometer()
+    device.set_data_streaming(ssc)
+    time.sleep(1.0)
+    device.stop_data_streaming()
+    device.disconnect()
+
+    print "poses:", len(estimator.history)
+    print "pose:", estimator.pose
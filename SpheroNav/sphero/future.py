@@ -0,0 +1,117 @@
+# coding: utf-8
+"""
+Futures for requests sent to the Sphero device
+"""
+import threading
+import time
+
+from error import SpheroTimeoutError
+
+
+class ResponseFuture(object):
+    """
+    The pending response of a request sent to the device.
+
+    The future is completed by the receiver when the response with the same sequence number as the
+    request arrives.
+    """
+
+    def __init__(self, packet):
+        """
+        :param packet: The request this future is the response of
+        :type packet: request.Request
+        """
+        super(ResponseFuture, self).__init__()
+        self.request = packet
+        self.sent_at = None
+        self.received_at = None
+        # Time the response is useless after, see SpheroAPI._write
+        self.deadline = None
+
+        self._done = threading.Event()
+        self._completed = False
+        self._lock = threading.Lock()
+        self._response = None
+        self._error = None
+        self._callbacks = []
+
+    @property
+    def seq(self):
+        return self.request.seq
+
+    def done(self):
+        """
+        :return: True if the response has arrived or the request has failed
+        :rtype: bool
+        """
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the future is done or the timeout expires
+        :param timeout: Max seconds to wait, None to wait forever
+        :return: True if the future is done
+        :rtype: bool
+        """
+        return self._done.wait(timeout)
+
+    def result(self, timeout=None):
+        """
+        Returns the response of the request, blocks until it has arrived
+        :param timeout: Max seconds to wait, None to wait forever
+        :rtype: response.Response
+        :raise SpheroError: If the request failed or timed out
+        """
+        if not self.wait(timeout):
+            raise SpheroTimeoutError('No response received from device before timeout')
+        if self._error is not None:
+            raise self._error
+        return self._response
+
+    def exception(self, timeout=None):
+        """
+        Returns the error the request failed with, or None if it succeeded
+        :rtype: Exception or None
+        """
+        self.wait(timeout)
+        return self._error
+
+    def add_done_callback(self, fn):
+        """
+        Adds a callback that is called with this future when it is done.
+        Is called immediately if the future is already done.
+        :param fn: The callback
+        """
+        with self._lock:
+            if not self._completed:
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_result(self, response):
+        """
+        Completes the future with the received response
+        :return: False if the future was already done
+        """
+        return self._complete(response, None)
+
+    def set_exception(self, error):
+        """
+        Completes the future with an error
+        :return: False if the future was already done
+        """
+        return self._complete(None, error)
+
+    def _complete(self, response, error):
+        with self._lock:
+            if self._completed:
+                return False
+            self._completed = True
+            self._response = response
+            self._error = error
+            self.received_at = time.time()
+            callbacks, self._callbacks = self._callbacks, []
+        self._done.set()
+        for callback in callbacks:
+            callback(self)
+        return True
@@ -0,0 +1,222 @@
+# coding: utf-8
+"""
+History of the sensor data streamed from a Sphero device
+"""
+import threading
+
+import numpy as np
+
+
+class SensorHistory(object):
+    """
+    Fixed capacity ring buffer of streamed sensor samples, stored column wise in numpy arrays.
+
+    There is one column for each value in the streaming config, and a timestamp for each sample. Every
+    sample is written twice, to two mirrored halves of the buffer, so the newest samples are always
+    contiguous in memory. Queries therefore return views into the buffer instead of copies, and time range
+    queries are binary searches in the timestamps.
+
+    The views are overwritten when the buffer wraps around, copy the returned arrays if they are kept.
+
+    The time range queries need sorted timestamps, so a sample older than the newest sample in the history
+    gets the timestamp of the newest sample. These samples are counted in clamped.
+    """
+
+    DTYPE = np.int16
+
+    def __init__(self, capacity=4096, names=()):
+        """
+        :param capacity: The max number of samples kept
+        :type capacity: int
+        :param names: The names of the streamed values, see the streaming keys in sphero.constants
+        :type names: tuple
+        """
+        super(SensorHistory, self).__init__()
+        if capacity <= 0:
+            raise ValueError("Capacity must be larger than 0")
+        self.capacity = capacity
+        self._lock = threading.RLock()
+        self.reset(names)
+
+    def reset(self, names=None):
+        """
+        Removes all samples from the history
+        :param names: New names of the columns, the current columns are kept if not given
+        :type names: tuple
+        """
+        with self._lock:
+            if names is not None:
+                self.names = tuple(names)
+                self._index = dict((name, i) for i, name in enumerate(self.names))
+            self._values = np.zeros((2 * self.capacity, len(self.names)), dtype=self.DTYPE)
+            self._times = np.zeros(2 * self.capacity, dtype=np.float64)
+            self._next = 0
+            self._size = 0
+            self.clamped = 0
+
+    def __len__(self):
+        return self._size
+
+    def index(self, name):
+        """
+        Returns the column of the given value
+        :param name: Streaming key of the value
+        :rtype: int
+        :raise KeyError: If the value is not streamed
+        """
+        return self._index[name]
+
+    def append(self, timestamp, values):
+        """
+        Adds a sample to the history
+        :param timestamp: The time of the sample
+        :type timestamp: float
+        :param values: The values of the sample, ordered as the names of the history
+        :type values: tuple
+        """
+        self.extend(np.array((timestamp,), dtype=np.float64), np.array((values,), dtype=self.DTYPE))
+
+    def extend(self, timestamps, frames):
+        """
+        Adds several samples to the history
+        :param timestamps: The time of each sample
+        :type timestamps: numpy.ndarray
+        :param frames: Array of shape (samples, number of values), ordered as the names of the history
+        :type frames: numpy.ndarray
+        """
+        count = len(timestamps)
+        if count > self.capacity:
+            timestamps = timestamps[-self.capacity:]
+            frames = frames[-self.capacity:]
+            count = self.capacity
+
+        with self._lock:
+            timestamps = self._monotonic(timestamps)
+            start = self._next
+            first = min(count, self.capacity - start)
+            rest = count - first
+            for offset in (0, self.capacity):
+                self._times[offset + start:offset + start + first] = timestamps[:first]
+                self._values[offset + start:offset + start + first] = frames[:first]
+                if rest:
+                    self._times[offset:offset + rest] = timestamps[first:]
+                    self._values[offset:offset + rest] = frames[first:]
+            self._next = (start + count) % self.capacity
+            self._size = min(self._size + count, self.capacity)
+
+    def _monotonic(self, timestamps):
+        """
+        Helper method: Clamps the timestamps so they never decrease, must be called with the lock held
+        """
+        newest = self._times[self._next + self.capacity - 1] if self._size else -np.inf
+        clamped = np.maximum.accumulate(np.maximum(timestamps, newest))
+        self.clamped += int(np.count_nonzero(clamped != timestamps))
+        return clamped
+
+    def add_packet(self, streaming_data):
+        """
+        Adds all frames of a received streaming packet. The history is reset if the packet is streamed
+        with other values than the ones in the history
+        :type streaming_data: sphero.streaming.SensorStreamingResponse
+        """
+        if streaming_data.layout.names != self.names:
+            self.reset(streaming_data.layout.names)
+        self.extend(streaming_data.timestamps, streaming_data.frames)
+
+    def _range(self):
+        """
+        Helper method: Returns the start and end of the contiguous samples in the mirrored buffer
+        """
+        end = self._next + self.capacity
+        return end - self._size, end
+
+    def latest(self, k=1):
+        """
+        Returns the newest samples
+        :param k: Max number of samples
+        :return: The timestamps and the values of the samples, from the oldest to the newest
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        with self._lock:
+            start, end = self._range()
+            start = max(start, end - k)
+            return self._times[start:end], self._values[start:end]
+
+    def window(self, t0, t1):
+        """
+        Returns the samples in the time range t0 <= timestamp <= t1
+        :return: The timestamps and the values of the samples, from the oldest to the newest
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        with self._lock:
+            start, end = self._range()
+            times = self._times[start:end]
+            first = times.searchsorted(t0, side='left')
+            last = times.searchsorted(t1, side='right')
+            return times[first:last], self._values[start + first:start + last]
+
+    def at(self, t):
+        """
+        Returns the values at the given time, linearly interpolated between the two closest samples.
+        Times outside of the history get the values of the oldest or newest sample
+        :return: The values, ordered as the names of the history
+        :rtype: numpy.ndarray
+        :raise IndexError: If the history is empty
+        """
+        with self._lock:
+            if not self._size:
+                raise IndexError("The sensor history is empty")
+            start, end = self._range()
+            times = self._times[start:end]
+            i = times.searchsorted(t, side='right')
+            if i == 0:
+                return self._values[start].astype(np.float64)
+            if i == len(times):
+                return self._values[end - 1].astype(np.float64)
+
+            t_before, t_after = times[i - 1], times[i]
+            before = self._values[start + i - 1].astype(np.float64)
+            after = self._values[start + i]
+            if t_after == t_before:
+                return before
+            weight = (t - t_before) / (t_after - t_before)
+            return before + (after - before) * weight
+
+    def column(self, name, k=None):
+        """
+        Returns the history of one value
+        :param name: Streaming key of the value
+        :param k: Max number of samples, all samples if not given
+        :return: The timestamps and the values, from the oldest to the newest
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        times, values = self.latest(k if k is not None else self.capacity)
+        return times, values[:, self.index(name)]
+
+
+if __name__ == "__main__":
+    # KEEPS THE HISTORY OF A SIMULATED DEVICE
+    import time
+    from core import SpheroAPI
+    from constants import KEY_STRM_IMU_YAW_ANGLE
+    from simulator import SimulatedTransport
+    from streaming import SensorStreamingConfig
+
+    device = SpheroAPI("Sphero-SIM", "00:00:00:00:00:00", SimulatedTransport())
+    device.connect()
+    history = device.enable_history(capacity=1000)
+
+    ssc = SensorStreamingConfig()
+    ssc.sample_rate = 100
+    ssc.m = 4
+    ssc.stream_imu_angle()
+    device.set_data_streaming(ssc)
+    time.sleep(2.0)
+    device.stop_data_streaming()
+
+    now = time.time()
+    times, values = history.window(now - 1.5, now - 1.0)
+    print "samples:", len(history), "in window:", len(times)
+    print "yaw 1.2 sec ago:", history.at(now - 1.2)[history.index(KEY_STRM_IMU_YAW_ANGLE)]
+    print "latest:", history.latest(3)[1]
+    device.disconnect()
@@ -3,6 +3,8 @@ from threading import Thread
 import threading
 import time
 from sphero import SpheroAPI
+from sphero.reactor import SpheroReactor
+from sphero.dispatcher import CallbackDispatcher
 
 
 class SpheroManager:
@@ -17,7 +19,15 @@ class SpheroManager:
 
     SPHERO_BASE_NAME = "Sphero-"
 
-    def __init__(self):
+    def __init__(self, use_reactor=False, dispatcher_workers=None):
+        """
+        :param use_reactor: Receive data for all devices from a single shared thread instead of one
+        receiver thread per device
+        :type use_reactor: bool
+        :param dispatcher_workers: Run the callbacks of all devices on one shared dispatcher with this number
+        of worker threads, instead of one dispatcher per device
+        :type dispatcher_workers: int or None
+        """
         self._name_cache = {"68:86:E7:02:3A:AE": "Sphero-RWO",
                             "68:86:E7:03:22:95": "Sphero-ORB",
                             "68:86:E7:03:24:54": "Sphero-YGY"}
@@ -30,6 +40,9 @@ class SpheroManager:
 
         self._sphero_found_cb = None
 
+        self._reactor = SpheroReactor() if use_reactor else None
+        self._dispatcher = CallbackDispatcher(dispatcher_workers) if dispatcher_workers else None
+
     def get_device_by_name(self, name):
         """
         Gets a device by its name
@@ -146,7 +159,7 @@ class SpheroManager:
         :type bt_name: str
         """
         if bt_name not in self._spheros:
-            new_sphero = SpheroAPI(bt_name, bt_addr)
+            new_sphero = SpheroAPI(bt_name, bt_addr, reactor=self._reactor, dispatcher=self._dispatcher)
             self._spheros[bt_name] = new_sphero
             self._notify_sphero_found(new_sphero)
 
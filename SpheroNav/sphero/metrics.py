@@ -0,0 +1,407 @@
+# coding: utf-8
+"""
+Counters and statistics collected for a Sphero device
+"""
+from collections import Counter
+import time
+
+
+class DeliveryStats(object):
+    """
+    Counts requests sent without asking the device for a response.
+
+    Their delivery can not be observed directly. It is estimated from acknowledged requests of the same
+    types (probes), that are sent in between the unacknowledged ones.
+    """
+
+    def __init__(self):
+        super(DeliveryStats, self).__init__()
+        self.unacknowledged_sent = 0
+        self.probes_sent = 0
+        self.probes_acknowledged = 0
+        self.probes_lost = 0
+
+    def reset(self):
+        self.__init__()
+
+    @property
+    def delivery_ratio(self):
+        """
+        The ratio of the completed probes that was acknowledged by the device
+        :return: Ratio in the range 0.0 - 1.0, or None if no probe has completed
+        :rtype: float or None
+        """
+        completed = self.probes_acknowledged + self.probes_lost
+        if not completed:
+            return None
+        return float(self.probes_acknowledged) / completed
+
+    @property
+    def estimated_delivered(self):
+        """
+        Estimate of how many of the unacknowledged requests that reached the device
+        :rtype: float or None
+        """
+        ratio = self.delivery_ratio
+        if ratio is None:
+            return None
+        return self.unacknowledged_sent * ratio
+
+    def __str__(self):
+        return "unacknowledged: {}, probes: {} (acknowledged: {}, lost: {}), delivery ratio: {}".format(
+            self.unacknowledged_sent,
+            self.probes_sent,
+            self.probes_acknowledged,
+            self.probes_lost,
+            self.delivery_ratio
+        )
+
+
+class DeadlineStats(object):
+    """
+    Counts the commands that missed their deadline, by command type
+    """
+
+    def __init__(self):
+        super(DeadlineStats, self).__init__()
+        # Commands dropped before they were sent to the device
+        self.dropped = Counter()
+        # Commands answered after their deadline
+        self.late = Counter()
+
+    def reset(self):
+        self.__init__()
+
+    def as_dict(self):
+        """
+        :return: Dict of the dropped and late counts, by name of the command type
+        :rtype: dict
+        """
+        names = set(self.dropped) | set(self.late)
+        return dict((name, {'dropped': self.dropped[name], 'late': self.late[name]}) for name in names)
+
+    def __str__(self):
+        return "dropped: {}, late: {}".format(dict(self.dropped), dict(self.late))
+
+
+class ReconnectStats(object):
+    """
+    Counts the lost connections to a device and the time it took to connect again
+    """
+
+    def __init__(self):
+        super(ReconnectStats, self).__init__()
+        # Connections lost while connected
+        self.drops = 0
+        # Attempts to connect again, and the drops that ended connected again or gave up
+        self.attempts = 0
+        self.reconnects = 0
+        self.failures = 0
+        # Settings that could not be sent again after connecting
+        self.replay_failures = 0
+        # Unacknowledged requests dropped while connecting
+        self.unacknowledged_dropped = 0
+        self.last_duration = None
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+
+    def reset(self):
+        self.__init__()
+
+    def reconnected(self, duration):
+        """
+        Adds a reconnect
+        :param duration: Seconds from the connection was lost until the device was set up again
+        """
+        self.reconnects += 1
+        self.last_duration = duration
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+
+    @property
+    def mean_duration(self):
+        """
+        Mean seconds from the connection was lost until the device was set up again
+        :rtype: float or None
+        """
+        return self.total_duration / self.reconnects if self.reconnects else None
+
+    def as_dict(self):
+        return {
+            'drops': self.drops,
+            'attempts': self.attempts,
+            'reconnects': self.reconnects,
+            'failures': self.failures,
+            'replay_failures': self.replay_failures,
+            'unacknowledged_dropped': self.unacknowledged_dropped,
+            'last_duration': self.last_duration,
+            'mean_duration': self.mean_duration,
+            'max_duration': self.max_duration,
+        }
+
+    def __str__(self):
+        return "drops: {}, reconnects: {} (attempts: {}, failures: {}), mean duration: {}".format(
+            self.drops,
+            self.reconnects,
+            self.attempts,
+            self.failures,
+            self.mean_duration
+        )
+
+
+class StreamingStats(object):
+    """
+    Tracks the sensor data packets received from the device against the packets expected from the
+    active streaming config.
+
+    The expected packet rate is the configured sample rate, MAX_SAMPLE_RATE_SPHERO / n, divided by the
+    m frames sent in each packet. Jitter is the smoothed deviation of the packet inter arrival time from
+    the expected interval, as the interarrival jitter of RTP (RFC 3550).
+    """
+
+    def __init__(self):
+        super(StreamingStats, self).__init__()
+        self.packet_rate = 0.0
+        self.max_packets = 0
+        self.started_at = None
+        self.received = 0
+        self.jitter = 0.0
+        self._last_arrival = None
+
+    def reset(self):
+        self.__init__()
+
+    def start(self, ssc, now=None):
+        """
+        Starts tracking a new streaming config
+        :type ssc: sphero.streaming.SensorStreamingConfig
+        """
+        self.reset()
+        if ssc.n and (ssc.mask1 or ssc.mask2):
+            self.packet_rate = ssc.packet_rate
+            self.max_packets = ssc.num_packets
+            self.started_at = now if now is not None else time.time()
+
+    def on_packet(self, timestamp):
+        """
+        Registers a received streaming packet
+        :param timestamp: The time the packet was received
+        """
+        self.received += 1
+        if self._last_arrival is not None and self.packet_rate:
+            deviation = abs((timestamp - self._last_arrival) - 1.0 / self.packet_rate)
+            self.jitter += (deviation - self.jitter) / 16.0
+        self._last_arrival = timestamp
+
+    def expected(self, now=None):
+        """
+        The number of packets the device should have sent since streaming started
+        :rtype: float
+        """
+        if self.started_at is None:
+            return 0.0
+        now = now if now is not None else time.time()
+        expected = max(now - self.started_at, 0.0) * self.packet_rate
+        if self.max_packets:
+            expected = min(expected, self.max_packets)
+        return expected
+
+    def loss(self, now=None):
+        """
+        The ratio of the expected packets that was not received
+        :return: Ratio in the range 0.0 - 1.0, or None if no packets are expected
+        :rtype: float or None
+        """
+        expected = self.expected(now)
+        if expected < 1.0:
+            return None
+        return max(0.0, 1.0 - self.received / expected)
+
+    def as_dict(self, now=None):
+        return {
+            'packet_rate': self.packet_rate,
+            'received': self.received,
+            'expected': self.expected(now),
+            'loss': self.loss(now),
+            'jitter': self.jitter,
+        }
+
+    def __str__(self):
+        return "packet rate: {}, received: {}, loss: {}, jitter: {}".format(
+            self.packet_rate, self.received, self.loss(), self.jitter)
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of latencies with log-linear buckets, as in HdrHistogram.
+
+    Values are recorded in microseconds. Every power of two range is split in 2^significant_bits buckets,
+    so a value is known to within 1 / 2^significant_bits of itself, 12.5% with the default of 3 bits. A
+    value is recorded with a few integer operations, and the number of buckets grows with the log of the
+    largest value.
+    """
+
+    def __init__(self, significant_bits=3):
+        """
+        :param significant_bits: Number of bits of the value kept in the bucket index
+        """
+        super(LatencyHistogram, self).__init__()
+        self.significant_bits = significant_bits
+        self._half = 1 << significant_bits
+        self.reset()
+
+    def reset(self):
+        self._counts = [0] * (2 * self._half)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        """
+        Helper method: The bucket index of a value in microseconds
+        """
+        shift = max(0, value.bit_length() - self.significant_bits - 1)
+        return (shift << self.significant_bits) + (value >> shift)
+
+    def _upper_bound(self, index):
+        """
+        Helper method: The highest value in microseconds in the bucket with the given index
+        """
+        shift = max(0, (index >> self.significant_bits) - 1)
+        return (((index - (shift << self.significant_bits)) + 1) << shift) - 1
+
+    def record(self, seconds):
+        """
+        Adds a latency
+        :param seconds: The latency in seconds
+        :type seconds: float
+        """
+        index = self._index(max(0, int(seconds * 1e6)))
+        if index >= len(self._counts):
+            self._counts.extend([0] * (index + 1 - len(self._counts)))
+        self._counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self):
+        """
+        :rtype: float or None
+        """
+        return self.total / self.count if self.count else None
+
+    def percentile(self, percent):
+        """
+        The latency that percent of the recorded latencies are below
+        :param percent: In the range 0.0 - 100.0
+        :return: The latency in seconds, or None if nothing is recorded
+        :rtype: float or None
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(round(percent / 100.0 * self.count)))
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                return min(self._upper_bound(index) / 1e6, self.max)
+        return self.max
+
+    def buckets(self):
+        """
+        :return: The upper bound in seconds and the count of each bucket with recorded latencies
+        :rtype: list of (float, int)
+        """
+        return [(self._upper_bound(index) / 1e6, count) for index, count in enumerate(self._counts) if count]
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'mean': self.mean,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+        }
+
+    def __str__(self):
+        if not self.count:
+            return "count: 0"
+        return "count: {}, mean: {:.6f}, p50: {:.6f}, p99: {:.6f}, max: {:.6f}".format(
+            self.count, self.mean, self.percentile(50), self.percentile(99), self.max)
+
+
+class ProtocolMetrics(object):
+    """
+    Counters of the data sent to and received from a device, and the round trip times of the requests
+    by command
+    """
+
+    def __init__(self):
+        super(ProtocolMetrics, self).__init__()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.frames_in = 0
+        self.frames_out = 0
+        # Round trip times by request type
+        self.rtt = {}
+        self.frames_per_second = 0.0
+        self._window_start = time.time()
+        self._window_frames = 0
+
+    def reset(self):
+        self.__init__()
+
+    def on_sent(self, num_bytes):
+        """
+        Registers a request sent to the device
+        """
+        self.bytes_out += num_bytes
+        self.frames_out += 1
+
+    def on_received(self, num_bytes, num_frames, now=None):
+        """
+        Registers a chunk of data received from the device
+        :param num_bytes: The size of the chunk
+        :param num_frames: The number of complete frames parsed from the chunk
+        """
+        self.bytes_in += num_bytes
+        self.frames_in += num_frames
+        self._window_frames += num_frames
+        now = now if now is not None else time.time()
+        elapsed = now - self._window_start
+        if elapsed >= 1.0:
+            self.frames_per_second = self._window_frames / elapsed
+            self._window_start = now
+            self._window_frames = 0
+
+    def record_rtt(self, packet, rtt):
+        """
+        Adds the round trip time of an acknowledged request
+        :type packet: sphero.request.Request
+        :param rtt: Seconds from the request was sent until the response was received
+        """
+        request_class = type(packet)
+        histogram = self.rtt.get(request_class)
+        if histogram is None:
+            histogram = self.rtt[request_class] = LatencyHistogram()
+        histogram.record(rtt)
+
+    def as_dict(self):
+        return {
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'frames_in': self.frames_in,
+            'frames_out': self.frames_out,
+            'frames_per_second': self.frames_per_second,
+            'rtt': dict((request_class.__name__, histogram.as_dict())
+                        for request_class, histogram in self.rtt.items()),
+        }
@@ -0,0 +1,237 @@
+# coding: utf-8
+"""
+Adaptive rate control of the sensor data streamed from a Sphero device
+"""
+import copy
+import threading
+
+from error import SpheroError
+
+
+class StreamingRateController(object):
+    """
+    Steps the sample rate and the frames per packet of the active streaming config to stay just below the
+    rate where the connection saturates.
+
+    Every interval the packets received from the device since the last interval are compared with the
+    packets expected from the streaming config, see SpheroAPI.streaming_stats. The rate is adjusted as AIMD
+    congestion control:
+
+        - Clear link: The sample rate is increased by increase_step samples/sec, until max_rate. At max_rate
+          the frames per packet, m, is halved to lower the latency of the samples.
+        - Congested link, loss above max_loss or jitter above max_jitter: m is doubled first, which keeps
+          the sample rate but halves the number of packets. When m is at max_m the sample rate is
+          multiplied by decrease_factor, down to min_rate.
+
+    The link is measured over at least min_packets expected packets, so low packet rates are adjusted less
+    often than the interval. Only configs that stream forever are controlled. The new config is sent
+    without blocking, and the link is measured again after the device has accepted it.
+
+    The controller runs in its own thread, so it only controls the blocking SpheroAPI, not the devices of
+    sphero.aio.
+    """
+
+    min_packets = 20
+
+    def __init__(self, device, min_rate=10, max_rate=400, max_m=16, max_loss=0.02, max_jitter=0.5,
+                 increase_step=10.0, decrease_factor=0.5, interval=1.0):
+        """
+        :param device: The controlled device
+        :type device: sphero.SpheroAPI
+        :param min_rate: The lowest sample rate, in samples/sec
+        :param max_rate: The highest sample rate, in samples/sec
+        :param max_m: The highest number of frames in each packet
+        :param max_loss: Ratio of lost packets where the link is congested, in the range 0.0 - 1.0
+        :param max_jitter: Jitter where the link is congested, relative to the expected packet interval
+        :param increase_step: Samples/sec added to the sample rate while the link is clear
+        :param decrease_factor: The sample rate is multiplied by this when the link is congested
+        :param interval: Seconds between each adjustment
+        :raise SpheroError: If the commands of the device return coroutines, the controller thread can not
+        drive a device owned by an event loop
+        """
+        if device.coroutine_commands:
+            raise SpheroError("Rate control is only supported for the blocking SpheroAPI")
+        super(StreamingRateController, self).__init__()
+        self.device = device
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_m = max_m
+        self.max_loss = max_loss
+        self.max_jitter = max_jitter
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.interval = interval
+
+        self.increases = 0
+        self.decreases = 0
+        self._pending = None
+        # Start time of the measured config, and the packets expected and received when last measured
+        self._mark = (None, 0.0, 0)
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts the controller thread
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="StreamingRateControlThread")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the controller thread. The streaming config is left as it is
+        """
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def metrics(self):
+        """
+        The current rate of the active streaming config, and the measured loss and jitter
+        :return: Dict of sample_rate, packet_rate, m, loss, jitter, received, expected, increases and decreases
+        :rtype: dict
+        """
+        ssc = self.device._ssc
+        metrics = self.device.streaming_stats.as_dict()
+        metrics['sample_rate'] = ssc.sample_rate if ssc is not None else 0.0
+        metrics['m'] = ssc.m if ssc is not None else 0
+        metrics['increases'] = self.increases
+        metrics['decreases'] = self.decreases
+        return metrics
+
+    def _run(self):
+        """
+        Helper method that adjusts the rate every interval, runs in the controller thread
+        """
+        while not self._stopped.wait(self.interval):
+            try:
+                self.adjust()
+            except SpheroError:
+                # Not connected, try again next interval
+                pass
+
+    def adjust(self):
+        """
+        Measures the link and sends a new streaming config if the rate should change.
+        Called by the controller thread every interval
+        :return: The new streaming config, or None if the rate was not changed
+        :rtype: sphero.SensorStreamingConfig or None
+        """
+        ssc = self.device._ssc
+        if not self._is_controllable(ssc):
+            return None
+        if self._pending is not None:
+            if not self._pending.done():
+                # The last config is not accepted by the device yet
+                return None
+            failed = self._pending.exception() is not None
+            self._pending = None
+            if failed:
+                # The device may stream with the config that failed, send the active config again
+                self._pending = self.device.set_data_streaming(ssc, block=False)
+                return None
+
+        stats = self.device.streaming_stats
+        started_at, expected_before, received_before = self._mark
+        if started_at != stats.started_at:
+            expected_before, received_before = 0.0, 0
+        total_expected = stats.expected()
+        expected = total_expected - expected_before
+        if expected < self.min_packets:
+            # Not measured long enough since the config was changed or the link was last measured
+            return None
+        self._mark = (stats.started_at, total_expected, stats.received)
+
+        # One packet of slack, a packet may be on its way when the link is measured
+        lost = expected - (stats.received - received_before) - 1.0
+        jitter = stats.jitter * stats.packet_rate
+        if lost > self.max_loss * expected or jitter > self.max_jitter:
+            new_ssc = self._decrease(ssc)
+        else:
+            new_ssc = self._increase(ssc)
+
+        if new_ssc is not None:
+            self._pending = self.device.set_data_streaming(new_ssc, block=False)
+        return new_ssc
+
+    def _is_controllable(self, ssc):
+        """
+        Helper method: Checks if the streaming config streams something forever
+        """
+        return (ssc is not None and ssc.n > 0 and bool(ssc.mask1 or ssc.mask2) and
+                ssc.num_packets == ssc.STREAM_FOREVER)
+
+    def _increase(self, ssc):
+        """
+        Helper method: Returns a config with a higher rate, or None if the rate is at max
+        """
+        n = self._divisor(ssc, ssc.sample_rate + self.increase_step)
+        if n < ssc.n:
+            self.increases += 1
+            return self._copy(ssc, n, ssc.m)
+        if ssc.m > 1:
+            self.increases += 1
+            return self._copy(ssc, ssc.n, ssc.m // 2)
+        return None
+
+    def _decrease(self, ssc):
+        """
+        Helper method: Returns a config with a lower packet rate, or None if the rate is at min
+        """
+        if ssc.m < self.max_m:
+            self.decreases += 1
+            return self._copy(ssc, ssc.n, min(ssc.m * 2, self.max_m))
+        n = max(self._divisor(ssc, ssc.sample_rate * self.decrease_factor), ssc.n + 1)
+        if ssc.MAX_SAMPLE_RATE_SPHERO / float(n) >= self.min_rate:
+            self.decreases += 1
+            return self._copy(ssc, n, ssc.m)
+        return None
+
+    def _divisor(self, ssc, sample_rate):
+        """
+        Helper method: Returns the divisor n of the sample rate, limited to min_rate and max_rate
+        """
+        sample_rate = min(max(sample_rate, self.min_rate), self.max_rate, ssc.MAX_SAMPLE_RATE_SPHERO)
+        return max(int(ssc.MAX_SAMPLE_RATE_SPHERO / sample_rate), 1)
+
+    @staticmethod
+    def _copy(ssc, n, m):
+        new_ssc = copy.copy(ssc)
+        new_ssc.n = n
+        new_ssc.m = m
+        return new_ssc
+
+
+if __name__ == "__main__":
+    # ADAPTS THE STREAMING RATE OF A SIMULATED DEVICE WITH PACKET LOSS
+    import time
+    from core import SpheroAPI
+    from simulator import SimulatedSphero, SimulatedTransport
+    from streaming import SensorStreamingConfig
+
+    device = SpheroAPI("Sphero-SIM", "00:00:00:00:00:00", SimulatedTransport(SimulatedSphero(loss=0.02)))
+    device.connect()
+
+    ssc = SensorStreamingConfig()
+    ssc.sample_rate = 100
+    ssc.stream_imu_angle()
+    device.set_data_streaming(ssc)
+
+    controller = device.enable_rate_control(interval=0.5)
+    for _ in xrange(10):
+        time.sleep(0.5)
+        print controller.metrics
+    device.disable_rate_control()
+    device.stop_data_streaming()
+    device.disconnect()
@@ -0,0 +1,146 @@
+# coding: utf-8
+"""
+Shared receiver for many Sphero devices
+"""
+import logging
+import select
+import threading
+import time
+
+from error import SpheroFatalError
+
+logger = logging.getLogger(__name__)
+
+
+class SpheroReactor(object):
+    """
+    Receives data for many devices from a single thread.
+
+    The connections of all registered devices are multiplexed with epoll, and the received data is parsed
+    and dispatched by the SpheroAPI instance the connection belongs to. The number of threads stays
+    constant as the number of devices grows.
+    """
+
+    poll_timeout = 0.1
+
+    def __init__(self):
+        super(SpheroReactor, self).__init__()
+        self._epoll = None
+        self._devices = {}
+        self._lock = threading.RLock()
+        self._thread = None
+        self._running = False
+
+    @property
+    def num_devices(self):
+        """
+        :return: The number of devices registered to the reactor
+        :rtype: int
+        """
+        return len(self._devices)
+
+    def register(self, device):
+        """
+        Starts to receive data for the given connected device. The reactor thread is started if not running
+        :param device: A connected device
+        :type device: sphero.SpheroAPI
+        """
+        with self._lock:
+            self._start()
+            fd = device._connection.fileno()
+            self._devices[fd] = device
+            self._epoll.register(fd, select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP)
+
+    def unregister(self, device):
+        """
+        Stops receiving data for the given device. Must be called before the connection is closed
+        :type device: sphero.SpheroAPI
+        """
+        with self._lock:
+            for fd, registered in self._devices.items():
+                if registered is device:
+                    del self._devices[fd]
+                    try:
+                        self._epoll.unregister(fd)
+                    except (IOError, ValueError):
+                        pass
+
+    def stop(self):
+        """
+        Stops the reactor thread, devices still registered stop receiving data
+        """
+        with self._lock:
+            self._running = False
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _start(self):
+        if self._epoll is None or self._epoll.closed:
+            self._epoll = select.epoll()
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="SpheroReactorThread")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _read(self, device):
+        """
+        Helper method: Handles the data ready on the connection of a device. An error in one device never
+        stops the reactor, the device is marked as crashed and its requests fail
+        :return: False if the device can not receive more data
+        :rtype: bool
+        """
+        try:
+            return device._on_readable()
+        except Exception:
+            logger.exception("Receiver of %s crashed", device.bt_name)
+            device._receiver_crashed = True
+            error = SpheroFatalError('FATAL Error, could not receive data from sphero. (receiver crashed)')
+            device._scheduler.clear(error)
+            device._fail_pending(error)
+            return False
+
+    def _run(self):
+        last_expire = time.time()
+        while self._running:
+            try:
+                events = self._epoll.poll(self.poll_timeout)
+            except IOError:
+                # Interrupted system call
+                continue
+
+            for fd, _ in events:
+                device = self._devices.get(fd)
+                if device is not None and not self._read(device):
+                    self.unregister(device)
+
+            now = time.time()
+            if now - last_expire >= self.poll_timeout:
+                last_expire = now
+                with self._lock:
+                    devices = self._devices.values()
+                for device in devices:
+                    device._expire_pending()
+
+
+if __name__ == "__main__":
+    # RECEIVES FROM A SIMULATED FLEET WITH ONE THREAD
+    from core import SpheroAPI
+    from simulator import SimulatedTransport
+
+    reactor = SpheroReactor()
+    fleet = [SpheroAPI("Sphero-SIM%d" % i, "00:00:00:00:00:%02d" % i, SimulatedTransport(), reactor=reactor)
+             for i in xrange(10)]
+    for device in fleet:
+        device.connect()
+
+    start = time.time()
+    futures = [device.ping(block=False) for device in fleet for _ in xrange(8)]
+    print "pings:", sum(future.result().success for future in futures), "in", time.time() - start, "sec"
+    print "threads:", threading.active_count(), "(one simulator thread per device)"
+
+    for device in fleet:
+        device.disconnect()
+    reactor.stop()
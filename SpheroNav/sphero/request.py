@@ -2,31 +2,123 @@
 import struct
 import response
 
+# Priority lanes of the outbound requests, see sphero.scheduler
+LANE_MOTION = 0
+LANE_CONFIGURATION = 1
+LANE_TELEMETRY = 2
+
+
+class RequestEncoder(object):
+    """
+    Precompiled encoder for requests of one type and payload format.
+
+    The header of the packet is prepared in a template, so encoding a request only copies the template and
+    patches in the start of packet byte, the sequence number, the payload and the checksum. The checksum
+    of the constant header bytes is precomputed.
+    """
+    HEADER_SIZE = 6
+
+    def __init__(self, sop1, sop2, did, cid, fmt):
+        self.body = struct.Struct(fmt)
+        self.dlen = self.body.size + 1
+        self.size = self.HEADER_SIZE + self.dlen
+
+        self.template = bytearray(self.size)
+        self.template[0:self.HEADER_SIZE] = bytearray((sop1, sop2, did, cid, 0x00, self.dlen))
+        # The checksum covers the packet from the device id, so the start of packet bytes are subtracted
+        self._sop1 = sop1
+        self._header_sum = did + cid + self.dlen
+
+    def encode(self, sop2, seq, data):
+        """
+        Encodes a request
+        :param sop2: The second start of packet byte
+        :param seq: The sequence number
+        :param data: The payload values, packed with the format of the encoder
+        :return: The encoded packet
+        :rtype: bytearray
+        """
+        packet = bytearray(self.template)
+        packet[1] = sop2
+        packet[4] = seq
+        if data:
+            self.body.pack_into(packet, self.HEADER_SIZE, *data)
+            checksum = sum(packet) - self._sop1 - sop2
+        else:
+            checksum = self._header_sum + seq
+        packet[-1] = ~checksum & 0xFF
+        return packet
+
+
+class RequestMeta(type):
+    """
+    Compiles the encoder of the payload format when a request class is defined.
+
+    Classes without a fixed format get their payload format from the length of the data. Encoders for
+    those are compiled the first time each length is used, and cached in the class.
+    """
+
+    def __init__(cls, name, bases, attrs):
+        super(RequestMeta, cls).__init__(name, bases, attrs)
+        cls._encoders = {}
+        cls.encoder(cls.fmt or '0B')
+
+    def encoder(cls, fmt):
+        """
+        Returns the encoder for requests of this class with the given payload format
+        :rtype: RequestEncoder
+        """
+        try:
+            return cls._encoders[fmt]
+        except KeyError:
+            encoder = cls._encoders[fmt] = RequestEncoder(cls.SOP1, cls.SOP2, cls.did, cls.cid, fmt)
+            return encoder
+
 
 class Request(object):
+    __metaclass__ = RequestMeta
+
     SOP1 = 0xFF
     SOP2 = 0xFF
+    SOP2_ANSWER = 0x01
     did = 0x00
     cid = 0x00
     fmt = None
 
+    # Set for requests where it is safe to skip the response from the device
+    allow_no_answer = False
+
+    # The priority lane the request is sent in
+    lane = LANE_CONFIGURATION
+
+    # Set for requests that can be sent again when the response is lost, without changing the result
+    idempotent = False
+
     def __init__(self, seq=0x00, *data):
         self.seq = seq
         self.data = data
+        self.answer = True
         if not self.fmt:
             self.fmt = '%sB' % len(self.data)
 
     def __str__(self):
         return self.bytes
 
+    def encode(self):
+        """
+        Encodes the request with the precompiled encoder of the class
+        :return: The packet that is sent to the device
+        :rtype: bytearray
+        """
+        encoder = self._encoders.get(self.fmt) or type(self).encoder(self.fmt)
+        return encoder.encode(self.sop2, self.seq, self.data)
+
     def checksum(self):
-        body = self.packet_header() + self.packet_body()
-        body = struct.unpack('%sB' % len(body), body)
-        return struct.pack('B', ~(sum(body[2:]) % 256) & 0xFF)
+        return struct.pack('B', self.encode()[-1])
 
     @property
     def bytes(self):
-        return self.packet_header() + self.packet_body() + self.checksum()
+        return str(self.encode())
 
     def packet_header(self):
         return struct.pack('6B', *self.header())
@@ -40,8 +132,15 @@ class Request(object):
     def dlen(self):
         return struct.calcsize(self.fmt) + 1
 
+    @property
+    def sop2(self):
+        """
+        The second start of packet byte. The answer bit is cleared if the device should not respond
+        """
+        return self.SOP2 if self.answer else self.SOP2 & ~self.SOP2_ANSWER
+
     def header(self):
-        return [self.SOP1, self.SOP2, self.did, self.cid, self.seq, self.dlen]
+        return [self.SOP1, self.sop2, self.did, self.cid, self.seq, self.dlen]
 
     def response(self, header, body):
         """
@@ -61,10 +160,14 @@ class Core(Request):
 
 class Ping(Core):
     cid = 0x01
+    lane = LANE_TELEMETRY
+    idempotent = True
 
 
 class GetVersion(Core):
     cid = 0x02
+    lane = LANE_TELEMETRY
+    idempotent = True
 
 
 class SetDeviceName(Core):
@@ -73,10 +176,14 @@ class SetDeviceName(Core):
 
 class GetBluetoothInfo(Core):
     cid = 0x11
+    lane = LANE_TELEMETRY
+    idempotent = True
 
 
 class GetAutoReconnect(Core):
     cid = 0x12
+    lane = LANE_TELEMETRY
+    idempotent = True
 
 
 class SetAutoReconnect(Core):
@@ -85,6 +192,8 @@ class SetAutoReconnect(Core):
 
 class GetPowerState(Core):
     cid = 0x20
+    lane = LANE_TELEMETRY
+    idempotent = True
 
 
 class SetPowerNotification(Core):
@@ -97,6 +206,8 @@ class Sleep(Core):
 
 class GetVoltageTripPoints(Core):
     cid = 0x23
+    lane = LANE_TELEMETRY
+    idempotent = True
 
 
 class SetVoltageTripPoints(Core):
@@ -113,10 +224,12 @@ class JumpToBootloader(Core):
 
 class PerformLevel1Diagnostics(Core):
     cid = 0x40
+    lane = LANE_TELEMETRY
 
 
 class PerformLevel2Diagnostics(Core):
     cid = 0x41
+    lane = LANE_TELEMETRY
 
 
 class ClearCounters(Core):
@@ -129,6 +242,7 @@ class SetTimeValue(Core):
 
 class PollPacketTimes(Core):
     cid = 0x51
+    lane = LANE_TELEMETRY
 
 
 #Sphero Commands
@@ -140,6 +254,7 @@ class Sphero(Request):
 class SetHeading(Sphero):
     cid = 0x01
     fmt = '!H'
+    allow_no_answer = True
 
 
 class SetStabilization(Sphero):
@@ -156,6 +271,8 @@ class SetApplicationConfigurationBlock(Sphero):
 
 class GetApplicationConfigurationBlock(Sphero):
     cid = 0x05
+    lane = LANE_TELEMETRY
+    idempotent = True
 
 
 class ReenableDemoMode(Sphero):
@@ -164,6 +281,8 @@ class ReenableDemoMode(Sphero):
 
 class GetChassisId(Sphero):
     cid = 0x07
+    lane = LANE_TELEMETRY
+    idempotent = True
 
 
 class SetChassisId(Sphero):
@@ -198,32 +317,44 @@ class SetAccelerometer(Sphero):
 
 class ReadLocator(Sphero):
     cid = 0x15
+    lane = LANE_TELEMETRY
+    idempotent = True
 
 
 class SetRGB(Sphero):
     cid = 0x20
+    allow_no_answer = True
+    idempotent = True
 
 
 class SetBackLEDOutput(Sphero):
     cid = 0x21
+    idempotent = True
 
 
 class GetRGB(Sphero):
     cid = 0x22
+    lane = LANE_TELEMETRY
+    idempotent = True
 
 
 class Roll(Sphero):
     fmt = '!BHB' #Speed, heading, state
     cid = 0x30
+    allow_no_answer = True
+    lane = LANE_MOTION
+    idempotent = True
 
 
 class SetBoostWithTime(Sphero):
     fmt = '!?'
     cid = 0x31
+    lane = LANE_MOTION
 
 
 class SetRawMotorValues(Sphero):
     cid = 0x33
+    lane = LANE_MOTION
 
 
 class SetMotionTimeout(Sphero):
@@ -238,14 +369,20 @@ class SetOptionFlags(Sphero):
 
 class GetOptionFlags(Sphero):
     cid = 0x36
+    lane = LANE_TELEMETRY
+    idempotent = True
 
 
 class GetConfigurationBlock(Sphero):
     cid = 0x40
+    lane = LANE_TELEMETRY
+    idempotent = True
 
 
 class GetDeviceMode(Sphero):
     cid = 0x42
+    lane = LANE_TELEMETRY
+    idempotent = True
 
 
 class RunMacro(Sphero):
@@ -266,6 +403,8 @@ class AbortMacro(Sphero):
 
 class GetMacroStatus(Sphero):
     cid = 0x56
+    lane = LANE_TELEMETRY
+    idempotent = True
 
 
 class SetMacroParameter(Sphero):
@@ -1,6 +1,22 @@
 # coding: utf-8
 import struct
 
+# Compiled structs for the formats that are not known until a response is received, by format
+_structs = {}
+
+
+def compiled_struct(fmt):
+    """
+    Returns a compiled struct for the given format, the struct is cached for later calls
+    :type fmt: str
+    :rtype: struct.Struct
+    """
+    try:
+        return _structs[fmt]
+    except KeyError:
+        compiled = _structs[fmt] = struct.Struct(fmt)
+        return compiled
+
 
 class ResponseCode(object):
     CODE_OK = 0x00
@@ -56,6 +72,8 @@ class ResponseCode(object):
 
 
 class AsyncIdCode(object):
+    __slots__ = ()
+
     ID_POWER_NOTIFICATION = 0x01
     ID_LEVEL_1_DIAGNOSTICS = 0x02
     ID_SENSOR_STREAMING = 0x03
@@ -91,15 +109,40 @@ class AsyncIdCode(object):
         return header[AsyncMsg.ID_CODE] == AsyncIdCode.ID_SENSOR_STREAMING
 
 
+class ResponseMeta(type):
+    """
+    Compiles the struct of the body format when a response class with a fixed format is defined
+    """
+
+    def __init__(cls, name, bases, attrs):
+        super(ResponseMeta, cls).__init__(name, bases, attrs)
+        fmt = attrs.get('fmt')
+        if isinstance(fmt, str):
+            cls._struct = compiled_struct(fmt)
+
+
 class BaseResponse(object):
     # TODO calculate checksum Throw exception if incorrect
+    __metaclass__ = ResponseMeta
+    __slots__ = ('header', 'data', '_body')
+
     SOP1 = 0
     SOP2 = 1
     DLEN = 4
 
+    # Compiled struct of the body, set for classes with a fixed body format
+    _struct = None
+
     def __init__(self, header, data):
+        """
+        :param header: The header of the received msg
+        :type header: tuple
+        :param data: The body of the received msg, including the checksum
+        :type data: str or buffer
+        """
         self.header = header
         self.data = data
+        self._body = None
 
     @property
     def fmt(self):
@@ -114,10 +157,19 @@ class BaseResponse(object):
 
     @property
     def body(self):
-        return struct.unpack(self.fmt, self.data)
+        """
+        The values of the body, decoded the first time the body is accessed
+        :rtype: tuple
+        """
+        if self._body is None:
+            decoder = self._struct or compiled_struct(self.fmt)
+            self._body = decoder.unpack_from(self.data)
+        return self._body
 
 
 class Response(BaseResponse):
+    __slots__ = ()
+
     MRSP = 2
     SEQ = 3
 
@@ -143,6 +195,8 @@ class Response(BaseResponse):
 
 
 class AsyncMsg(BaseResponse, AsyncIdCode):
+    __slots__ = ()
+
     ID_CODE = 2
     DLEN = 3
     DLEN_MSB = 3
@@ -171,17 +225,19 @@ class AsyncMsg(BaseResponse, AsyncIdCode):
 
 # SYNC RESPONSES
 class GetRGB(Response):
+    __slots__ = ('r', 'g', 'b')
+
     def __init__(self, header, data):
         super(GetRGB, self).__init__(header, data)
-        self.r = self.body[0]
-        self.g = self.body[1]
-        self.b = self.body[2]
+        self.r, self.g, self.b = self.body[:3]
 
     def __str__(self):
         return " R: {}, G: {}, B: {}\n".format(self.r, self.g, self.b)
 
 
 class GetBluetoothInfo(Response):
+    __slots__ = ('name', 'bta')
+
     def __init__(self, header, body):
         super(GetBluetoothInfo, self).__init__(header, body)
         self.name = self.data.split('\x00', 1)[0]
@@ -189,13 +245,13 @@ class GetBluetoothInfo(Response):
 
 
 class ReadLocator(Response):
+    __slots__ = ('x_pos', 'y_pos', 'x_vel', 'y_vel', 'sog')
+
+    fmt = '!4hHb'
+
     def __init__(self, header, data):
         super(ReadLocator, self).__init__(header, data)
-        self.x_pos = self.body[0]
-        self.y_pos = self.body[1]
-        self.x_vel = self.body[2]
-        self.y_vel = self.body[3]
-        self.sog = self.body[4]
+        self.x_pos, self.y_pos, self.x_vel, self.y_vel, self.sog = self.body[:5]
 
     def __str__(self):
         return " xpos: %d \n ypos: %d \n xvel: %d cm/sec\n yvel: %d cm/sec\n sog: %d cm/sec\n" % (
@@ -206,12 +262,10 @@ class ReadLocator(Response):
             self.sog
         )
 
-    @property
-    def fmt(self):
-        return '!4hHb'
-
 
 class PowerState(object):
+    __slots__ = ()
+
     _power_state = -1
     BAT_CHARGING = 1
     BAT_OK = 2
@@ -231,13 +285,18 @@ class PowerState(object):
 
 
 class GetPowerState(Response, PowerState):
+    __slots__ = ('rec_ver', '_power_state', 'bat_voltage', 'num_charges', 'time_since_last_charge')
+
+    fmt = '!2B3Hb'
+
     def __init__(self, header, data):
         super(GetPowerState, self).__init__(header, data)
-        self.rec_ver = self.body[0]
-        self._power_state = self.body[1]
-        self.bat_voltage = self.body[2] / 100.0
-        self.num_charges = self.body[3]
-        self.time_since_last_charge = self.body[4]
+        body = self.body
+        self.rec_ver = body[0]
+        self._power_state = body[1]
+        self.bat_voltage = body[2] / 100.0
+        self.num_charges = body[3]
+        self.time_since_last_charge = body[4]
 
     def __str__(self):
         return " RecVer: v.{} \n PowerState: {} \n Voltage: {} \n NumCharges {} \n Last charge: {} sec\n".format(
@@ -248,12 +307,13 @@ class GetPowerState(Response, PowerState):
             self.time_since_last_charge
         )
 
-    @property
-    def fmt(self):
-        return '!2B3Hb'
-
 
 class GetOptionFlags(Response):
+    __slots__ = ('stay_on', 'vector_drive', 'leveling', 'tail_LED', 'motion_timeout', 'demo_mode', 'tap_light',
+                 'tap_heavy', 'gyro_max')
+
+    fmt = '!Ib'
+
     def __init__(self, header, data):
         super(GetOptionFlags, self).__init__(header, data)
         flags = self.body[0]
@@ -281,34 +341,28 @@ class GetOptionFlags(Response):
                 self.gyro_max
         )
 
-    @property
-    def fmt(self):
-        return '!Ib'
-
 
 # ASYNC MESSAGES
 class CollisionDetected(AsyncMsg):
+    __slots__ = ('x', 'y', 'z', 'x_axis', 'y_axis', 'x_magnitude', 'y_magnitude', 'speed', 'timestamp')
+
+    fmt = '!3hB2HBIb'
+
     def __init__(self, header, data):
         super(CollisionDetected, self).__init__(header, data)
-        self.x = self.body[0]
-        self.y = self.body[1]
-        self.z = self.body[2]
-        self.x_axis = bool(self.body[3] & 0x01)
-        self.y_axis = bool(self.body[3] & 0x02)
-        self.x_magnitude = self.body[4]
-        self.y_magnitude = self.body[5]
-        self.speed = self.body[6]
-        self.timestamp = self.body[7]
+        self.x, self.y, self.z, axis, self.x_magnitude, self.y_magnitude, self.speed, self.timestamp = self.body[:8]
+        self.x_axis = bool(axis & 0x01)
+        self.y_axis = bool(axis & 0x02)
 
     def __str__(self):
-        return str(self.__dict__)
-
-    @property
-    def fmt(self):
-        return '!3hB2HBIb'
+        return str(dict((name, getattr(self, name)) for name in self.__slots__))
 
 
 class PowerNotification(AsyncMsg, PowerState):
+    __slots__ = ('_power_state',)
+
+    fmt = '!Bb'
+
     def __init__(self, header, data):
         super(PowerNotification, self).__init__(header, data)
         self._power_state = self.body[0]
@@ -319,9 +373,53 @@ class PowerNotification(AsyncMsg, PowerState):
 
 class LevelOneDiagnostics(AsyncMsg):
     # TODO Add save to file etc.
+    __slots__ = ('result',)
+
     def __init__(self, header, data):
         super(LevelOneDiagnostics, self).__init__(header, data)
         self.result = data[:-1]
 
     def __str__(self):
-        return self.result
\ No newline at end of file
+        return self.result
+
+
+class MacroMarker(AsyncMsg):
+    __slots__ = ('marker', 'macro_id', 'command_number')
+
+    fmt = '!2BHb'
+
+    def __init__(self, header, data):
+        super(MacroMarker, self).__init__(header, data)
+        self.marker, self.macro_id, self.command_number = self.body[:3]
+
+    def __str__(self):
+        return "marker: {}, macro: {}, command: {}".format(self.marker, self.macro_id, self.command_number)
+
+
+class OrbBasicMessage(AsyncMsg):
+    """
+    Text printed by a running orbBasic program, or an orbBasic error message in ASCII
+    """
+    __slots__ = ('text',)
+
+    def __init__(self, header, data):
+        super(OrbBasicMessage, self).__init__(header, data)
+        self.text = data[:-1]
+
+    @property
+    def is_error(self):
+        return self.header[AsyncMsg.ID_CODE] == AsyncIdCode.ID_ORB_ERROR_MSG_ASCII
+
+    def __str__(self):
+        return self.text
+
+
+# The message class of each async id code, other async messages are decoded as AsyncMsg
+ASYNC_MESSAGES = {
+    AsyncIdCode.ID_POWER_NOTIFICATION: PowerNotification,
+    AsyncIdCode.ID_LEVEL_1_DIAGNOSTICS: LevelOneDiagnostics,
+    AsyncIdCode.ID_MACRO_MARKERS: MacroMarker,
+    AsyncIdCode.ID_COLLISION_DETECTED: CollisionDetected,
+    AsyncIdCode.ID_ORB_PRINT_MSG: OrbBasicMessage,
+    AsyncIdCode.ID_ORB_ERROR_MSG_ASCII: OrbBasicMessage,
+}
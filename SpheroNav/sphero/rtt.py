@@ -0,0 +1,98 @@
+# coding: utf-8
+"""
+Round trip time estimation for the requests sent to a Sphero device
+"""
+import threading
+
+
+class RttEstimator(object):
+    """
+    Smoothed round trip time and round trip time variance of the acknowledged requests, with the
+    retransmission timeout computed from them as in TCP (RFC 6298):
+
+        srtt = (1 - alpha) * srtt + alpha * rtt
+        rttvar = (1 - beta) * rttvar + beta * |srtt - rtt|
+        rto = srtt + k * rttvar
+
+    The timeout is kept between min_rto and max_rto, and is initial_rto until the first round trip is
+    measured. The timeout is doubled on every timeout until the next round trip is measured, so a device
+    that has become slow is not flooded with retries.
+    """
+
+    alpha = 1 / 8.0
+    beta = 1 / 4.0
+    k = 4
+
+    def __init__(self, initial_rto=3.0, min_rto=1.0, max_rto=25.0):
+        """
+        :param initial_rto: Seconds used as timeout before any round trip is measured
+        :param min_rto: The shortest timeout in seconds
+        :param max_rto: The longest timeout in seconds
+        """
+        super(RttEstimator, self).__init__()
+        self.initial_rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets all measured round trips, e.g. when the device is connected again
+        """
+        self.srtt = None
+        self.rttvar = None
+        self.last_rtt = None
+        self.samples = 0
+        self.timeouts = 0
+        self._rto = self.initial_rto
+
+    @property
+    def rto(self):
+        """
+        The current timeout of a request, in seconds
+        :rtype: float
+        """
+        return self._rto
+
+    def sample(self, rtt):
+        """
+        Adds the round trip time of an acknowledged request
+        :param rtt: Seconds from the request was sent until the response was received
+        :type rtt: float
+        """
+        with self._lock:
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2.0
+            else:
+                self.rttvar = (1 - self.beta) * self.rttvar + self.beta * abs(self.srtt - rtt)
+                self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+            self.last_rtt = rtt
+            self.samples += 1
+            self._rto = self._clamp(self.srtt + self.k * self.rttvar)
+
+    def backoff(self):
+        """
+        Doubles the timeout after a request has timed out
+        """
+        with self._lock:
+            self.timeouts += 1
+            self._rto = self._clamp(self._rto * 2)
+
+    def _clamp(self, rto):
+        return min(self.max_rto, max(self.min_rto, rto))
+
+    def as_dict(self):
+        return {
+            'srtt': self.srtt,
+            'rttvar': self.rttvar,
+            'rto': self.rto,
+            'samples': self.samples,
+            'timeouts': self.timeouts,
+        }
+
+    def __str__(self):
+        if self.srtt is None:
+            return "srtt: -, rto: {:.3f}".format(self.rto)
+        return "srtt: {:.3f}, rttvar: {:.3f}, rto: {:.3f}".format(self.srtt, self.rttvar, self.rto)
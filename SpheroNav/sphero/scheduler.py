@@ -0,0 +1,334 @@
+# coding: utf-8
+"""
+Outbound command scheduling for a Sphero device
+"""
+from collections import deque
+import threading
+import time
+
+import request
+from error import SpheroError, SpheroCancelledError, SpheroDeadlineError, SpheroTimeoutError
+
+LANE_NAMES = {
+    request.LANE_MOTION: 'motion',
+    request.LANE_CONFIGURATION: 'configuration',
+    request.LANE_TELEMETRY: 'telemetry',
+}
+
+
+class LaneStats(object):
+    """
+    Counters of the requests sent in one priority lane
+    """
+
+    def __init__(self, name):
+        super(LaneStats, self).__init__()
+        self.name = name
+        self.queued = 0
+        self.sent = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def mean_wait(self):
+        """
+        Mean seconds a request waited in the lane before it was sent
+        :rtype: float
+        """
+        return self.total_wait / self.sent if self.sent else 0.0
+
+    def as_dict(self):
+        return {
+            'queued': self.queued,
+            'sent': self.sent,
+            'mean_wait': self.mean_wait,
+            'max_wait': self.max_wait,
+        }
+
+
+class CommandScheduler(object):
+    """
+    Outbound scheduler for one device, with priority lanes and latest-wins slots for commands that set
+    state.
+
+    Priority lanes:
+        Requests are queued in the lane of their class, see request.Request.lane. When there is room in
+        the send window of the device, the motion lane is always drained first, then configuration, then
+        telemetry and diagnostics. A request that has waited longer than max_wait in a lower lane is sent
+        before the higher lanes, so polls are never starved by a steady stream of motion commands. Requests
+        keep their order within a lane.
+
+    Deadlines:
+        A request with a deadline in its future is dropped instead of sent when the deadline has passed,
+        and the future fails with SpheroDeadlineError.
+
+    Coalescing:
+        When coalesce is set on submit, at most one unsent request of each coalesced type is held. A newer
+        request replaces the older unsent one, and the future of the replaced request fails with
+        SpheroCancelledError. Coalesced requests are clocked by the acknowledgements from the device: one is
+        only sent while fewer than window coalesced requests wait for a response, so the send rate follows
+        the round trip time of the link and the request that is sent is always the newest one.
+
+    Sending:
+        Requests are sent on the thread that submits them while there is room in the send window. When room
+        is made by a response, the receiver thread only wakes the sender thread of the scheduler, which
+        sends the queued requests, so the receiver never blocks on a send. The sender thread is started when
+        needed and stops when it has been idle for sender_idle_timeout.
+    """
+
+    COALESCED_REQUESTS = (request.Roll, request.SetRGB, request.SetBackLEDOutput)
+
+    LANES = (request.LANE_MOTION, request.LANE_CONFIGURATION, request.LANE_TELEMETRY)
+
+    max_wait = 0.5
+
+    # Seconds the sender thread waits to be woken before it stops
+    sender_idle_timeout = 1.0
+
+    def __init__(self, device, window=1):
+        """
+        :param device: The device the requests are sent to
+        :type device: sphero.SpheroAPI
+        :param window: Max number of coalesced requests waiting for a response
+        :type window: int
+        """
+        super(CommandScheduler, self).__init__()
+        self._device = device
+        self.window = window
+
+        # Queued requests of each lane, entries are [packet, future, queued at]. The packet is set to None
+        # when the entry is replaced by a newer request
+        self._lanes = dict((lane, deque()) for lane in self.LANES)
+        # The queued entry of each coalesced type
+        self._slots = {}
+        self._lock = threading.RLock()
+        # Held while sending, so requests are sent in the order they are taken from the lanes. Never held by
+        # the receiver thread
+        self._send_lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._sender = None
+        self._in_flight = 0
+        self._queued = 0
+
+        self.sent = 0
+        self.superseded = 0
+        self.lane_stats = dict((lane, LaneStats(LANE_NAMES[lane])) for lane in self.LANES)
+
+    def accepts(self, packet):
+        """
+        :return: True if requests of this type are coalesced
+        :rtype: bool
+        """
+        return isinstance(packet, self.COALESCED_REQUESTS)
+
+    @property
+    def queued(self):
+        """
+        The number of requests waiting to be sent
+        :rtype: int
+        """
+        return self._queued
+
+    def lane_depth(self, lane):
+        """
+        :param lane: The lane, e.g. request.LANE_MOTION
+        :return: The number of requests waiting to be sent in the lane
+        :rtype: int
+        """
+        return self.lane_stats[lane].queued
+
+    def stats(self):
+        """
+        The queue depth and wait time of each lane
+        :return: Dict of the counters by lane name
+        :rtype: dict
+        """
+        with self._lock:
+            return dict((stats.name, stats.as_dict()) for stats in self.lane_stats.itervalues())
+
+    def submit(self, packet, future, coalesce=False):
+        """
+        Queues a request for sending
+        :param packet: The request
+        :type packet: request.Request
+        :param future: The future response of the request
+        :type future: sphero.future.ResponseFuture
+        :param coalesce: Replace an unsent request of the same type if the type is coalesced
+        :type coalesce: bool
+        """
+        lane = self._lane(packet)
+        entry = [packet, future, time.time()]
+        replaced = None
+        with self._lock:
+            if coalesce and self.accepts(packet):
+                replaced = self._slots.get(type(packet))
+                if replaced is not None:
+                    self._remove(replaced)
+                    self.superseded += 1
+                self._slots[type(packet)] = entry
+            self._lanes[lane].append(entry)
+            self.lane_stats[lane].queued += 1
+            self._queued += 1
+
+        if replaced is not None:
+            replaced[1].set_exception(SpheroCancelledError('Replaced by a newer request before it was sent'))
+        self.pump()
+
+    def clear(self, error):
+        """
+        Drops all queued requests
+        :param error: The error the futures of the dropped requests fail with
+        """
+        with self._lock:
+            dropped = [entry for lane in self._lanes.itervalues() for entry in lane if entry[0] is not None]
+            for lane in self.LANES:
+                self._lanes[lane].clear()
+                self.lane_stats[lane].queued = 0
+            self._slots.clear()
+            self._queued = 0
+        for _, future, _ in dropped:
+            future.set_exception(error)
+
+    def expire(self, timeout):
+        """
+        Fails the requests that have waited longer than timeout to be sent
+        :param timeout: Max seconds in the queue
+        """
+        give_up = time.time() - timeout
+        expired = []
+        with self._lock:
+            for queue in self._lanes.itervalues():
+                for entry in queue:
+                    if entry[0] is not None and entry[2] < give_up:
+                        expired.append(entry[1])
+                        self._remove(entry)
+        for future in expired:
+            future.set_exception(SpheroTimeoutError('No response received from device before timeout (send '
+                                                    'window full)'))
+
+    def pump(self):
+        """
+        Sends queued requests while there is room in the send window. The room in the window is taken and the
+        request is removed from its lane with the lock held, so no other thread can fill the window between
+        the check and the send. The request is sent after the lock is released
+        """
+        with self._send_lock:
+            while True:
+                error = None
+                with self._lock:
+                    if not self._queued or not self._device._can_transmit():
+                        return
+                    entry = self._next_entry()
+                    if entry is None:
+                        return
+                    packet, future, queued_at = entry
+                    coalesced = self._slots.get(type(packet)) is entry
+                    self._remove(entry)
+                    now = time.time()
+                    missed_deadline = future.deadline is not None and now > future.deadline
+                    if missed_deadline:
+                        self._device.deadline_stats.dropped[type(packet).__name__] += 1
+                    elif future.done():
+                        # The caller has given up on the request
+                        continue
+                    else:
+                        try:
+                            self._device._register_pending(future)
+                        except SpheroError as e:
+                            error = e
+                        else:
+                            stats = self.lane_stats[self._lane(packet)]
+                            stats.sent += 1
+                            stats.total_wait += now - queued_at
+                            stats.max_wait = max(stats.max_wait, now - queued_at)
+                            self.sent += 1
+                            if coalesced:
+                                self._in_flight += 1
+                                future.add_done_callback(self._on_done)
+
+                if missed_deadline:
+                    future.set_exception(SpheroDeadlineError('Dropped, the deadline passed before it was sent'))
+                    continue
+                if error is None:
+                    try:
+                        self._device._transmit(packet, future)
+                    except SpheroError as e:
+                        error = e
+                if error is not None:
+                    future.set_exception(error)
+
+    def wake(self):
+        """
+        Wakes the sender thread to send the queued requests, e.g. when a response has made room in the send
+        window. Does not block, so it can be used from the receiver thread
+        """
+        with self._lock:
+            if not self._queued:
+                return
+            if self._sender is None:
+                self._sender = threading.Thread(target=self._send_queued, name="SpheroSenderThread")
+                self._sender.daemon = True
+                self._sender.start()
+            self._wakeup.set()
+
+    def _send_queued(self):
+        """
+        Helper method: Sends the queued requests each time the scheduler is woken, runs in the sender thread
+        """
+        while True:
+            self._wakeup.wait(self.sender_idle_timeout)
+            with self._lock:
+                if not self._wakeup.is_set():
+                    self._sender = None
+                    return
+                self._wakeup.clear()
+            self.pump()
+
+    def _lane(self, packet):
+        return packet.lane if packet.lane in self._lanes else request.LANE_CONFIGURATION
+
+    def _remove(self, entry):
+        """
+        Helper method: Marks a queued entry as removed, must be called with the lock held
+        """
+        packet = entry[0]
+        if packet is not None:
+            self.lane_stats[self._lane(packet)].queued -= 1
+            self._queued -= 1
+            if self._slots.get(type(packet)) is entry:
+                del self._slots[type(packet)]
+            entry[0] = None
+
+    def _head(self, lane):
+        """
+        Helper method: Returns the first entry of the lane that can be sent, must be called with the lock held
+        """
+        queue = self._lanes[lane]
+        while queue and queue[0][0] is None:
+            queue.popleft()
+        for entry in queue:
+            packet = entry[0]
+            if packet is None:
+                continue
+            if self._slots.get(type(packet)) is entry and self._in_flight >= self.window:
+                # Wait for the acknowledgement of the previous coalesced request
+                continue
+            return entry
+        return None
+
+    def _next_entry(self):
+        """
+        Helper method: Picks the next entry to send, must be called with the lock held
+        """
+        heads = [head for head in (self._head(lane) for lane in self.LANES) if head is not None]
+        if not heads:
+            return None
+        starving = [head for head in heads[1:] if time.time() - head[2] > self.max_wait]
+        if starving:
+            return min(starving, key=lambda head: head[2])
+        return heads[0]
+
+    def _on_done(self, future):
+        with self._lock:
+            self._in_flight -= 1
+        self.wake()
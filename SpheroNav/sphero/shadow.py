@@ -0,0 +1,142 @@
+# coding: utf-8
+"""
+Client side copy of the settable state of a Sphero device
+"""
+import threading
+
+import request
+from response import ResponseCode
+
+
+class DeviceShadow(object):
+    """
+    The last value the device has accepted for each of its settings.
+
+    A setting is stored as the payload of the request that set it, by the type of the request. The value is
+    stored when the device has answered the request successfully, and removed when a request of the same
+    type is sent, until the device has answered it. Requests that would set a setting to the value it
+    already has can then be answered from the shadow, without a round trip to the device.
+
+    Only the answer to the newest request of each type is stored. The device answers the requests in the
+    order they are sent, so no request of the type is in flight when the newest one is answered, and an
+    answer to an older request can not overwrite the value of a newer one.
+    """
+
+    # The requests that set state on the device, each type overwrites the state set by the previous one
+    SHADOWED_REQUESTS = (
+        request.SetRGB,
+        request.SetBackLEDOutput,
+        request.SetOptionFlags,
+        request.SetStabilization,
+        request.ConfigureCollisionDetection,
+        request.SetRotationRate,
+        request.SetMotionTimeout,
+        request.SetPowerNotification,
+        request.SetDeviceName,
+    )
+
+    # Requests that change settings of other request types, e.g. raw motor values turn off stabilization
+    SIDE_EFFECTS = {
+        request.SetRawMotorValues: (request.SetStabilization,),
+    }
+
+    # Requests after which the device may have reset all of its settings
+    RESETTING_REQUESTS = (request.Sleep,)
+
+    def __init__(self):
+        super(DeviceShadow, self).__init__()
+        self._state = {}
+        # Sequence number of the newest request of each type that is not answered yet
+        self._newest = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def __len__(self):
+        return len(self._state)
+
+    def __contains__(self, request_class):
+        return request_class in self._state
+
+    def is_shadowed(self, packet):
+        """
+        :type packet: request.Request
+        :return: True if the request sets state that is kept in the shadow
+        """
+        return type(packet) in self.SHADOWED_REQUESTS
+
+    def matches(self, packet):
+        """
+        Checks if the request would set state to the value the device already has
+        :type packet: request.Request
+        :rtype: bool
+        """
+        return self._state.get(type(packet)) == packet.data
+
+    def update(self, packet):
+        """
+        Stores the state set by a request the device has accepted
+        :type packet: request.Request
+        """
+        if self.is_shadowed(packet):
+            with self._lock:
+                if self._newest.get(type(packet)) == packet.seq:
+                    del self._newest[type(packet)]
+                    self._state[type(packet)] = packet.data
+
+    def invalidate(self, packet):
+        """
+        Removes the state set by requests of the same type, the state is unknown until the device answers.
+        The state the request changes as a side effect is removed as well. Must be called with the final
+        sequence number of the request, before it is sent
+        :type packet: request.Request
+        """
+        if isinstance(packet, self.RESETTING_REQUESTS):
+            self.clear()
+            return
+        for request_class in self.SIDE_EFFECTS.get(type(packet), ()):
+            with self._lock:
+                # An answer to a request of the type that is still in flight is not stored either
+                self._state.pop(request_class, None)
+                self._newest.pop(request_class, None)
+        if self.is_shadowed(packet):
+            with self._lock:
+                self._state.pop(type(packet), None)
+                self._newest[type(packet)] = packet.seq
+
+    def clear(self):
+        """
+        Removes all state, e.g. when the device may have been reset
+        """
+        with self._lock:
+            self._state.clear()
+            self._newest.clear()
+
+    def get(self, request_class):
+        """
+        Returns the payload of the last accepted request of the given type
+        :return: The payload, or None if the state is unknown
+        :rtype: tuple or None
+        """
+        return self._state.get(request_class)
+
+    def items(self):
+        """
+        :return: The request type and payload of all known state, in the order of SHADOWED_REQUESTS
+        :rtype: list of (class, tuple)
+        """
+        with self._lock:
+            return [(cls, self._state[cls]) for cls in self.SHADOWED_REQUESTS if cls in self._state]
+
+    def answer(self, packet):
+        """
+        Creates the response the device would have answered the request with
+        :type packet: request.Request
+        :rtype: response.Response
+        """
+        self.suppressed += 1
+        code, dlen = ResponseCode.CODE_OK, 1
+        checksum = chr(~(code + packet.seq + dlen) & 0xFF)
+        return packet.response((0xFF, 0xFF, code, packet.seq, dlen), checksum)
+
+    def __str__(self):
+        return "\n".join("{}: {}".format(cls.__name__, data) for cls, data in self.items())
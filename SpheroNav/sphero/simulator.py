@@ -0,0 +1,359 @@
+# coding: utf-8
+"""
+Simulated Sphero device, used to run and benchmark the SpheroAPI without hardware
+"""
+import heapq
+import inspect
+import random
+import select
+import socket
+import struct
+import threading
+import time
+
+import request
+from response import ResponseCode, AsyncIdCode
+from streaming import Mask1, Mask2, SensorStreamingConfig
+from transport import LoopbackTransport
+
+
+class SimulatedSphero(object):
+    """
+    A simulated device that answers requests from the SpheroAPI over a socket.
+
+    Every request defined in the request module is answered with a response frame. Sensor data is
+    streamed as configured with SetDataStreaming. Latency can be added to all data sent from the device,
+    and a ratio of the frames sent from the device can be dropped to simulate packet loss.
+    """
+
+    REQUEST_HEADER = struct.Struct('6B')
+    STREAMING_BYTE_ORDER = '!'
+
+    def __init__(self, name="Sphero-SIM", bt_addr="00:00:00:00:00:00", latency=0.0, loss=0.0, seed=None):
+        """
+        :param name: Name reported by GetBluetoothInfo
+        :param bt_addr: Address reported by GetBluetoothInfo
+        :param latency: Seconds added before every frame sent from the device
+        :type latency: float
+        :param loss: Ratio of frames sent from the device that are dropped, in the range 0.0 - 1.0
+        :type loss: float
+        :param seed: Seed for the packet loss random generator
+        """
+        super(SimulatedSphero, self).__init__()
+        self.name = name
+        self.bt_addr = bt_addr
+        self.latency = latency
+        self.loss = loss
+        self._random = random.Random(seed)
+
+        self._socket = None
+        self._thread = None
+        self._running = False
+        self._buffer = ''
+
+        self._outgoing = []
+        self._outgoing_lock = threading.Lock()
+
+        # STATISTICS
+        self.requests_received = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+
+        # DEVICE STATE
+        self.rgb = (0xFF, 0xFF, 0xFF)
+        self.back_led = 0x00
+        self.option_flags = 0x00000000
+        self.locator = (0, 0)
+        self.velocity = (0, 0)
+        self.speed = 0
+        self.heading = 0
+
+        # STREAMING STATE
+        self._stream_fields = 0
+        self._stream_m = 1
+        self._stream_interval = None
+        self._stream_packets_left = 0
+        self._next_stream_time = None
+        self._stream_sample = 0
+
+        self._handlers = self._create_handlers()
+
+    @staticmethod
+    def _request_classes():
+        """
+        Helper method: Maps (did, cid) to all request classes defined in the request module
+        :rtype: dict
+        """
+        classes = {}
+        for _, klass in inspect.getmembers(request, inspect.isclass):
+            if issubclass(klass, request.Request) and klass.__name__ not in ('Request', 'Core', 'Sphero'):
+                classes[(klass.did, klass.cid)] = klass
+        return classes
+
+    def _create_handlers(self):
+        handlers = dict.fromkeys(self._request_classes().itervalues(), self._reply_simple)
+        handlers.update({
+            request.GetRGB: self._reply_get_rgb,
+            request.SetRGB: self._reply_set_rgb,
+            request.SetBackLEDOutput: self._reply_set_back_led,
+            request.GetBluetoothInfo: self._reply_bluetooth_info,
+            request.GetPowerState: self._reply_power_state,
+            request.GetOptionFlags: self._reply_get_option_flags,
+            request.SetOptionFlags: self._reply_set_option_flags,
+            request.ReadLocator: self._reply_read_locator,
+            request.ConfigureLocator: self._reply_configure_locator,
+            request.Roll: self._reply_roll,
+            request.SetDataStreaming: self._reply_set_data_streaming,
+        })
+        return dict(((klass.did, klass.cid), handler) for klass, handler in handlers.iteritems())
+
+    def attach(self, sock):
+        """
+        Starts to serve requests received on the given socket
+        :param sock: The device end of the connection
+        :type sock: socket.socket
+        """
+        self._socket = sock
+        self._buffer = ''
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="SimulatedSpheroThread")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def detach(self):
+        """
+        Stops serving requests
+        """
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        self._socket = None
+
+    def inject_collision(self, x=100, y=100, z=0, speed=50):
+        """
+        Sends a collision notification from the device
+        """
+        body = struct.pack('!3hB2HBI', x, y, z, 0x03, abs(x), abs(y), speed, int(time.time() * 1000) & 0xFFFFFFFF)
+        self._send_async(AsyncIdCode.ID_COLLISION_DETECTED, body)
+
+    # MAIN LOOP
+
+    def _run(self):
+        while self._running:
+            try:
+                readable = select.select([self._socket], [], [], self._poll_timeout())[0]
+                if readable:
+                    data = self._socket.recv(1024)
+                    if not data:
+                        break
+                    self._buffer += data
+                    self._handle_requests()
+                self._stream()
+                self._flush()
+            except (socket.error, select.error, ValueError):
+                break
+        self._running = False
+
+    def _poll_timeout(self):
+        timeout = 0.1
+        now = time.time()
+        if self._next_stream_time is not None:
+            timeout = min(timeout, self._next_stream_time - now)
+        with self._outgoing_lock:
+            if self._outgoing:
+                timeout = min(timeout, self._outgoing[0][0] - now)
+        return max(timeout, 0.0)
+
+    def _handle_requests(self):
+        """
+        Helper method: Parses and answers all complete requests in the receive buffer
+        """
+        header_length = self.REQUEST_HEADER.size
+        while True:
+            start = self._buffer.find('\xff')
+            if start < 0:
+                self._buffer = ''
+                return
+            self._buffer = self._buffer[start:]
+            if len(self._buffer) < header_length:
+                return
+            sop1, sop2, did, cid, seq, dlen = self.REQUEST_HEADER.unpack_from(self._buffer)
+            if sop2 & 0xFC != 0xFC:
+                self._buffer = self._buffer[1:]
+                continue
+            if len(self._buffer) < header_length + dlen:
+                return
+            body = self._buffer[header_length:header_length + dlen - 1]
+            self._buffer = self._buffer[header_length + dlen:]
+            self.requests_received += 1
+
+            handler = self._handlers.get((did, cid))
+            if handler is None:
+                code, data = ResponseCode.CODE_EBAD_CMD, ''
+            else:
+                code, data = handler(body)
+            if sop2 & 0x01:
+                self._send_response(code, seq, data)
+
+    # OUTGOING FRAMES
+
+    @staticmethod
+    def checksum(data):
+        return chr(~(sum(bytearray(data)) % 256) & 0xFF)
+
+    def _send_response(self, code, seq, data):
+        frame = struct.pack('5B', 0xFF, 0xFF, code, seq, len(data) + 1)
+        self._queue(frame + data + self.checksum(frame[2:] + data))
+
+    def _send_async(self, id_code, data):
+        frame = struct.pack('!3BH', 0xFF, 0xFE, id_code, len(data) + 1)
+        self._queue(frame + data + self.checksum(frame[2:] + data))
+
+    def _queue(self, frame):
+        if self.loss and self._random.random() < self.loss:
+            self.frames_dropped += 1
+            return
+        with self._outgoing_lock:
+            heapq.heappush(self._outgoing, (time.time() + self.latency, self.frames_sent, frame))
+            self.frames_sent += 1
+
+    def _flush(self):
+        now = time.time()
+        frames = []
+        with self._outgoing_lock:
+            while self._outgoing and self._outgoing[0][0] <= now:
+                frames.append(heapq.heappop(self._outgoing)[2])
+        if frames:
+            self._socket.sendall(''.join(frames))
+
+    # SENSOR STREAMING
+
+    def _stream(self):
+        now = time.time()
+        while self._next_stream_time is not None and self._next_stream_time <= now:
+            values = []
+            for _ in xrange(self._stream_m):
+                self._stream_sample += 1
+                values.extend([self._stream_sample % 0x7FFF] * self._stream_fields)
+            body = struct.pack('%s%dh' % (self.STREAMING_BYTE_ORDER, len(values)), *values)
+            self._send_async(AsyncIdCode.ID_SENSOR_STREAMING, body)
+
+            self._next_stream_time += self._stream_interval
+            if self._stream_packets_left:
+                self._stream_packets_left -= 1
+                if not self._stream_packets_left:
+                    self._next_stream_time = None
+
+    @staticmethod
+    def _count_fields(mask, names):
+        return len([bit for bit in names if bit & mask])
+
+    # REQUEST HANDLERS
+
+    @staticmethod
+    def _reply_simple(body):
+        return ResponseCode.CODE_OK, ''
+
+    def _reply_get_rgb(self, body):
+        return ResponseCode.CODE_OK, struct.pack('3B', *self.rgb)
+
+    def _reply_set_rgb(self, body):
+        self.rgb = struct.unpack_from('3B', body)
+        return ResponseCode.CODE_OK, ''
+
+    def _reply_set_back_led(self, body):
+        self.back_led = struct.unpack_from('B', body)[0]
+        return ResponseCode.CODE_OK, ''
+
+    def _reply_bluetooth_info(self, body):
+        name = self.name[:15].ljust(16, '\x00')
+        addr = self.bt_addr.replace(':', '')[:12].ljust(12, '\x00')
+        return ResponseCode.CODE_OK, name + addr + '\x00' + 'rgb'
+
+    @staticmethod
+    def _reply_power_state(body):
+        return ResponseCode.CODE_OK, struct.pack('!2B3H', 1, 2, 780, 10, 3600)
+
+    def _reply_get_option_flags(self, body):
+        return ResponseCode.CODE_OK, struct.pack('!I', self.option_flags)
+
+    def _reply_set_option_flags(self, body):
+        self.option_flags = struct.unpack_from('!I', body)[0]
+        return ResponseCode.CODE_OK, ''
+
+    def _reply_read_locator(self, body):
+        x, y = self.locator
+        vel_x, vel_y = self.velocity
+        return ResponseCode.CODE_OK, struct.pack('!4hH', x, y, vel_x, vel_y, self.speed)
+
+    def _reply_configure_locator(self, body):
+        _, x, y, _ = struct.unpack_from('!b3h', body)
+        self.locator = (x, y)
+        return ResponseCode.CODE_OK, ''
+
+    def _reply_roll(self, body):
+        self.speed, self.heading, _ = struct.unpack_from('!BHB', body)
+        return ResponseCode.CODE_OK, ''
+
+    def _reply_set_data_streaming(self, body):
+        n, m, mask1, packet_count, mask2 = struct.unpack_from('!2HIBI', body)
+        self._stream_fields = self._count_fields(mask1, Mask1.mask1_names) + \
+            self._count_fields(mask2, Mask2.mask2_names)
+        self._stream_m = max(m, 1)
+        self._stream_packets_left = packet_count
+        if n and self._stream_fields:
+            rate = float(SensorStreamingConfig.MAX_SAMPLE_RATE_SPHERO) / n
+            self._stream_interval = self._stream_m / rate
+            self._next_stream_time = time.time() + self._stream_interval
+        else:
+            self._next_stream_time = None
+        return ResponseCode.CODE_OK, ''
+
+
+class SimulatedTransport(LoopbackTransport):
+    """
+    Loopback connection to a SimulatedSphero
+    """
+
+    def __init__(self, device=None):
+        """
+        :param device: The simulated device to connect to, a new device is created if not set
+        :type device: SimulatedSphero
+        """
+        super(SimulatedTransport, self).__init__()
+        self.device = device if device is not None else SimulatedSphero()
+
+    def connect(self, address):
+        super(SimulatedTransport, self).connect(address)
+        self.device.attach(self.peer)
+
+    def close(self):
+        self.device.detach()
+        super(SimulatedTransport, self).close()
+
+
+if __name__ == "__main__":
+    # BENCHMARK OF THE SPHERO API AGAINST A SIMULATED DEVICE
+    from core import SpheroAPI
+
+    s1 = SpheroAPI(bt_name="Sphero-SIM", bt_addr="00:00:00:00:00:00", transport=SimulatedTransport())
+    s1.connect()
+
+    num_pings = 2000
+    t0 = time.time()
+    for _ in xrange(num_pings):
+        s1.ping()
+    print "ping: %.1f requests/sec" % (num_pings / (time.time() - t0))
+
+    received = []
+    s1.set_sensor_streaming_cb(received.append)
+    ssc = SensorStreamingConfig()
+    ssc.sample_rate = 400
+    ssc.stream_all()
+    s1.set_data_streaming(ssc)
+    time.sleep(5.0)
+    s1.stop_data_streaming()
+    print "streaming: %.1f packets/sec" % (len(received) / 5.0)
+
+    s1.disconnect()
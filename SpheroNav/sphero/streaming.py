@@ -1,4 +1,6 @@
 from collections import namedtuple
+import struct
+import numpy as np
 from sphero import response
 from error import SpheroError
 from constants import *
@@ -300,6 +302,131 @@ class Mask2(object):
         MaskUtil.print_mask(self.mask2, self.mask2_names)
 
 
+class StreamingLayout(object):
+    """
+    Decoder for the sensor data streamed with one streaming config, compiled by SensorStreamingConfig.compile().
+
+    Holds the names of the streamed values in the order they are received, the index of each value and
+    the struct that decodes a frame in one call.
+
+    A packet holds m frames of samples. All values are signed 16 bit integers in network byte order.
+    """
+    DTYPE = np.dtype('>i2')
+
+    def __init__(self, names, m=1, frame_interval=None):
+        """
+        :param names: The names of the streamed values, in the order they are received from the device
+        :type names: list
+        :param m: Number of frames in each packet
+        :type m: int
+        :param frame_interval: Seconds between the samples of two frames
+        :type frame_interval: float
+        """
+        super(StreamingLayout, self).__init__()
+        self.names = tuple(names)
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        self.m = max(m, 1)
+        self.frame_interval = frame_interval
+        self.struct = struct.Struct('!%dh' % len(self.names))
+        # Length of the body of a packet, the m frames and the checksum
+        self.packet_size = self.m * self.struct.size + 1
+
+        # Offset of the newest frame in the packet
+        self._last_frame_offset = (self.m - 1) * self.struct.size
+        # Age of each frame relative to the newest frame
+        self._frame_ages = np.arange(self.m - 1, -1, -1) * (frame_interval or 0.0)
+
+    def __len__(self):
+        return len(self.names)
+
+    def matches(self, data):
+        """
+        Checks if a received streaming packet has the length of a packet with this layout. Packets streamed
+        with another config, e.g. right after a new config is sent, can not be decoded with this layout
+        :param data: The body of the streaming packet
+        :rtype: bool
+        """
+        return len(data) == self.packet_size
+
+    def decode(self, data):
+        """
+        Decodes the values of the newest frame in a received streaming packet, see matches()
+        :param data: The body of the streaming packet
+        :return: The values, in the same order as the names
+        :rtype: tuple
+        """
+        return self.struct.unpack_from(data, self._last_frame_offset)
+
+    def decode_frames(self, data):
+        """
+        Decodes all frames of a received streaming packet, without copying the data
+        :param data: The body of the streaming packet
+        :return: Array of shape (m, number of values), one row for each frame from the oldest to the newest
+        :rtype: numpy.ndarray
+        """
+        return np.frombuffer(data, dtype=self.DTYPE, count=self.m * len(self.names)).reshape(self.m, len(self.names))
+
+    def frame_timestamps(self, timestamp):
+        """
+        Interpolates the sample time of each frame in a packet from the configured sample rate
+        :param timestamp: The time the packet was received, used as the time of the newest frame
+        :return: The timestamp of each frame from the oldest to the newest
+        :rtype: numpy.ndarray
+        """
+        return timestamp - self._frame_ages
+
+
+class SampleClock(object):
+    """
+    Times the frames of the streamed packets of one device.
+
+    The newest frame of a packet is timed one packet of samples after the newest frame of the previous
+    packet, at the sample interval of the layout. The time a packet is parsed is not used directly, since the
+    packets parsed from one received chunk of data get almost the same time. The clock is set to the
+    receive time of the packet when it has drifted more than max_drift from it, e.g. after lost packets or
+    when the layout changes. The timestamps never decrease.
+    """
+
+    max_drift = 0.1
+
+    def __init__(self):
+        super(SampleClock, self).__init__()
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets the previous frame, the next packet is timed from its receive time
+        """
+        self._last = None
+        self._layout = None
+        self.resyncs = 0
+
+    def stamp(self, layout, receive_time):
+        """
+        Times the frames of a received packet
+        :param layout: The layout the packet is decoded with
+        :type layout: StreamingLayout
+        :param receive_time: The time the packet was received
+        :type receive_time: float
+        :return: The timestamp of each frame from the oldest to the newest
+        :rtype: numpy.ndarray
+        """
+        newest = receive_time
+        if self._last is not None and layout is self._layout and layout.frame_interval:
+            expected = self._last + layout.m * layout.frame_interval
+            if abs(receive_time - expected) <= self.max_drift:
+                newest = expected
+            else:
+                self.resyncs += 1
+
+        timestamps = layout.frame_timestamps(newest)
+        if self._last is not None:
+            np.maximum(timestamps, self._last, out=timestamps)
+        self._last = timestamps[-1]
+        self._layout = layout
+        return timestamps
+
+
 class SensorStreamingConfig(Mask1, Mask2):
     """
     Class used to create a streaming config for the sphero device. It is used to specify which sensor data and the
@@ -309,9 +436,17 @@ class SensorStreamingConfig(Mask1, Mask2):
     STREAM_FOREVER = 0
     MAX_SAMPLE_RATE_SPHERO = 400
 
+    # Compiled layouts, by mask1 and mask2
+    _layouts = {}
+
+    # Mask bit of each streaming key
+    _mask1_bits = dict((name, bit) for bit, name in Mask1.mask1_names.iteritems())
+    _mask2_bits = dict((name, bit) for bit, name in Mask2.mask2_names.iteritems())
+
     def __init__(self):
         super(SensorStreamingConfig, self).__init__()
         self.n = 420
+        # Number of frames of samples sent in each packet
         self.m = 1
         self.num_packets = 0
 
@@ -320,9 +455,19 @@ class SensorStreamingConfig(Mask1, Mask2):
         """
         Returns the current number of samples set to be streamed per/sec from the device in this config
         :return: Samples/sec
-        :rtype: float or int
+        :rtype: float
+        """
+        if not self.n:
+            return 0.0
+        return float(self.MAX_SAMPLE_RATE_SPHERO) / self.n
+
+    @property
+    def packet_rate(self):
+        """
+        Returns the number of packets streamed per/sec from the device, each packet holds m samples
+        :rtype: float
         """
-        return ssc.MAX_SAMPLE_RATE_SPHERO / self.n
+        return self.sample_rate / max(self.m, 1)
 
     @sample_rate.setter
     def sample_rate(self, packets_sec):
@@ -353,6 +498,23 @@ class SensorStreamingConfig(Mask1, Mask2):
         Mask1.stream_none(self)
         Mask2.stream_none(self)
 
+    def stream_values(self, names, activate=True):
+        """
+        Activates streaming of single values
+        :param names: Streaming keys of the values, see the KEY_STRM constants
+        :type names: list
+        :raise SpheroError: If a value can not be streamed
+        """
+        for name in names:
+            if name in self._mask1_bits:
+                self.mask1 = self.mask1 | self._mask1_bits[name] if activate else \
+                    self.mask1 & ~self._mask1_bits[name]
+            elif name in self._mask2_bits:
+                self.mask2 = self.mask2 | self._mask2_bits[name] if activate else \
+                    self.mask2 & ~self._mask2_bits[name]
+            else:
+                raise SpheroError("Unknown streaming value: %s" % name)
+
     print_mask1 = Mask1.print_mask
     print_mask2 = Mask2.print_mask
 
@@ -372,6 +534,21 @@ class SensorStreamingConfig(Mask1, Mask2):
         """
         return Mask1.get_values(self) + Mask2.get_values(self)
 
+    def compile(self):
+        """
+        Compiles the decoder for the sensor data streamed with the current config. Layouts are cached, so
+        configs with the same masks, frames per packet and sample rate share the layout
+        :rtype: StreamingLayout
+        """
+        key = (self.mask1, self.mask2, self.m, self.n)
+        try:
+            return self._layouts[key]
+        except KeyError:
+            names = [name for name, is_activated in self.get_streaming_config() if is_activated]
+            frame_interval = 1.0 / self.sample_rate if self.n else None
+            layout = self._layouts[key] = StreamingLayout(names, self.m, frame_interval)
+            return layout
+
 
 class SensorBase(object):
     """
@@ -393,17 +570,30 @@ class SensorBase(object):
             except KeyError:
                 pass
 
+    def set_values(self, layout, values):
+        """
+        Helper method: Sets the data of the sensor from values decoded with a compiled streaming layout
+        :type layout: StreamingLayout
+        :param values: The decoded values
+        :type values: tuple
+        """
+        index = layout.index
+        for key in self._data:
+            i = index.get(key)
+            if i is not None:
+                self._data[key] = values[i]
+
 
 class Motor(SensorBase):
     """
     Holds motor data streamed from device
     """
+    _emf_raw_tuple = namedtuple("EmfRaw", "left, right")
+    _pwm_raw_tuple = namedtuple("PwmRaw", "left, right")
+    _emf_filtered_tuple = namedtuple("EmfFiltered", "left, right")
+
     def __init__(self):
         super(Motor, self).__init__()
-        self._emf_raw_tuple = namedtuple("EmfRaw", "left, right")
-        self._pwm_raw_tuple = namedtuple("PwmRaw", "left, right")
-        self._emf_filtered_tuple = namedtuple("EmfFiltered", "left, right")
-
         self._data = {
             KEY_STRM_EMF_RAW_LEFT_MOTOR: None,
             KEY_STRM_EMF_RAW_RIGHT_MOTOR: None,
@@ -475,10 +665,10 @@ class Quaternion(SensorBase):
     """
     Holds data for streamed quaternion position
     """
+    _quaternion_tuple = namedtuple("Quaternion", "q1 q2 q3 q4")
+
     def __init__(self):
         super(Quaternion, self).__init__()
-        self._quaternion_tuple = namedtuple("Quaternion", "q1 q2 q3 q4")
-
         self._data = {
             KEY_STRM_Q0: None,
             KEY_STRM_Q1: None,
@@ -518,10 +708,10 @@ class Velocity(SensorBase):
     """
     Holds data for Velocity data streamed from device
     """
+    _velocity_tuple = namedtuple("Velocity", "x, y, acc")
+
     def __init__(self):
         super(Velocity, self).__init__()
-        self._velocity_tuple = namedtuple("Velocity", "x, y, acc")
-
         self._data = {
             KEY_STRM_VELOCITY_X: None,
             KEY_STRM_VELOCITY_Y: None,
@@ -556,10 +746,10 @@ class Odometer(SensorBase):
     """
     Holds data streamed from spheros locator position
     """
+    _location_tuple = namedtuple("Odometer", "x, y")
+
     def __init__(self):
         super(Odometer, self).__init__()
-        self._location_tuple = namedtuple("Odometer", "x, y")
-
         self._data = {
             KEY_STRM_ODOMETER_X: None,
             KEY_STRM_ODOMETER_Y: None
@@ -589,10 +779,10 @@ class Odometer(SensorBase):
 
 
 class Imu(SensorBase):
+    _imu_tuple = namedtuple("IMU", "pitch roll yaw")
+
     def __init__(self):
         super(Imu, self).__init__()
-        self._imu_tuple = namedtuple("IMU", "pitch roll yaw")
-
         self._data = {
             KEY_STRM_IMU_PITCH_ANGLE: None,
             KEY_STRM_IMU_ROLL_ANGLE: None,
@@ -627,12 +817,12 @@ class Accelerometer(SensorBase):
     Holds a sample of streamed Accelerometer data
     """
 
+    _acc_tuple = namedtuple("AxisRaw", "x y z")
+    _acc_mg_tuple = namedtuple("AxisMilliG", "x y z")
+    _acc_filtered_tuple = namedtuple("AxisFilteredG", "x y z")
+
     def __init__(self):
         super(Accelerometer, self).__init__()
-        self._acc_tuple = namedtuple("AxisRaw", "x y z")
-        self._acc_mg_tuple = namedtuple("AxisMilliG", "x y z")
-        self._acc_filtered_tuple = namedtuple("AxisFilteredG", "x y z")
-
         self._data = {
             KEY_STRM_X_RAW: None,
             KEY_STRM_Y_RAW: None,
@@ -708,12 +898,12 @@ class Gyro(SensorBase):
     """
     Holds a sample of streamed Gyro data
     """
+    _gyro_raw_tuple = namedtuple("GyroRaw", "x y z")
+    _gyro_raw_degrees_tuple = namedtuple("GyroDegrees", "x y z")
+    _gyro_filtered_tuple = namedtuple("GyroDPS", "x y z")
+
     def __init__(self):
         super(Gyro, self).__init__()
-        self._gyro_raw_tuple = namedtuple("GyroRaw", "x y z")
-        self._gyro_raw_degrees_tuple = namedtuple("GyroDegrees", "x y z")
-        self._gyro_filtered_tuple = namedtuple("GyroDPS", "x y z")
-
         self._data = {
             KEY_STRM_GYRO_X_RAW: None,
             KEY_STRM_GYRO_Y_RAW: None,
@@ -777,54 +967,123 @@ class Gyro(SensorBase):
 
 
 class SensorStreamingResponse(response.AsyncMsg):
-    # TODO: Add docs for this class - 4/16/14
+    """
+    A packet of sensor data streamed from the device.
 
-    def __init__(self, header, data, ssc):
+    The packet is decoded in one call with the layout compiled from the streaming config. The sensor
+    classes (gyro, imu, ...) are created the first time they are accessed, and hold the newest frame when
+    the device sends several frames in each packet. All frames are available as an array from frames.
+    """
+    __slots__ = ('timestamp', 'ssc', 'layout', 'values', '_raw_sensor_data', '_sensors', '_frames', '_timestamps')
+
+    def __init__(self, header, data, ssc, layout=None):
+        """
+        :param ssc: The streaming config the data is streamed with
+        :type ssc: SensorStreamingConfig
+        :param layout: The compiled layout of the streaming config, compiled from ssc if not given
+        :type layout: StreamingLayout
+        """
         super(SensorStreamingResponse, self).__init__(header, data)
         self.timestamp = time.time()
-
-        self.raw_sensor_data = {}
         self.ssc = ssc
-        self.raw_sensor_data = self._parse_sensor_data(ssc)
+        self.layout = layout if layout is not None else ssc.compile()
+        self.values = self.layout.decode(data)
 
-        # SENSOR data holders
-        self.gyro = Gyro()
-        self.accelerometer = Accelerometer()
-        self.imu = Imu()
-        self.motor = Motor()
-        self.odometer = Odometer()
-        self.velocity = Velocity()
-        self.quaternion = Quaternion()
+        self._raw_sensor_data = None
+        self._sensors = {}
+        self._frames = None
+        self._timestamps = None
 
-        # Parse received sensor data
-        self._map_sensor_data(self.raw_sensor_data)
+    @property
+    def num_frames(self):
+        """
+        The number of frames of samples in the packet
+        :rtype: int
+        """
+        return self.layout.m
 
-    def _parse_sensor_data(self, ss_conf):
+    @property
+    def frames(self):
         """
-        Parse raw data from sphero into a dict where keys are DataName and Value is Sensor Data
-        :param ss_conf:
-        :return:
+        All frames of samples in the packet. Columns are ordered as layout.names
+        :return: Array of int16 values of shape (num_frames, number of values), from the oldest to the newest frame
+        :rtype: numpy.ndarray
         """
-        sensor_data = {}
+        if self._frames is None:
+            self._frames = self.layout.decode_frames(self.data)
+        return self._frames
 
-        streaming_config = ss_conf.get_streaming_config()
+    @property
+    def timestamps(self):
+        """
+        The time of each frame. Set by the SampleClock of the device, else interpolated back from the receive
+        time of the packet at the sample rate
+        :return: Timestamps from the oldest to the newest frame
+        :rtype: numpy.ndarray
+        """
+        if self._timestamps is None:
+            self._timestamps = self.layout.frame_timestamps(self.timestamp)
+        return self._timestamps
 
-        data_offset = 0
-        for sensor_name, is_activated in streaming_config:
-            if is_activated:
-                sensor_data[sensor_name] = self.body[data_offset]
-                data_offset += 1
-        return sensor_data
+    @timestamps.setter
+    def timestamps(self, timestamps):
+        self._timestamps = timestamps
 
-    def _map_sensor_data(self, sensor_data):
+    @property
+    def raw_sensor_data(self):
         """
-        Helper method: maps data to the correct classes
-        :param sensor_data:
-        :return:
+        The received sensor data as a dict where keys are DataName and Value is Sensor Data
+        :rtype: dict
         """
-        for key, value in self.__dict__.iteritems():
-            if isinstance(value, SensorBase):
-                value.set_data(sensor_data)
+        if self._raw_sensor_data is None:
+            self._raw_sensor_data = dict(zip(self.layout.names, self.values))
+        return self._raw_sensor_data
+
+    def _sensor(self, sensor_class):
+        """
+        Helper method: Returns the sensor of the given class, the sensor is created on first access
+        """
+        try:
+            return self._sensors[sensor_class]
+        except KeyError:
+            sensor = self._sensors[sensor_class] = sensor_class()
+            sensor.set_values(self.layout, self.values)
+            return sensor
+
+    @property
+    def gyro(self):
+        """:rtype: Gyro"""
+        return self._sensor(Gyro)
+
+    @property
+    def accelerometer(self):
+        """:rtype: Accelerometer"""
+        return self._sensor(Accelerometer)
+
+    @property
+    def imu(self):
+        """:rtype: Imu"""
+        return self._sensor(Imu)
+
+    @property
+    def motor(self):
+        """:rtype: Motor"""
+        return self._sensor(Motor)
+
+    @property
+    def odometer(self):
+        """:rtype: Odometer"""
+        return self._sensor(Odometer)
+
+    @property
+    def velocity(self):
+        """:rtype: Velocity"""
+        return self._sensor(Velocity)
+
+    @property
+    def quaternion(self):
+        """:rtype: Quaternion"""
+        return self._sensor(Quaternion)
 
     @property
     def fmt(self):
@@ -0,0 +1,205 @@
+# coding: utf-8
+"""
+Subscriptions to single values of the sensor data streamed from a Sphero device
+"""
+import operator
+import threading
+
+from dispatcher import EVENT_STREAMING
+from error import SpheroError
+from streaming import SensorStreamingConfig
+
+
+class StreamingSubscription(object):
+    """
+    A subscription to some of the streamed values, created by SpheroAPI.subscribe()
+    """
+
+    def __init__(self, keys, callback, max_rate=None):
+        """
+        :param keys: Streaming keys of the values, see the KEY_STRM constants
+        :type keys: list
+        :param callback: Called with the timestamp and a dict of the raw values of each delivered sample
+        :type callback: method or function
+        :param max_rate: Max number of samples delivered each second, all received samples if None
+        :type max_rate: float or None
+        """
+        super(StreamingSubscription, self).__init__()
+        if not keys:
+            raise SpheroError("A subscription needs at least one value")
+        if max_rate is not None and max_rate <= 0:
+            raise SpheroError("Max rate must be a number larger than 0")
+        self.keys = tuple(keys)
+        self.callback = callback
+        self.max_rate = max_rate
+
+        self.delivered = 0
+        self.decimated = 0
+
+        self._interval = 1.0 / max_rate if max_rate else 0.0
+        self._next_time = None
+        # Getter of the subscribed values from the decoded values, by layout
+        self._getters = {}
+
+    def _select(self, streaming_data):
+        """
+        Helper method: Returns the subscribed values of a packet, or None if the sample is decimated or
+        the values are not streamed
+        """
+        timestamp = streaming_data.timestamp
+        if self._next_time is not None and timestamp < self._next_time:
+            self.decimated += 1
+            return None
+
+        layout = streaming_data.layout
+        try:
+            getter = self._getters[layout]
+        except KeyError:
+            getter = self._getters[layout] = self._compile_getter(layout)
+        if getter is None:
+            return None
+
+        if self._interval:
+            next_time = (self._next_time or timestamp) + self._interval
+            self._next_time = next_time if next_time > timestamp else timestamp + self._interval
+        self.delivered += 1
+        return getter(streaming_data.values)
+
+    def _compile_getter(self, layout):
+        """
+        Helper method: Returns a function that picks the subscribed values out of the decoded values
+        """
+        try:
+            indexes = [layout.index[key] for key in self.keys]
+        except KeyError:
+            return None
+        if len(indexes) == 1:
+            index = indexes[0]
+            return lambda values: (values[index],)
+        return operator.itemgetter(*indexes)
+
+
+class SubscriptionManager(object):
+    """
+    Keeps the subscriptions of a device, and streams the values they subscribe to.
+
+    The streaming config of the device is the union of the subscribed values, at the highest max rate of
+    the subscriptions. The subscribed values are picked from the received packets on the receiver thread,
+    and the callbacks are run by the callback dispatcher of the device as streaming events, so a slow
+    callback does not delay the parsing of received data. Each subscription is the source of its own events,
+    so it has its own queue in the dispatcher, and a slow subscription never drops the samples of the
+    others or of the streaming callback of the device. Samples already queued when a subscription is
+    removed are still delivered.
+    """
+
+    default_rate = 50.0
+
+    def __init__(self, device):
+        """
+        :type device: sphero.SpheroAPI
+        """
+        super(SubscriptionManager, self).__init__()
+        self.device = device
+        self.subscriptions = ()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    def subscribe(self, keys, callback, max_rate=None, **options):
+        """
+        Adds a subscription and updates the streaming config of the device
+        :param options: Options for set_data_streaming
+        :rtype: StreamingSubscription
+        """
+        subscription, ssc = self.add(keys, callback, max_rate)
+        self.device.set_data_streaming(ssc, **options)
+        return subscription
+
+    def unsubscribe(self, subscription, **options):
+        """
+        Removes a subscription and updates the streaming config of the device. Streaming is stopped when
+        the last subscription is removed
+        :type subscription: StreamingSubscription
+        :param options: Options for set_data_streaming
+        """
+        ssc = self.remove(subscription)
+        if ssc is not None:
+            self.device.set_data_streaming(ssc, **options)
+
+    def add(self, keys, callback, max_rate=None):
+        """
+        Adds a subscription, without sending the new streaming config to the device
+        :return: The subscription and the streaming config for all subscriptions
+        :rtype: (StreamingSubscription, SensorStreamingConfig)
+        """
+        subscription = StreamingSubscription(keys, callback, max_rate)
+        with self._lock:
+            self.subscriptions += (subscription,)
+            return subscription, self.streaming_config()
+
+    def remove(self, subscription):
+        """
+        Removes a subscription, without sending the new streaming config to the device
+        :type subscription: StreamingSubscription
+        :return: The streaming config for the remaining subscriptions, or None if it was not subscribed
+        :rtype: SensorStreamingConfig or None
+        """
+        with self._lock:
+            if subscription not in self.subscriptions:
+                return None
+            self.subscriptions = tuple(s for s in self.subscriptions if s is not subscription)
+            return self.streaming_config()
+
+    def streaming_config(self):
+        """
+        Builds the streaming config for the current subscriptions. Without subscriptions it is the config
+        that stops streaming, as sent by SpheroAPI.stop_data_streaming
+        :rtype: SensorStreamingConfig
+        """
+        ssc = SensorStreamingConfig()
+        ssc.stream_none()
+        if not self.subscriptions:
+            return ssc
+        for subscription in self.subscriptions:
+            ssc.stream_values(subscription.keys)
+        rates = [subscription.max_rate for subscription in self.subscriptions if subscription.max_rate]
+        ssc.sample_rate = min(max(rates) if rates else self.default_rate, ssc.MAX_SAMPLE_RATE_SPHERO)
+        ssc.num_packets = ssc.STREAM_FOREVER
+        return ssc
+
+    def on_packet(self, streaming_data):
+        """
+        Dispatches the values of a received packet to the subscriptions, called on the receiver thread
+        :type streaming_data: sphero.streaming.SensorStreamingResponse
+        """
+        dispatcher = self.device.dispatcher
+        for subscription in self.subscriptions:
+            values = subscription._select(streaming_data)
+            if values is not None:
+                dispatcher.dispatch(EVENT_STREAMING, subscription.callback, streaming_data.timestamp,
+                                    dict(zip(subscription.keys, values)), source=subscription)
+
+
+if __name__ == "__main__":
+    # SUBSCRIBES TO VALUES OF A SIMULATED DEVICE
+    import time
+    from core import SpheroAPI
+    from constants import KEY_STRM_IMU_YAW_ANGLE, KEY_STRM_VELOCITY_X, KEY_STRM_VELOCITY_Y
+    from simulator import SimulatedTransport
+
+    def print_yaw(timestamp, values):
+        print "yaw:", values
+
+    def count_velocity(timestamp, values):
+        count_velocity.samples += 1
+    count_velocity.samples = 0
+
+    device = SpheroAPI("Sphero-SIM", "00:00:00:00:00:00", SimulatedTransport())
+    device.connect()
+    yaw_subscription = device.subscribe([KEY_STRM_IMU_YAW_ANGLE], print_yaw, max_rate=5)
+    device.subscribe([KEY_STRM_VELOCITY_X, KEY_STRM_VELOCITY_Y], count_velocity, max_rate=100)
+    time.sleep(1.0)
+    device.unsubscribe(yaw_subscription)
+    print "velocity samples:", count_velocity.samples, "yaw samples:", yaw_subscription.delivered
+    device.disconnect()
@@ -0,0 +1,280 @@
+# coding: utf-8
+"""
+Binary log of the sensor data streamed from a Sphero device.
+
+File format:
+    A header of HEADER_SIZE bytes with the streaming config of the recorded data, followed by one fixed
+    width record for each frame of samples. A record is the timestamp of the frame as a little endian
+    float64, followed by the values as big endian int16 in the order they are streamed from the device.
+"""
+import mmap
+import os
+import Queue
+import struct
+import threading
+
+import numpy as np
+
+from error import SpheroError
+from streaming import SensorStreamingConfig
+
+
+MAGIC = 'SPHTLM\x00\x01'
+VERSION = 1
+
+# magic, version, header size, mask1, mask2, n, m, number of values, device name
+_header = struct.Struct('<8sHHIIHHH32s6x')
+HEADER_SIZE = _header.size
+
+
+def record_dtype(num_values):
+    """
+    Returns the numpy type of the records in a log with the given number of values
+    :rtype: numpy.dtype
+    """
+    return np.dtype([('timestamp', '<f8'), ('values', '>i2', (num_values,))])
+
+
+class TelemetryRecorder(object):
+    """
+    Records streamed sensor data to a binary log file.
+
+    record() only queues the packet, so it is safe to call from the receiver thread. The header and the
+    records are written to the file from a background thread. Packets are dropped if the writer falls more than
+    max_queued packets behind.
+
+    The streaming config of the log is taken from the first recorded packet. Packets streamed with another
+    config are skipped, start a new recording when the streaming config is changed.
+
+    The records are written with timestamps that never decrease, TelemetryLog.window depends on it. A frame
+    older than the previous one gets the timestamp of the previous frame.
+    """
+
+    def __init__(self, path, device_name='', max_queued=10000):
+        """
+        :param path: The file to write the log to, an existing file is overwritten
+        :param device_name: The name of the recorded device, stored in the header
+        :param max_queued: Max number of packets waiting to be written
+        """
+        super(TelemetryRecorder, self).__init__()
+        self.path = path
+        self.device_name = device_name
+
+        self._file = open(path, 'wb')
+        self._queue = Queue.Queue(maxsize=max_queued)
+        self._layout = None
+        self._dtype = None
+        self._last_timestamp = -np.inf
+
+        self.frames_written = 0
+        self.packets_dropped = 0
+        self.packets_skipped = 0
+
+        self._closed = False
+        self._writer_thread = threading.Thread(target=self._writer, name="TelemetryWriterThread")
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
+
+    def record(self, streaming_data):
+        """
+        Queues a received streaming packet for writing
+        :type streaming_data: sphero.streaming.SensorStreamingResponse
+        """
+        if self._closed:
+            return
+        layout = streaming_data.layout
+        if self._layout is None:
+            self._layout = layout
+            self._dtype = record_dtype(len(layout))
+            # Written by the writer thread before the first packet, the receiver thread never writes the file
+            self._queue.put_nowait(self._header(layout, streaming_data.ssc))
+        elif layout.names != self._layout.names:
+            self.packets_skipped += 1
+            return
+
+        try:
+            self._queue.put_nowait((streaming_data.timestamps, streaming_data.layout, streaming_data.data))
+        except Queue.Full:
+            self.packets_dropped += 1
+
+    def close(self):
+        """
+        Writes all queued packets and closes the log file
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer_thread.join()
+        self._file.close()
+
+    def _header(self, layout, ssc):
+        """
+        Helper method: Packs the header of the log, queued before the first packet
+        :rtype: str
+        """
+        return _header.pack(MAGIC, VERSION, HEADER_SIZE, ssc.mask1, ssc.mask2, ssc.n, layout.m, len(layout),
+                            self.device_name[:32])
+
+    def _writer(self):
+        """
+        Helper method that writes the queued packets to the file, runs in the writer thread
+        """
+        while True:
+            items = [self._queue.get()]
+            # Write all packets that are waiting at once
+            try:
+                while len(items) < 1000:
+                    items.append(self._queue.get_nowait())
+            except Queue.Empty:
+                pass
+
+            closing = items[-1] is None
+            if closing:
+                items.pop()
+            if items and isinstance(items[0], str):
+                # The header, queued before the first packet
+                self._file.write(items.pop(0))
+            self._write_packets(items)
+            if closing:
+                self._file.flush()
+                return
+
+    def _write_packets(self, packets):
+        if not packets:
+            return
+        records = np.empty(sum(layout.m for _, layout, _ in packets), dtype=self._dtype)
+
+        i = 0
+        for timestamps, layout, data in packets:
+            records['timestamp'][i:i + layout.m] = timestamps
+            records['values'][i:i + layout.m] = layout.decode_frames(data)
+            i += layout.m
+        timestamps = records['timestamp']
+        np.maximum.accumulate(np.maximum(timestamps, self._last_timestamp), out=timestamps)
+        self._last_timestamp = timestamps[-1]
+        self._file.write(records.tostring())
+        self.frames_written += len(records)
+
+
+class TelemetryLog(object):
+    """
+    Reads a telemetry log file.
+
+    The file is memory mapped and exposed as a numpy structured array, so logs of any size open instantly
+    and are only read from disk when the records are accessed.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The log file
+        :raise SpheroError: If the file is not a telemetry log
+        """
+        super(TelemetryLog, self).__init__()
+        self.path = path
+        with open(path, 'rb') as log_file:
+            header = log_file.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE:
+                raise SpheroError("Not a telemetry log: %s" % path)
+            magic, version, header_size, mask1, mask2, n, m, num_values, device_name = _header.unpack(header)
+            if magic != MAGIC or version > VERSION:
+                raise SpheroError("Not a telemetry log, or unsupported version: %s" % path)
+
+            self.device_name = device_name.rstrip('\x00')
+            self.ssc = SensorStreamingConfig()
+            self.ssc.mask1 = mask1
+            self.ssc.mask2 = mask2
+            self.ssc.n = n
+            self.ssc.m = m
+            self.names = self.ssc.compile().names
+            if len(self.names) != num_values:
+                raise SpheroError("Corrupt telemetry log header: %s" % path)
+            self._index = dict((name, i) for i, name in enumerate(self.names))
+
+            self.dtype = record_dtype(num_values)
+            size = os.fstat(log_file.fileno()).st_size
+            num_records = (size - header_size) // self.dtype.itemsize
+            if num_records > 0:
+                self._map = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+                self.records = np.frombuffer(self._map, dtype=self.dtype, count=num_records, offset=header_size)
+            else:
+                self._map = None
+                self.records = np.empty(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, item):
+        return self.records[item]
+
+    @property
+    def timestamps(self):
+        """
+        :rtype: numpy.ndarray
+        """
+        return self.records['timestamp']
+
+    @property
+    def values(self):
+        """
+        The values of all records, of shape (records, number of values). Columns are ordered as names
+        :rtype: numpy.ndarray
+        """
+        return self.records['values']
+
+    def column(self, name):
+        """
+        Returns all recorded samples of one value
+        :param name: Streaming key of the value
+        :rtype: numpy.ndarray
+        """
+        return self.records['values'][:, self._index[name]]
+
+    def window(self, t0, t1):
+        """
+        Returns the records in the time range t0 <= timestamp <= t1
+        :rtype: numpy.ndarray
+        """
+        timestamps = self.timestamps
+        return self.records[timestamps.searchsorted(t0, side='left'):timestamps.searchsorted(t1, side='right')]
+
+    def close(self):
+        """
+        Closes the memory map of the file. Arrays from the log must not be used after the log is closed
+        """
+        self.records = np.empty(0, dtype=self.dtype)
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+if __name__ == "__main__":
+    # RECORDS A SIMULATED DEVICE AND READS THE LOG
+    import tempfile
+    import time
+    from core import SpheroAPI
+    from constants import KEY_STRM_GYRO_X
+    from simulator import SimulatedTransport
+
+    log_path = os.path.join(tempfile.gettempdir(), "sphero_telemetry.tlm")
+    device = SpheroAPI("Sphero-SIM", "00:00:00:00:00:00", SimulatedTransport())
+    device.connect()
+
+    streaming_config = SensorStreamingConfig()
+    streaming_config.sample_rate = 400
+    streaming_config.m = 4
+    streaming_config.stream_all()
+    device.set_data_streaming(streaming_config)
+
+    device.start_recording(log_path)
+    time.sleep(2.0)
+    recorder = device.stop_recording()
+    device.stop_data_streaming()
+    device.disconnect()
+    print "frames written:", recorder.frames_written, "dropped packets:", recorder.packets_dropped
+
+    log = TelemetryLog(log_path)
+    print "records:", len(log), "values:", len(log.names), "size:", os.path.getsize(log_path), "bytes"
+    print "gyro x:", log.column(KEY_STRM_GYRO_X)[:10]
+    print "last second:", len(log.window(log.timestamps[-1] - 1.0, log.timestamps[-1]))
+    log.close()
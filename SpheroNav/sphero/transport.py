@@ -0,0 +1,134 @@
+# coding: utf-8
+"""
+Transports used by the SpheroAPI to exchange raw data with a device
+"""
+import socket
+import bluetooth
+
+from error import SpheroError, SpheroConnectionError
+
+
+class Transport(object):
+    """
+    Base class for the connection between a SpheroAPI instance and a device.
+
+    A transport is select()-able through fileno() while connected.
+    """
+
+    def connect(self, address):
+        """
+        Opens the connection to the device
+        :param address: The address of the device
+        :type address: str
+        :raise SpheroConnectionError: If the connection could not be established
+        """
+        raise NotImplementedError
+
+    def send(self, data):
+        """
+        Sends raw data to the device
+        :param data: The data to send
+        :type data: str or bytearray
+        :raise SpheroConnectionError: If the data could not be sent
+        """
+        raise NotImplementedError
+
+    def recv(self, size):
+        """
+        Receives up to size bytes from the device. Returns an empty string if the connection is closed
+        :param size: Max number of bytes to receive
+        :type size: int
+        :rtype: str
+        :raise SpheroError: If the receive failed
+        """
+        raise NotImplementedError
+
+    def fileno(self):
+        """
+        :return: The file descriptor of the connection
+        :rtype: int
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Closes the connection to the device
+        """
+        raise NotImplementedError
+
+
+class RfcommTransport(Transport):
+    """
+    Bluetooth RFCOMM connection to a physical Sphero
+    """
+
+    PORT = 1
+
+    def __init__(self):
+        super(RfcommTransport, self).__init__()
+        self._socket = None
+
+    def connect(self, address):
+        self._socket = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
+        try:
+            self._socket.connect((address, self.PORT))
+        except bluetooth.btcommon.BluetoothError as e:
+            self.close()
+            raise SpheroConnectionError("Could not connect to device", e.message)
+
+    def send(self, data):
+        try:
+            self._socket.send(data)
+        except bluetooth.BluetoothError as e:
+            raise SpheroConnectionError("Could not send msg, device is not connected", e.message)
+
+    def recv(self, size):
+        try:
+            return self._socket.recv(size)
+        except bluetooth.BluetoothError as e:
+            raise SpheroError("Failed to receive data from device:" + e.message)
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+class LoopbackTransport(Transport):
+    """
+    Connection over a local socket pair. The other end of the pair is available as peer after connect,
+    and is used to act as the device.
+    """
+
+    def __init__(self):
+        super(LoopbackTransport, self).__init__()
+        self._socket = None
+        self.peer = None
+
+    def connect(self, address):
+        self._socket, self.peer = socket.socketpair()
+
+    def send(self, data):
+        try:
+            self._socket.sendall(data)
+        except (socket.error, AttributeError) as e:
+            raise SpheroConnectionError("Could not send msg, device is not connected", str(e))
+
+    def recv(self, size):
+        try:
+            return self._socket.recv(size)
+        except (socket.error, AttributeError) as e:
+            raise SpheroError("Failed to receive data from device:" + str(e))
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def close(self):
+        for sock in (self._socket, self.peer):
+            if sock is not None:
+                sock.close()
+        self._socket = None
+        self.peer = None
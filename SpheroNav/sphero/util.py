@@ -1,3 +1,8 @@
+import ctypes
+import ctypes.util
+import time
+
+
 
 def host_to_device_angle(host_angle):
     """
@@ -18,4 +23,43 @@ def device_to_host_angle(device_angle):
     :return: equal angle in host coordinates
     :rtype: float or int
     """
-    return (450.0 - device_angle) % 360
\ No newline at end of file
+    return (450.0 - device_angle) % 360
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _create_monotonic_clock():
+    """
+    Helper method that returns a clock function for the monotonic clock of the system, or time.time() if
+    the monotonic clock is not available
+    """
+    CLOCK_MONOTONIC = 1
+    try:
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1', use_errno=True)
+        clock_gettime = librt.clock_gettime
+    except (OSError, AttributeError):
+        return time.time
+
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+
+    def monotonic_clock():
+        t = _Timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+            return time.time()
+        return t.tv_sec + t.tv_nsec * 1e-9
+
+    return monotonic_clock
+
+
+_monotonic_clock = _create_monotonic_clock()
+
+
+def monotonic():
+    """
+    Returns the time of a clock that never goes backwards, in seconds. Only the difference between two calls
+    is meaningful. Falls back to time.time() if the system has no monotonic clock
+    :rtype: float
+    """
+    return _monotonic_clock()
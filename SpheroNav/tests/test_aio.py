@@ -0,0 +1,83 @@
+# coding: utf-8
+"""
+Tests of the asyncio driven Sphero API
+"""
+import threading
+import unittest
+
+import trollius as asyncio
+from trollius import From
+
+from sphero.aio import AsyncSpheroAPI
+from sphero.dispatcher import LoopDispatcher, DROP_OLDEST
+from sphero.simulator import SimulatedTransport
+from sphero.streaming import SensorStreamingConfig
+
+
+class LoopDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.dispatcher = LoopDispatcher(self.loop, max_queued=2)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_loop(self):
+        self.loop.run_until_complete(asyncio.sleep(0.01, loop=self.loop))
+
+    def test_callbacks_run_in_the_loop_in_order(self):
+        calls = []
+
+        def callback(value):
+            calls.append((value, threading.current_thread()))
+
+        thread = threading.Thread(target=self.dispatcher.dispatch, args=('event', callback, 1))
+        thread.start()
+        thread.join()
+        self.dispatcher.dispatch('event', callback, 2)
+        self.assertEqual(calls, [])
+        self.run_loop()
+        self.assertEqual(calls, [(1, threading.current_thread()), (2, threading.current_thread())])
+        self.assertEqual(self.dispatcher.stats()['callback']['called'], 2)
+        self.assertEqual(self.dispatcher.pending(), 0)
+
+    def test_overflow_policy(self):
+        calls = []
+        self.dispatcher.set_policy('event', DROP_OLDEST)
+        for value in xrange(5):
+            self.dispatcher.dispatch('event', calls.append, value)
+        self.run_loop()
+        self.assertEqual(calls, [3, 4])
+
+
+class AsyncCallbackTest(unittest.TestCase):
+
+    def test_streaming_callback_runs_in_the_loop(self):
+        loop = asyncio.get_event_loop()
+        device = AsyncSpheroAPI("Sphero-SIM", "00:00:00:00:00:00", SimulatedTransport(), loop=loop)
+        received = asyncio.Future(loop=loop)
+
+        def on_streaming(streaming_data):
+            if not received.done():
+                received.set_result(threading.current_thread())
+
+        @asyncio.coroutine
+        def run():
+            yield From(device.connect())
+            device.set_sensor_streaming_cb(on_streaming)
+            ssc = SensorStreamingConfig()
+            ssc.sample_rate = 50
+            ssc.stream_imu_angle()
+            yield From(device.set_data_streaming(ssc))
+            thread = yield From(asyncio.wait_for(received, 5.0, loop=loop))
+            yield From(device.stop_data_streaming())
+            device.disconnect()
+            self.assertIs(thread, threading.current_thread())
+
+        self.assertIsInstance(device.dispatcher, LoopDispatcher)
+        loop.run_until_complete(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
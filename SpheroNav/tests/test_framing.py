@@ -0,0 +1,109 @@
+# coding: utf-8
+"""
+Tests of the buffered frame parser
+"""
+import struct
+import unittest
+
+from sphero.framing import FrameParser
+
+
+def response_frame(mrsp, seq, body):
+    """
+    Builds a sync response frame with a valid checksum
+    """
+    frame = bytearray((0xFF, 0xFF, mrsp, seq, len(body) + 1)) + bytearray(body)
+    return str(frame + bytearray((~sum(frame[2:]) & 0xFF,)))
+
+
+def async_frame(id_code, body):
+    """
+    Builds an async message frame with a valid checksum
+    """
+    dlen = len(body) + 1
+    frame = bytearray((0xFF, 0xFE, id_code, dlen >> 8, dlen & 0xFF)) + bytearray(body)
+    return str(frame + bytearray((~sum(frame[2:]) & 0xFF,)))
+
+
+class FrameParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = FrameParser(size=64)
+
+    def test_response_frame(self):
+        frame = response_frame(0x00, 0x12, '\x01\x02')
+        self.parser.feed(frame)
+        header, body = self.parser.next_frame()
+        self.assertEqual(header, (0xFF, 0xFF, 0x00, 0x12, 3))
+        self.assertEqual(body, frame[5:])
+        self.assertIsNone(self.parser.next_frame())
+        self.assertEqual(len(self.parser), 0)
+
+    def test_async_frame_with_long_body(self):
+        body = struct.pack('!300B', *([7] * 300))
+        self.parser.feed(async_frame(0x03, body))
+        header, received = self.parser.next_frame()
+        self.assertEqual(header, (0xFF, 0xFE, 0x03, 301))
+        self.assertEqual(received[:-1], body)
+
+    def test_frame_split_across_feeds(self):
+        frame = response_frame(0x00, 0x01, '\x05\x06\x07')
+        for i in xrange(len(frame) - 1):
+            self.parser.feed(frame[i])
+            self.assertIsNone(self.parser.next_frame())
+        self.parser.feed(frame[-1])
+        self.assertEqual(self.parser.next_frame()[0][3], 0x01)
+
+    def test_several_frames_in_one_feed(self):
+        self.parser.feed(''.join(response_frame(0x00, seq, '\x00') for seq in xrange(5)))
+        self.assertEqual([header[3] for header, _ in self.parser.frames()], range(5))
+
+    def test_resync_discards_bytes_in_front_of_a_frame(self):
+        self.parser.feed('\x00\x13\x37' + response_frame(0x00, 0x02, ''))
+        header, _ = self.parser.next_frame()
+        self.assertEqual(header[3], 0x02)
+        self.assertEqual(self.parser.discarded_bytes, 3)
+        self.assertEqual(self.parser.resyncs, 1)
+
+    def test_resync_on_start_of_packet_without_valid_second_byte(self):
+        self.parser.feed('\xff\x00' + response_frame(0x00, 0x03, '\x01'))
+        header, _ = self.parser.next_frame()
+        self.assertEqual(header[3], 0x03)
+        self.assertEqual(self.parser.discarded_bytes, 2)
+
+    def test_wrong_checksum_is_dropped_and_counted(self):
+        broken = bytearray(response_frame(0x00, 0x04, '\x01\x02'))
+        broken[-1] ^= 0xFF
+        self.parser.feed(str(broken) + response_frame(0x00, 0x05, '\x03'))
+        header, _ = self.parser.next_frame()
+        self.assertEqual(header[3], 0x05)
+        self.assertEqual(self.parser.checksum_errors, 1)
+        self.assertEqual(self.parser.discarded_bytes, len(broken))
+        self.assertIsNone(self.parser.next_frame())
+
+    def test_wrong_checksum_is_kept_without_verification(self):
+        self.parser.verify_checksums = False
+        broken = bytearray(response_frame(0x00, 0x04, '\x01'))
+        broken[-1] ^= 0xFF
+        self.parser.feed(str(broken))
+        self.assertEqual(self.parser.next_frame()[0][3], 0x04)
+        self.assertEqual(self.parser.checksum_errors, 0)
+
+    def test_buffer_is_reused_and_grown(self):
+        frame = response_frame(0x00, 0x06, '\x00' * 10)
+        for _ in xrange(20):
+            self.parser.feed(frame)
+            self.assertEqual(self.parser.next_frame()[0][3], 0x06)
+        self.parser.feed(frame * 10)
+        self.assertEqual(len(list(self.parser.frames())), 10)
+
+    def test_reset_drops_buffered_data(self):
+        self.parser.feed(response_frame(0x00, 0x07, '\x01')[:4])
+        self.parser.reset()
+        self.assertEqual(len(self.parser), 0)
+        self.parser.feed(response_frame(0x00, 0x08, '\x01'))
+        self.assertEqual(self.parser.next_frame()[0][3], 0x08)
+
+
+if __name__ == '__main__':
+    unittest.main()
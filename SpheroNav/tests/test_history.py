@@ -0,0 +1,56 @@
+# coding: utf-8
+"""
+Tests of the sensor history ring buffer
+"""
+import unittest
+
+import numpy as np
+
+from sphero.history import SensorHistory
+
+
+def frames(*values):
+    return np.array([(value, -value) for value in values], dtype=np.int16)
+
+
+class SensorHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.history = SensorHistory(capacity=8, names=('a', 'b'))
+
+    def test_latest_and_wrap_around(self):
+        self.history.extend(np.arange(10, dtype=np.float64), frames(*range(10)))
+        times, values = self.history.latest(3)
+        self.assertEqual(times.tolist(), [7.0, 8.0, 9.0])
+        self.assertEqual(values[:, 0].tolist(), [7, 8, 9])
+        self.assertEqual(len(self.history), 8)
+
+    def test_window(self):
+        self.history.extend(np.arange(6, dtype=np.float64), frames(*range(6)))
+        times, values = self.history.window(1.5, 4.0)
+        self.assertEqual(times.tolist(), [2.0, 3.0, 4.0])
+        self.assertEqual(values[:, 1].tolist(), [-2, -3, -4])
+
+    def test_at_interpolates(self):
+        self.history.extend(np.array([1.0, 2.0]), frames(10, 20))
+        self.assertEqual(self.history.at(1.25).tolist(), [12.5, -12.5])
+        self.assertEqual(self.history.at(0.0).tolist(), [10.0, -10.0])
+        self.assertEqual(self.history.at(5.0).tolist(), [20.0, -20.0])
+
+    def test_timestamps_are_kept_sorted(self):
+        self.history.extend(np.array([1.0, 2.0, 3.0]), frames(1, 2, 3))
+        self.history.extend(np.array([2.5, 4.0, 3.5]), frames(4, 5, 6))
+        times, _ = self.history.latest(8)
+        self.assertEqual(times.tolist(), [1.0, 2.0, 3.0, 3.0, 4.0, 4.0])
+        self.assertEqual(self.history.clamped, 2)
+        self.assertEqual(self.history.window(3.0, 3.0)[1][:, 0].tolist(), [3, 4])
+
+    def test_extend_does_not_change_the_given_timestamps(self):
+        self.history.append(5.0, (1, 1))
+        timestamps = np.array([4.0])
+        self.history.extend(timestamps, frames(2))
+        self.assertEqual(timestamps.tolist(), [4.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# coding: utf-8
+"""
+Tests of the reconnect after a lost connection, against the simulated Sphero device
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from sphero import request
+from sphero.capture import WireCapture
+from sphero.core import SpheroAPI
+from sphero.error import SpheroTimeoutError
+from sphero.simulator import SimulatedSphero, SimulatedTransport
+
+
+class ReconnectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = SimulatedSphero()
+        self.transport = SimulatedTransport(self.sim)
+        self.device = SpheroAPI("Sphero-SIM", "00:00:00:00:00:00", self.transport)
+        self.device.auto_reconnect = True
+        self.device.reconnect_delay = 0.01
+        self.device.connect()
+
+    def tearDown(self):
+        self.device.disconnect()
+
+    def drop_connection(self):
+        """
+        Closes the link from the device end, like a device that is turned off and on
+        """
+        self.sim.detach()
+        self.transport.peer.close()
+
+    def wait_reconnected(self, reconnects=1, timeout=5.0):
+        end = time.time() + timeout
+        while self.device.reconnect_stats.reconnects < reconnects:
+            self.assertLess(time.time(), end, "Not connected again")
+            time.sleep(0.01)
+
+    def test_settings_are_replayed(self):
+        self.device.set_rgb(0x10, 0x20, 0x30)
+        self.device.set_back_led_output(0x80)
+        # The device lost its settings while it was off
+        self.sim.rgb = (0xFF, 0xFF, 0xFF)
+        self.sim.back_led = 0x00
+
+        self.drop_connection()
+        self.wait_reconnected()
+        self.assertEqual(self.sim.rgb, (0x10, 0x20, 0x30))
+        self.assertEqual(self.sim.back_led, 0x80)
+        self.assertEqual(self.device.reconnect_stats.drops, 1)
+        self.assertEqual(self.device.reconnect_stats.replay_failures, 0)
+        self.assertTrue(self.device.ping().success)
+
+    def test_queued_requests_are_sent_when_connected_again(self):
+        self.sim.latency = 0.2
+        futures = [self.device.send_async(request.Ping(self.device.seq)) for _ in xrange(20)]
+        queued = self.device._scheduler.queued
+        self.assertGreater(queued, 0)
+
+        self.drop_connection()
+        for future in futures:
+            future.wait(10)
+        lost = [future for future in futures if isinstance(future.exception(), SpheroTimeoutError)]
+        self.assertEqual(len(lost), len(futures) - queued)
+        self.assertTrue(all(future.result().success for future in futures if future not in lost))
+
+    def test_capture_is_kept_across_reconnects(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'capture.cap')
+            self.device.disconnect()
+            self.device.connect(capture=path)
+            self.device.ping()
+            self.drop_connection()
+            self.wait_reconnected()
+            self.device.ping()
+            self.device.disconnect()
+
+            ping = (request.Ping.did, request.Ping.cid)
+            pings = [data for _, data in WireCapture(path).sent() if (ord(data[2]), ord(data[3])) == ping]
+            self.assertEqual(len(pings), 2)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_blocking_request_is_sent_again(self):
+        self.sim.latency = 0.3
+        self.device.rtt.reset()
+
+        def drop_later():
+            time.sleep(0.1)
+            self.drop_connection()
+
+        threading.Thread(target=drop_later).start()
+        self.assertTrue(self.device.get_power_state().success)
+        self.wait_reconnected()
+        self.assertEqual(self.device.retries['GetPowerState'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# coding: utf-8
+"""
+Tests of the precompiled request encoders
+"""
+import struct
+import unittest
+
+from sphero import request
+
+
+def struct_encoding(packet):
+    """
+    The packet as encoded with struct before the encoders were precompiled
+    """
+    data = struct.pack('6B', *packet.header())
+    if packet.data:
+        data += struct.pack(packet.fmt, *packet.data)
+    values = struct.unpack('%dB' % len(data), data)
+    return data + struct.pack('B', ~(sum(values[2:]) % 256) & 0xFF)
+
+
+class RequestEncoderTest(unittest.TestCase):
+
+    REQUESTS = [
+        (request.Ping, ()),
+        (request.GetPowerState, ()),
+        (request.SetRGB, (0x10, 0x20, 0x30, 0x00)),
+        (request.SetBackLEDOutput, (0xFF,)),
+        (request.Roll, (0x80, 359, 0x01)),
+        (request.SetHeading, (270,)),
+        (request.SetDataStreaming, (10, 1, 0xC0000000, 0, 0x01800000)),
+        (request.ConfigureLocator, (0x01, -100, 200, -300)),
+        (request.SetOptionFlags, (-1,)),
+        (request.SetMotionTimeout, (5000,)),
+        (request.SetDeviceName, tuple(bytearray('Sphero-ABC'))),
+    ]
+
+    def test_same_bytes_as_struct_encoding(self):
+        for request_class, data in self.REQUESTS:
+            for seq in (0x00, 0x01, 0x7F, 0xFF):
+                packet = request_class(seq, *data)
+                self.assertEqual(packet.bytes, struct_encoding(packet), request_class.__name__)
+
+    def test_encoders_are_shared_by_payload_format(self):
+        self.assertIs(request.SetRGB.encoder('4B'), request.SetRGB.encoder('4B'))
+        self.assertIsNot(request.SetRGB.encoder('4B'), request.SetBackLEDOutput.encoder('4B'))
+
+    def test_no_answer_clears_the_answer_bit(self):
+        packet = request.Roll(0x05, 0x40, 90, 0x01)
+        answered = packet.bytes
+        packet.answer = False
+        unanswered = packet.bytes
+        self.assertEqual(ord(unanswered[1]), 0xFE)
+        # The start of packet bytes are not covered by the checksum
+        self.assertEqual(unanswered[2:], answered[2:])
+        self.assertEqual(unanswered, struct_encoding(packet))
+
+    def test_encode_returns_a_new_packet(self):
+        packet = request.Ping(0x01)
+        first = packet.encode()
+        first[4] = 0x00
+        self.assertEqual(packet.encode()[4], 0x01)
+
+
+if __name__ == '__main__':
+    unittest.main()
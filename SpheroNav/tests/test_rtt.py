@@ -0,0 +1,109 @@
+# coding: utf-8
+"""
+Tests of the round trip time estimation
+"""
+import time
+import unittest
+
+from sphero import request
+from sphero.core import SpheroAPI
+from sphero.future import ResponseFuture
+from sphero.rtt import RttEstimator
+from sphero.simulator import SimulatedSphero, SimulatedTransport
+
+
+class RttEstimatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rtt = RttEstimator(initial_rto=3.0, min_rto=0.1, max_rto=10.0)
+
+    def test_initial_timeout(self):
+        self.assertEqual(self.rtt.rto, 3.0)
+        self.assertIsNone(self.rtt.srtt)
+
+    def test_first_sample(self):
+        self.rtt.sample(0.2)
+        self.assertAlmostEqual(self.rtt.srtt, 0.2)
+        self.assertAlmostEqual(self.rtt.rttvar, 0.1)
+        self.assertAlmostEqual(self.rtt.rto, 0.2 + 4 * 0.1)
+
+    def test_smoothing(self):
+        self.rtt.sample(0.2)
+        self.rtt.sample(0.6)
+        rttvar = 0.75 * 0.1 + 0.25 * 0.4
+        srtt = 0.875 * 0.2 + 0.125 * 0.6
+        self.assertAlmostEqual(self.rtt.rttvar, rttvar)
+        self.assertAlmostEqual(self.rtt.srtt, srtt)
+        self.assertAlmostEqual(self.rtt.rto, srtt + 4 * rttvar)
+        self.assertEqual(self.rtt.samples, 2)
+        self.assertEqual(self.rtt.last_rtt, 0.6)
+
+    def test_converges_to_a_steady_round_trip_time(self):
+        for _ in xrange(200):
+            self.rtt.sample(0.05)
+        self.assertAlmostEqual(self.rtt.srtt, 0.05)
+        self.assertAlmostEqual(self.rtt.rto, 0.1, places=3)
+
+    def test_timeout_is_clamped(self):
+        self.rtt.sample(0.001)
+        self.assertEqual(self.rtt.rto, 0.1)
+        self.rtt.sample(20.0)
+        self.assertEqual(self.rtt.rto, 10.0)
+
+    def test_backoff_doubles_until_the_next_sample(self):
+        self.rtt.sample(0.2)
+        self.rtt.backoff()
+        self.assertAlmostEqual(self.rtt.rto, 1.2)
+        for _ in xrange(10):
+            self.rtt.backoff()
+        self.assertEqual(self.rtt.rto, 10.0)
+        self.assertEqual(self.rtt.timeouts, 11)
+
+        self.rtt.sample(0.2)
+        self.assertLess(self.rtt.rto, 1.0)
+
+    def test_reset(self):
+        self.rtt.sample(0.2)
+        self.rtt.backoff()
+        self.rtt.reset()
+        self.assertEqual(self.rtt.rto, 3.0)
+        self.assertEqual(self.rtt.as_dict(), {'srtt': None, 'rttvar': None, 'rto': 3.0, 'samples': 0,
+                                              'timeouts': 0})
+
+
+
+class AdaptiveTimeoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = SimulatedSphero()
+        self.device = SpheroAPI("Sphero-SIM", "00:00:00:00:00:00", SimulatedTransport(self.sim))
+        self.device.connect()
+        for _ in xrange(20):
+            self.device.ping()
+
+    def tearDown(self):
+        self.device.disconnect()
+
+    def test_timeout_follows_the_round_trip_time(self):
+        self.assertEqual(self.device.timeout, self.device.rtt.min_rto)
+        self.assertEqual(self.device._timeout_for(request.Ping(0)), self.device.timeout)
+
+    def test_requests_not_sent_again_wait_longer(self):
+        timeout = self.device._timeout_for(request.SetStabilization(0, 1))
+        self.assertGreaterEqual(timeout, self.device.min_single_attempt_timeout)
+
+        self.sim.latency = 1.5
+        start = time.time()
+        self.assertTrue(self.device.set_stabilization(True).success)
+        self.assertGreater(time.time() - start, 1.5)
+
+    def test_request_not_yet_sent_is_not_expired(self):
+        future = ResponseFuture(request.Ping(self.device.seq))
+        self.device._register_pending(future)
+        self.device._expire_pending()
+        self.assertFalse(future.done())
+        self.device._pop_pending(future.seq, future)
+
+
+if __name__ == '__main__':
+    unittest.main()
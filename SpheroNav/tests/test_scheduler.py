@@ -0,0 +1,179 @@
+# coding: utf-8
+"""
+Tests of the outbound command scheduler
+"""
+import threading
+import time
+import unittest
+
+from sphero import request
+from sphero.error import SpheroCancelledError, SpheroConnectionError, SpheroDeadlineError, SpheroTimeoutError
+from sphero.future import ResponseFuture
+from sphero.metrics import DeadlineStats
+from sphero.scheduler import CommandScheduler
+
+
+class FakeDevice(object):
+    """
+    Records the sent requests, the send window is open while window_open is set
+    """
+
+    def __init__(self):
+        self.window_open = False
+        self.sent = []
+        self.senders = set()
+        self.deadline_stats = DeadlineStats()
+
+    def _can_transmit(self):
+        return self.window_open
+
+    def _register_pending(self, future):
+        pass
+
+    def _transmit(self, packet, future):
+        self.sent.append(packet)
+        self.senders.add(threading.current_thread().name)
+
+
+class CommandSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.device = FakeDevice()
+        self.scheduler = CommandScheduler(self.device)
+
+    def submit(self, packet, coalesce=False):
+        future = ResponseFuture(packet)
+        self.scheduler.submit(packet, future, coalesce)
+        return future
+
+    def open_window(self):
+        self.device.window_open = True
+        self.scheduler.pump()
+
+    def wait_sent(self, count, timeout=1.0):
+        end = time.time() + timeout
+        while len(self.device.sent) < count and time.time() < end:
+            time.sleep(0.001)
+
+    def test_sent_directly_when_the_window_is_open(self):
+        self.device.window_open = True
+        self.submit(request.Ping(1))
+        self.assertEqual([packet.seq for packet in self.device.sent], [1])
+        self.assertEqual(self.scheduler.queued, 0)
+
+    def test_lanes_are_drained_by_priority(self):
+        self.submit(request.GetPowerState(1))
+        self.submit(request.SetRGB(2, 1, 2, 3, 0))
+        self.submit(request.Roll(3, 0x40, 0, 1))
+        self.submit(request.Roll(4, 0x40, 90, 1))
+        self.assertEqual(self.scheduler.lane_depth(request.LANE_MOTION), 2)
+        self.assertEqual(self.scheduler.lane_depth(request.LANE_TELEMETRY), 1)
+
+        self.open_window()
+        self.assertEqual([packet.seq for packet in self.device.sent], [3, 4, 2, 1])
+        self.assertEqual(self.scheduler.stats()['motion']['sent'], 2)
+        self.assertEqual(self.scheduler.lane_depth(request.LANE_MOTION), 0)
+
+    def test_starved_lane_is_sent_first(self):
+        self.scheduler.max_wait = 0.01
+        self.submit(request.GetPowerState(1))
+        time.sleep(0.02)
+        self.submit(request.Roll(2, 0x40, 0, 1))
+        self.open_window()
+        self.assertEqual([packet.seq for packet in self.device.sent], [1, 2])
+
+    def test_coalesced_requests_replace_the_unsent_request(self):
+        futures = [self.submit(request.Roll(seq, 0x40, seq, 1), coalesce=True) for seq in xrange(3)]
+        self.assertEqual(self.scheduler.queued, 1)
+        self.assertEqual(self.scheduler.superseded, 2)
+        for future in futures[:2]:
+            self.assertIsInstance(future.exception(0), SpheroCancelledError)
+
+        self.open_window()
+        self.assertEqual([packet.seq for packet in self.device.sent], [2])
+        self.assertFalse(futures[2].done())
+
+    def test_requests_are_not_coalesced_unless_asked(self):
+        for seq in xrange(3):
+            self.submit(request.Roll(seq, 0x40, seq, 1))
+        self.open_window()
+        self.assertEqual(len(self.device.sent), 3)
+
+    def test_coalesced_requests_are_clocked_by_acknowledgements(self):
+        self.device.window_open = True
+        first = self.submit(request.Roll(1, 0x40, 0, 1), coalesce=True)
+        self.submit(request.Roll(2, 0x40, 10, 1), coalesce=True)
+        self.submit(request.Roll(3, 0x40, 20, 1), coalesce=True)
+        # Other requests pass the waiting coalesced request
+        self.submit(request.Ping(4))
+        self.assertEqual([packet.seq for packet in self.device.sent], [1, 4])
+
+        first.set_result(None)
+        self.wait_sent(3)
+        self.assertEqual([packet.seq for packet in self.device.sent], [1, 4, 3])
+
+    def test_response_wakes_the_sender_thread(self):
+        self.device.window_open = True
+        first = self.submit(request.Roll(1, 0x40, 0, 1), coalesce=True)
+        self.submit(request.Roll(2, 0x40, 10, 1), coalesce=True)
+        receiver = threading.Thread(target=first.set_result, args=(None,), name="SpheroReceiverThread")
+        receiver.start()
+        receiver.join()
+        self.wait_sent(2)
+        self.assertEqual([packet.seq for packet in self.device.sent], [1, 2])
+        self.assertNotIn("SpheroReceiverThread", self.device.senders)
+        self.assertIn("SpheroSenderThread", self.device.senders)
+
+    def test_sender_thread_stops_when_idle(self):
+        self.scheduler.sender_idle_timeout = 0.01
+        self.submit(request.Ping(1))
+        self.scheduler.wake()
+        self.device.window_open = True
+        self.scheduler.wake()
+        self.wait_sent(1)
+        end = time.time() + 1.0
+        while self.scheduler._sender is not None and time.time() < end:
+            time.sleep(0.005)
+        self.assertIsNone(self.scheduler._sender)
+
+    def test_request_past_its_deadline_is_dropped(self):
+        late = ResponseFuture(request.Ping(1))
+        late.deadline = time.time() - 1
+        self.scheduler.submit(late.request, late)
+        in_time = ResponseFuture(request.Ping(2))
+        in_time.deadline = time.time() + 10
+        self.scheduler.submit(in_time.request, in_time)
+
+        self.open_window()
+        self.assertEqual([packet.seq for packet in self.device.sent], [2])
+        self.assertIsInstance(late.exception(0), SpheroDeadlineError)
+        self.assertEqual(self.device.deadline_stats.dropped['Ping'], 1)
+
+    def test_cancelled_request_is_not_sent(self):
+        future = self.submit(request.Ping(1))
+        future.set_exception(SpheroTimeoutError('Given up'))
+        self.open_window()
+        self.assertEqual(self.device.sent, [])
+
+    def test_expire_fails_requests_queued_too_long(self):
+        future = self.submit(request.Ping(1))
+        self.scheduler.expire(10)
+        self.assertFalse(future.done())
+        self.scheduler.expire(-1)
+        self.assertIsInstance(future.exception(0), SpheroTimeoutError)
+        self.assertEqual(self.scheduler.queued, 0)
+
+    def test_clear_fails_all_queued_requests(self):
+        futures = [self.submit(request.Ping(seq)) for seq in xrange(3)]
+        futures.append(self.submit(request.Roll(3, 0x40, 0, 1), coalesce=True))
+        error = SpheroConnectionError('Device is not connected')
+        self.scheduler.clear(error)
+        self.assertEqual(self.scheduler.queued, 0)
+        for future in futures:
+            self.assertIs(future.exception(0), error)
+        self.open_window()
+        self.assertEqual(self.device.sent, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# coding: utf-8
+"""
+Tests of the client side device shadow
+"""
+import unittest
+
+import trollius as asyncio
+from trollius import From
+
+from sphero import request
+from sphero.aio import AsyncSpheroAPI
+from sphero.core import SpheroAPI
+from sphero.shadow import DeviceShadow
+from sphero.simulator import SimulatedSphero, SimulatedTransport
+
+
+class DeviceShadowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shadow = DeviceShadow()
+
+    def write(self, seq, *data):
+        packet = request.SetRGB(seq, *data)
+        self.shadow.invalidate(packet)
+        return packet
+
+    def test_answered_request_is_stored(self):
+        packet = self.write(1, 1, 2, 3, 0)
+        self.assertFalse(self.shadow.matches(packet))
+        self.shadow.update(packet)
+        self.assertTrue(self.shadow.matches(request.SetRGB(2, 1, 2, 3, 0)))
+        self.assertFalse(self.shadow.matches(request.SetRGB(2, 1, 2, 4, 0)))
+
+    def test_answer_to_an_older_request_is_not_stored(self):
+        older = self.write(1, 0xFF, 0, 0, 0)
+        newer = self.write(2, 0, 0, 0xFF, 0)
+        self.shadow.update(older)
+        self.assertIsNone(self.shadow.get(request.SetRGB))
+        self.shadow.update(newer)
+        self.assertEqual(self.shadow.get(request.SetRGB), newer.data)
+
+    def test_requests_that_are_not_shadowed(self):
+        packet = request.Roll(1, 0x40, 0, 1)
+        self.shadow.invalidate(packet)
+        self.shadow.update(packet)
+        self.assertEqual(len(self.shadow), 0)
+
+    def test_raw_motor_values_invalidate_the_stabilization(self):
+        stabilization = request.SetStabilization(1, 1)
+        self.shadow.invalidate(stabilization)
+        self.shadow.update(stabilization)
+        self.shadow.invalidate(request.SetRawMotorValues(2, 1, 0x80, 1, 0x80))
+        self.assertIsNone(self.shadow.get(request.SetStabilization))
+
+    def test_sleep_clears_the_shadow(self):
+        self.shadow.update(self.write(1, 1, 2, 3, 0))
+        self.shadow.invalidate(request.Sleep(2, 0, 0, 0))
+        self.assertEqual(len(self.shadow), 0)
+
+    def test_clear(self):
+        self.shadow.update(self.write(1, 1, 2, 3, 0))
+        self.shadow.clear()
+        self.assertEqual(self.shadow.items(), [])
+
+
+class ShadowedDeviceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = SimulatedSphero(latency=0.05)
+        self.device = SpheroAPI("Sphero-SIM", "00:00:00:00:00:00", SimulatedTransport(self.sim))
+        self.device.connect()
+
+    def tearDown(self):
+        self.device.disconnect()
+
+    def test_redundant_write_is_answered_from_the_shadow(self):
+        self.device.set_rgb(0xFF, 0, 0)
+        received = self.sim.requests_received
+        self.assertTrue(self.device.set_rgb(0xFF, 0, 0).success)
+        self.assertEqual(self.sim.requests_received, received)
+        self.assertEqual(self.device.shadow.suppressed, 1)
+        self.device.set_rgb(0xFF, 0, 0, force=True)
+        self.assertEqual(self.sim.requests_received, received + 1)
+
+    def test_stabilization_can_be_turned_on_after_raw_motor_values(self):
+        self.device.set_stabilization(True)
+        self.device.set_raw_motor_values(1, 0x40, 1, 0x40)
+        self.device.set_stabilization(True)
+        self.assertEqual(self.device.shadow.suppressed, 0)
+
+    def test_overlapping_writes(self):
+        first = self.device.set_rgb(0xFF, 0, 0, block=False)
+        self.device.set_rgb(0, 0, 0xFF, block=False)
+        first.result()
+        self.device.set_rgb(0xFF, 0, 0)
+        self.assertEqual(self.sim.rgb, (0xFF, 0, 0))
+        self.assertEqual(self.device.shadow.suppressed, 0)
+
+
+
+class AsyncShadowTest(unittest.TestCase):
+
+    def test_shadow_is_cleared_on_disconnect(self):
+        device = AsyncSpheroAPI("Sphero-SIM", "00:00:00:00:00:00", SimulatedTransport())
+
+        @asyncio.coroutine
+        def run():
+            yield From(device.connect())
+            yield From(device.set_rgb(0xFF, 0, 0))
+            self.assertEqual(len(device.shadow), 1)
+            device.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(run())
+        self.assertEqual(len(device.shadow), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# coding: utf-8
+"""
+Tests of the compiled streaming layouts
+"""
+import struct
+import unittest
+
+from sphero import streaming
+from sphero.streaming import SampleClock, SensorStreamingConfig, SensorStreamingResponse, StreamingLayout
+
+
+def packet(frames):
+    """
+    Builds the body of a streaming packet, the frames and a checksum byte
+    """
+    values = [value for frame in frames for value in frame]
+    return struct.pack('!%dh' % len(values), *values) + '\x00'
+
+
+class StreamingLayoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.layout = StreamingLayout(['a', 'b', 'c'], m=2, frame_interval=0.01)
+
+    def test_packet_size_includes_the_checksum(self):
+        self.assertEqual(self.layout.packet_size, 2 * 3 * 2 + 1)
+        self.assertEqual(StreamingLayout(['a']).packet_size, 3)
+
+    def test_decode_returns_the_newest_frame(self):
+        self.assertEqual(self.layout.decode(packet([(1, 2, 3), (-4, 5, -32768)])), (-4, 5, -32768))
+
+    def test_decode_frames(self):
+        frames = self.layout.decode_frames(packet([(1, 2, 3), (4, 5, 6)]))
+        self.assertEqual(frames.shape, (2, 3))
+        self.assertEqual(frames.tolist(), [[1, 2, 3], [4, 5, 6]])
+
+    def test_frame_timestamps(self):
+        self.assertEqual(self.layout.frame_timestamps(10.0).tolist(), [9.99, 10.0])
+
+    def test_matches_only_packets_of_the_layout_length(self):
+        self.assertTrue(self.layout.matches(packet([(1, 2, 3), (4, 5, 6)])))
+        self.assertFalse(self.layout.matches(packet([(1, 2, 3)])))
+        self.assertFalse(self.layout.matches(packet([(1, 2, 3, 4), (5, 6, 7, 8)])))
+        self.assertFalse(self.layout.matches(''))
+
+    def test_short_packet_can_not_be_decoded(self):
+        self.assertRaises(struct.error, self.layout.decode, packet([(1, 2, 3)]))
+
+
+class SampleClockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = SampleClock()
+        self.layout = StreamingLayout(['a'], m=4, frame_interval=0.0025)
+
+    def assertIncreasing(self, timestamps):
+        steps = [b - a for a, b in zip(timestamps, timestamps[1:])]
+        self.assertTrue(all(step > 0 for step in steps), steps)
+
+    def test_first_packet_is_timed_from_the_receive_time(self):
+        self.assertAlmostEqual(self.clock.stamp(self.layout, 10.0)[-1], 10.0)
+
+    def test_packets_parsed_together_do_not_overlap(self):
+        timestamps = []
+        # Two chunks of three packets, each chunk parsed at the same time
+        for receive_time in (10.0, 10.0, 10.0, 10.03, 10.03, 10.03):
+            timestamps.extend(self.clock.stamp(self.layout, receive_time))
+        self.assertIncreasing(timestamps)
+        self.assertAlmostEqual(timestamps[-1] - timestamps[0], 23 * 0.0025)
+        self.assertEqual(self.clock.resyncs, 0)
+
+    def test_resync_after_drift(self):
+        self.clock.stamp(self.layout, 10.0)
+        # Packets were lost
+        self.assertAlmostEqual(self.clock.stamp(self.layout, 11.0)[-1], 11.0)
+        self.assertEqual(self.clock.resyncs, 1)
+
+    def test_timestamps_never_decrease(self):
+        last = self.clock.stamp(self.layout, 10.0)[-1]
+        timestamps = self.clock.stamp(StreamingLayout(['a', 'b'], m=4, frame_interval=0.0025), 10.001)
+        self.assertTrue(all(timestamp >= last for timestamp in timestamps))
+
+
+class SensorStreamingConfigTest(unittest.TestCase):
+
+    def test_compile_follows_the_masks(self):
+        ssc = SensorStreamingConfig()
+        ssc.stream_imu_angle()
+        layout = ssc.compile()
+        self.assertEqual(set(layout.names), {streaming.KEY_STRM_IMU_PITCH_ANGLE, streaming.KEY_STRM_IMU_ROLL_ANGLE,
+                                             streaming.KEY_STRM_IMU_YAW_ANGLE})
+        self.assertIs(ssc.compile(), layout)
+
+        ssc.stream_velocity()
+        self.assertEqual(len(ssc.compile()), 5)
+
+    def test_response_decodes_with_the_layout(self):
+        ssc = SensorStreamingConfig()
+        ssc.stream_imu_angle()
+        layout = ssc.compile()
+        values = range(len(layout))
+        data = SensorStreamingResponse((0xFF, 0xFE, 0x03, layout.packet_size), packet([values]), ssc, layout)
+        self.assertEqual(data.values, tuple(values))
+        self.assertEqual(data.num_frames, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# coding: utf-8
+"""
+Tests of the subscriptions to streamed sensor values
+"""
+import struct
+import threading
+import time
+import unittest
+
+from sphero.dispatcher import CallbackDispatcher
+from sphero.streaming import SensorStreamingConfig, SensorStreamingResponse
+from sphero.subscription import SubscriptionManager
+
+
+class FakeDevice(object):
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+
+
+class SubscriptionManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = CallbackDispatcher(workers=2, max_queued=1)
+        self.manager = SubscriptionManager(FakeDevice(self.dispatcher))
+        self.ssc = SensorStreamingConfig()
+        self.ssc.stream_imu_angle()
+        self.layout = self.ssc.compile()
+
+    def tearDown(self):
+        self.dispatcher.stop()
+
+    def packet(self, value):
+        values = [value] * len(self.layout)
+        body = struct.pack('!%dh' % len(values), *values) + '\x00'
+        return SensorStreamingResponse((0xFF, 0xFE, 0x03, len(body)), body, self.ssc, self.layout)
+
+    def test_config_without_subscriptions_stops_streaming(self):
+        subscription, ssc = self.manager.add(self.layout.names[:1], lambda *args: None)
+        self.assertTrue(ssc.mask1 or ssc.mask2)
+        ssc = self.manager.remove(subscription)
+
+        stop_ssc = SensorStreamingConfig()
+        stop_ssc.stream_none()
+        self.assertEqual((ssc.n, ssc.m, ssc.mask1, ssc.num_packets, ssc.mask2),
+                         (stop_ssc.n, stop_ssc.m, stop_ssc.mask1, stop_ssc.num_packets, stop_ssc.mask2))
+
+    def test_slow_subscription_does_not_drop_samples_of_the_others(self):
+        release = threading.Event()
+        received = []
+        self.manager.add(self.layout.names[:1], lambda timestamp, values: release.wait(5))
+        self.manager.add(self.layout.names[1:2], lambda timestamp, values: received.append(values))
+        for value in xrange(5):
+            self.manager.on_packet(self.packet(value))
+            time.sleep(0.02)
+        release.set()
+        self.dispatcher.wait(5)
+        self.assertEqual([values.values()[0] for values in received], range(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
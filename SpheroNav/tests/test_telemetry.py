@@ -0,0 +1,86 @@
+# coding: utf-8
+"""
+Tests of the binary telemetry log
+"""
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from sphero.streaming import SensorStreamingConfig, SensorStreamingResponse
+from sphero.telemetry import TelemetryLog, TelemetryRecorder
+
+
+class TelemetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'log.bin')
+        self.ssc = SensorStreamingConfig()
+        self.ssc.sample_rate = 100
+        self.ssc.m = 2
+        self.ssc.stream_imu_angle()
+        self.layout = self.ssc.compile()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def packet(self, timestamps, value):
+        values = [value] * (self.layout.m * len(self.layout))
+        body = struct.pack('!%dh' % len(values), *values) + '\x00'
+        streaming_data = SensorStreamingResponse((0xFF, 0xFE, 0x03, len(body)), body, self.ssc, self.layout)
+        streaming_data.timestamps = np.array(timestamps)
+        return streaming_data
+
+    def record(self, packets):
+        recorder = TelemetryRecorder(self.path, 'Sphero-SIM')
+        for streaming_data in packets:
+            recorder.record(streaming_data)
+        recorder.close()
+        return TelemetryLog(self.path)
+
+    def test_records_are_read_back(self):
+        log = self.record([self.packet([1.0, 1.01], 1), self.packet([1.02, 1.03], 2)])
+        self.assertEqual(log.device_name, 'Sphero-SIM')
+        self.assertEqual(len(log), 4)
+        self.assertEqual(log.timestamps.tolist(), [1.0, 1.01, 1.02, 1.03])
+        self.assertEqual(log.column(self.layout.names[0]).tolist(), [1, 1, 2, 2])
+        self.assertEqual(len(log.window(1.005, 1.025)), 2)
+        log.close()
+
+    def test_file_is_only_written_by_the_writer_thread(self):
+        recorder = TelemetryRecorder(self.path)
+        writers = set()
+
+        class File(object):
+            def __init__(self, log_file):
+                self.log_file = log_file
+
+            def write(self, data):
+                writers.add(threading.current_thread().name)
+                self.log_file.write(data)
+
+            def flush(self):
+                self.log_file.flush()
+
+            def close(self):
+                self.log_file.close()
+
+        recorder._file = File(recorder._file)
+        recorder.record(self.packet([1.0, 1.01], 1))
+        recorder.close()
+        self.assertEqual(writers, {'TelemetryWriterThread'})
+
+    def test_timestamps_never_decrease(self):
+        log = self.record([self.packet([1.0, 1.01], 1), self.packet([1.005, 1.02], 2)])
+        self.assertEqual(log.timestamps.tolist(), [1.0, 1.01, 1.01, 1.02])
+        self.assertEqual(len(log.window(1.01, 1.01)), 2)
+        log.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import struct
+import timeit
+
+from sphero import request
+
+
+def legacy_encode(packet):
+    """
+    The encoding used before the encoders were precompiled, kept for comparison
+    """
+    header = struct.pack('6B', *packet.header())
+    body = struct.pack(packet.fmt, *packet.data) if packet.data else ''
+    data = header + body
+    values = struct.unpack('%sB' % len(data), data)
+    return data + struct.pack('B', ~(sum(values[2:]) % 256) & 0xFF)
+
+
+def run(name, packet, number=100000):
+    legacy = min(timeit.repeat(lambda: legacy_encode(packet), number=number, repeat=3))
+    compiled = min(timeit.repeat(packet.encode, number=number, repeat=3))
+    print "%-20s legacy: %8.0f pack/sec  compiled: %8.0f pack/sec  speedup: %.2fx" % (
+        name, number / legacy, number / compiled, legacy / compiled)
+
+
+if __name__ == "__main__":
+    run("Ping", request.Ping(0x01))
+    run("Roll", request.Roll(0x02, 128, 270, 1))
+    run("SetRGB", request.SetRGB(0x03, 255, 0, 128, 0))
+    run("SetDataStreaming", request.SetDataStreaming(0x04, 40, 1, 0xFFFFFFFF, 0, 0x00800000))
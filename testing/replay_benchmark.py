@@ -0,0 +1,83 @@
+import os
+import sys
+import tempfile
+import time
+
+import sphero
+from sphero.capture import WireCapture, ReplayTransport
+from sphero.framing import FrameParser
+from sphero.response import AsyncMsg
+
+
+def record_capture(path, seconds=3.0):
+    """
+    Records a capture of a simulated device streaming all sensors
+    """
+    device = sphero.SpheroAPI("Sphero-SIM", "00:00:00:00:00:00", sphero.SimulatedTransport())
+    device.connect(capture=path)
+
+    ssc = sphero.SensorStreamingConfig()
+    ssc.sample_rate = 400
+    ssc.stream_all()
+    device.set_data_streaming(ssc)
+    for _ in xrange(int(seconds * 10)):
+        device.ping()
+        time.sleep(0.1)
+    device.stop_data_streaming()
+    device.disconnect()
+
+
+def count_streaming_packets(capture):
+    parser = FrameParser()
+    count = 0
+    for _, data in capture.received():
+        parser.feed(data)
+        for header, _ in parser.frames():
+            if AsyncMsg.is_async_msg(header) and AsyncMsg.is_sensor_streaming_package(header):
+                count += 1
+    return count
+
+
+def replay(capture, speed=None, timeout=30.0):
+    expected = count_streaming_packets(capture)
+    received = []
+
+    transport = ReplayTransport(capture, speed=speed)
+    device = sphero.SpheroAPI("Replay", "replay", transport)
+    device.connect()
+    ssc = capture.streaming_config()
+    device.use_streaming_config(ssc)
+    device.set_sensor_streaming_cb(received.append)
+
+    def decoded():
+        # The callback may not see every packet, the dispatcher drops the oldest when it falls behind
+        return device.streaming_stats.received + device.mismatched_streaming_packets
+
+    start = time.time()
+    give_up = start + timeout
+    transport.start()
+    transport.wait(timeout)
+    while decoded() < expected and time.time() < give_up:
+        time.sleep(0.0001)
+    time_used = time.time() - start
+    device.dispatcher.wait(max(0.0, give_up - time.time()))
+    dropped = sum(stats['dropped'] for stats in device.dispatcher.stats().itervalues())
+    device.disconnect()
+
+    print "replayed %d bytes, %d of %d streaming packets of %d values in %.3f sec" % (
+        transport.bytes_delivered, decoded(), expected, len(ssc.compile()), time_used)
+    print "%.0f bytes/sec, %.0f packets/sec (captured at %.0f packets/sec)" % (
+        transport.bytes_delivered / time_used, decoded() / time_used, expected / capture.duration)
+    print "callback: %d packets, %d dropped by the dispatcher, %d did not match the layout" % (
+        len(received), dropped, device.mismatched_streaming_packets)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        capture_path = sys.argv[1]
+    else:
+        capture_path = os.path.join(tempfile.gettempdir(), "sphero_capture.cap")
+        print "recording capture of a simulated device to", capture_path
+        record_capture(capture_path)
+
+    replay(WireCapture(capture_path))